@@ -369,6 +369,7 @@ def register():
 
     # Register atexit function to shutdown simulation queue before quitting Blender
     atexit.register(simulation_queue.shutdown)
+    atexit.register(cellblender_mol_viz.shutdown_frame_cache)
 
     # Molecule Labels
     bpy.types.WindowManager.display_mol_labels = bpy.props.PointerProperty(type=cellblender_molecules.MCELL_MolLabelProps)
@@ -401,6 +402,8 @@ def unregister():
     remove_handler ( bpy.app.handlers.load_post, cellblender_simulation.disable_python )
 
     atexit.unregister(simulation_queue.shutdown)
+    atexit.unregister(cellblender_mol_viz.shutdown_frame_cache)
+    cellblender_mol_viz.shutdown_frame_cache()
 
     bpy.utils.unregister_module(__name__)
 
@@ -36,19 +36,22 @@ from bpy.props import BoolProperty, CollectionProperty, EnumProperty, \
 #import mathutils
 
 # python imports
+import bmesh
 import mathutils
-import array
 import glob
 import os
-import random
 import re
-import json
+import hashlib
+import time
+import subprocess
 
 # CellBlender imports
 import cellblender
 from . import parameter_system
 from . import cellblender_release
 from . import cellblender_utils
+from . import mol_viz_data
+from . import mol_viz_cache
 
 from cellblender.cellblender_utils import timeline_view_all
 from cellblender.cellblender_utils import mcell_files_path
@@ -60,6 +63,7 @@ def register():
 
 
 def unregister():
+    shutdown_frame_cache()
     bpy.utils.unregister_module(__name__)
 
 
@@ -68,6 +72,21 @@ def unregister():
 
 global_mol_file_list = []
 
+# Decoded frames are cached (and prefetched) here. See get_frame_cache().
+global_frame_cache = None
+global_last_mol_file_index = None
+
+# What was last seen for recently viewed sweep points and seeds, so switching
+# back to one doesn't touch the filesystem (cleared by a full Read Viz Data):
+#   (files path, sweep choices) -> (top level viz directory, seed names)
+#   mol_file_dir -> [frame file names, (filepath, skip, clip, mol_dict) of the last frame shown]
+global_sweep_states = mol_viz_cache.StateCache(16)
+global_seed_states = mol_viz_cache.StateCache(8)
+
+# Follow mode holds back the newest frame file until its size stops changing
+# (it may still be being written). See follow_mol_viz_files().
+global_follow_pending = None
+
 
 def create_color_list():
     """ Create a list of colors to be assigned to the glyphs. """
@@ -114,6 +133,8 @@ def assemble_mat(obj1, obj2):
 @persistent
 def read_viz_data_load_post(context):
     print ( "load post handler: cellblender_mol_viz.read_viz_data_load_post() called" )
+    # The new file's mol_viz_list may even live at the address of the old one
+    global_mol_viz_species.invalidate()
     bpy.ops.mcell.read_viz_data()
 
 
@@ -146,7 +167,7 @@ def viz_data_save_post(context):
 # temporary until we make importing viz data automatic.
 def read_viz_data_callback(self, context):
     # print ( "read_viz_data_callback" )
-    bpy.ops.mcell.read_viz_data()
+    bpy.ops.mcell.read_viz_data(use_cache=True)
 
 
 class MCELL_OT_update_data_layout(bpy.types.Operator):
@@ -168,9 +189,17 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
     bl_description = "Load the molecule visualization data into Blender"
     bl_options = {'REGISTER'}
 
+    use_cache = BoolProperty(
+        name="Use Cached State", default=False,
+        description="Reuse what was found the last time this sweep point and seed were viewed")
+
     def execute(self, context):
         global global_mol_file_list
 
+        if not self.use_cache:
+            global_sweep_states.clear()
+            global_seed_states.clear()
+
         # Called when the molecule files are actually to be read (when the
         # "Read Molecule Files" button is pushed or a seed value is selected
         # from the list)
@@ -193,15 +222,19 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
           #  mol_file_dir comes from directory associated with saved .blend file
           mol_viz_top_level_dir = None
           files_path = mcell_files_path()  # This will be the full path from "/"
+          sweep_key = (files_path, tuple([(choice.name, choice.get('enum_choice', 0)) for choice in choices_list]))
+          sweep_state = global_sweep_states.get(sweep_key)
 
           # Check to see if the data is in an output_data directory or not
 
-          if os.path.exists(files_path) and 'output_data' in os.listdir(files_path):
+          if sweep_state is not None:
+            # This sweep point was viewed recently
+            mol_viz_top_level_dir = sweep_state[0]
+
+          elif os.path.exists(files_path) and 'output_data' in os.listdir(files_path):
             # New "output_data" layout
             # Read the viz data from the first data path in the potential sweep
-            f = open ( os.path.join(files_path,"data_layout.json"), 'r' )
-            layout_spec = json.loads ( f.read() )
-            f.close()
+            layout_spec = mol_viz_cache.directory_listings.data_layout(files_path)
             data_layout = layout_spec['data_layout']
             sub_path = ""
             for level in data_layout:
@@ -232,20 +265,26 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
 
           mol_viz_top_level_dir = os.path.relpath(mol_viz_top_level_dir)
 
-          mol_viz_seed_list = glob.glob(os.path.join(mol_viz_top_level_dir, "*"))
-          mol_viz_seed_list.sort()
+          if sweep_state is not None:
+              mol_viz_seed_list = sweep_state[1]
+          else:
+              mol_viz_seed_list = []
+              if os.path.isdir(mol_viz_top_level_dir):
+                  mol_viz_seed_list = mol_viz_cache.directory_listings.seed_dirs(mol_viz_top_level_dir)
+              global_sweep_states.put(sweep_key, (mol_viz_top_level_dir, mol_viz_seed_list))
 
-          # Clear the list of seeds (e.g. seed_00001, seed_00002, etc) and the
-          # list of files (e.g. my_project.cellbin.0001.dat,
-          # my_project.cellbin.0002.dat)
-          mol_viz.mol_viz_seed_list.clear()
+          if [item.name for item in mol_viz.mol_viz_seed_list] != mol_viz_seed_list:
+              # Clear the list of seeds (e.g. seed_00001, seed_00002, etc) and the
+              # list of files (e.g. my_project.cellbin.0001.dat,
+              # my_project.cellbin.0002.dat)
+              mol_viz.mol_viz_seed_list.clear()
 
 
-          # Add all the seed directories to the mol_viz_seed_list collection
-          # (seed_00001, seed_00002, etc)
-          for mol_viz_seed in mol_viz_seed_list:
-              new_item = mol_viz.mol_viz_seed_list.add()
-              new_item.name = os.path.basename(mol_viz_seed)
+              # Add all the seed directories to the mol_viz_seed_list collection
+              # (seed_00001, seed_00002, etc)
+              for mol_viz_seed in mol_viz_seed_list:
+                  new_item = mol_viz.mol_viz_seed_list.add()
+                  new_item.name = os.path.basename(mol_viz_seed)
 
           if mol_viz.mol_viz_seed_list:
               # If you previously had some viz data loaded, but reran the
@@ -266,11 +305,18 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
         global_mol_file_list = []
         mol_file_list = []
 
+        seed_state = None
         if mol_file_dir != '':
-          mol_file_list = [ f for f in glob.glob(os.path.join(mol_file_dir, "*")) if not f.endswith(os.sep + "viz_bngl") ]
+          seed_state = global_seed_states.get(mol_file_dir)
+          if seed_state is not None:
+            # This seed was viewed recently
+            mol_file_list = seed_state[0]
+          else:
+            mol_file_list = list_mol_viz_files(mol_file_dir)
+            global_seed_states.put(mol_file_dir, [mol_file_list, None])
           print ( "Read found " + str(len(mol_file_list)) + " files" )
-          print ( "Last file is " + mol_file_list[len(mol_file_list)-1] )
-          mol_file_list.sort()
+          if mol_file_list:
+            print ( "Last file is " + mol_file_list[len(mol_file_list)-1] )
 
         if mol_file_list:
           # Add all the viz_data files to global_mol_file_list (e.g.
@@ -278,7 +324,11 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
           for mol_file_name in mol_file_list:
 #              new_item = mol_viz.mol_file_list.add()
 #              new_item.name = os.path.basename(mol_file_name)
-              global_mol_file_list.append(os.path.basename(mol_file_name))
+              global_mol_file_list.append(mol_file_name)
+
+          if mol_viz.load_visible_only and (seed_state is None) and not (os.sep in global_mol_file_list[0]):
+              # Build (or bring up to date) the species index for this seed
+              mol_viz_cache.get_species_index(mol_file_dir).update(global_mol_file_list)
 
           # If you previously had some viz data loaded, but reran the
           # simulation with less iterations, you can receive an index error.
@@ -303,7 +353,8 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
             mol_viz.mol_file_index = 0
 
           try:
-              mol_viz_clear(mcell, force_clear=True)
+              # Switching to a recently viewed seed updates the molecule objects in place
+              mol_viz_clear(mcell, force_clear=(seed_state is None))
               mol_viz_update(self, context)
           except:
               print( "Unexpected Exception calling mol_viz_update: " + str(sys.exc_info()) )
@@ -312,6 +363,162 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
 
 
 
+def list_mol_viz_files(mol_file_dir):
+    """ Return the names of the viz files in a seed directory in frame order.
+
+    The files are ordered by frame number (whatever their zero padding) and
+    the directory scan is cached until the directory changes (see
+    mol_viz_cache.DirectoryListingCache). When the directory holds a frame
+    pack (see mol_viz_pack.py) its frames are used instead, named
+    "<pack file>/<original file name>".
+    """
+    if not os.path.isdir(mol_file_dir):
+        return []
+    return list(mol_viz_cache.directory_listings.frame_files(mol_file_dir).values())
+
+
+class MCELL_OT_pack_viz_data(bpy.types.Operator):
+    bl_idname = "mcell.pack_viz_data"
+    bl_label = "Pack Viz Data"
+    bl_description = "Pack the viz files of each seed into a single file (runs in the background)"
+    bl_options = {'REGISTER'}
+
+    remove_files = BoolProperty(
+        name="Remove Packed Files", default=False,
+        description="Delete the individual viz files once they have been packed")
+
+    def execute(self, context):
+        mcell = context.scene.mcell
+        mol_file_dir = mcell.mol_viz.mol_file_dir
+        if mol_file_dir == '':
+            self.report({'ERROR'}, "No viz data has been read")
+            return {'CANCELLED'}
+
+        python_path = cellblender_utils.get_python_path(mcell=mcell)
+        if python_path is None:
+            self.report({'ERROR'}, "Unable to find a Python to run the packer")
+            return {'CANCELLED'}
+
+        # Pack all of the seeds next to the current one
+        seeds_dir = mol_file_dir
+        if not mcell.mol_viz.manual_select_viz_dir:
+            seeds_dir = os.path.dirname(os.path.abspath(mol_file_dir))
+        script_file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mol_viz_pack.py")
+        args = [python_path, script_file_path]
+        if self.remove_files:
+            args.append("-remove")
+        args.append(seeds_dir)
+        print ( "Packing viz data with: " + " ".join(args) )
+        subprocess.Popen(args, stdout=None, stderr=None)
+        self.report({'INFO'}, "Packing viz data in " + seeds_dir + " (read the viz data again when done)")
+        return {'FINISHED'}
+
+
+def density_volume_paths(mol_viz):
+    """ Return (seeds directory, analysis directory) for the density volume of the current viz data. """
+    seeds_dir = os.path.abspath(mol_viz.mol_file_dir)
+    if not mol_viz.manual_select_viz_dir:
+        seeds_dir = os.path.dirname(seeds_dir)
+    return (seeds_dir, os.path.join(os.path.dirname(seeds_dir), "viz_analysis"))
+
+
+class MCELL_OT_build_density_volume(bpy.types.Operator):
+    bl_idname = "mcell.build_density_volume"
+    bl_label = "Build Density"
+    bl_description = "Accumulate the density of a molecule over all seeds into a volume file (runs in the background)"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        mcell = context.scene.mcell
+        mol_viz = mcell.mol_viz
+        if mol_viz.mol_file_dir == '':
+            self.report({'ERROR'}, "No viz data has been read")
+            return {'CANCELLED'}
+        if mol_viz.density_mol_name == '':
+            self.report({'ERROR'}, "Choose a molecule to build the density of")
+            return {'CANCELLED'}
+
+        python_path = cellblender_utils.get_python_path(mcell=mcell)
+        if python_path is None:
+            self.report({'ERROR'}, "Unable to find a Python to run the density builder")
+            return {'CANCELLED'}
+
+        seeds_dir, out_dir = density_volume_paths(mol_viz)
+        script_file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mol_viz_analysis.py")
+        args = [python_path, script_file_path,
+                "-density=" + mol_viz.density_mol_name, "-bins=%d" % (mol_viz.density_bins), "-out=" + out_dir]
+        if mol_viz.density_use_frames:
+            args.append("-frames=%d:%d" % (mol_viz.density_frame_start, mol_viz.density_frame_stop))
+        args.append(seeds_dir)
+        print ( "Building density volume with: " + " ".join(args) )
+        subprocess.Popen(args, stdout=None, stderr=None)
+        self.report({'INFO'}, "Building the density of " + mol_viz.density_mol_name + " (show it when done)")
+        return {'FINISHED'}
+
+
+class MCELL_OT_show_density_volume(bpy.types.Operator):
+    bl_idname = "mcell.show_density_volume"
+    bl_label = "Show Density"
+    bl_description = "Show the density volume built for a molecule as a volume object"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        import numpy
+
+        mol_viz = context.scene.mcell.mol_viz
+        mol_name = mol_viz.density_mol_name
+        if not mol_name.startswith("mol_"):
+            mol_name = "mol_" + mol_name
+        out_path = os.path.join(density_volume_paths(mol_viz)[1], "density_" + mol_name[4:])
+        if not (os.path.exists(out_path + ".bvox") and os.path.exists(out_path + ".npz")):
+            self.report({'ERROR'}, "No density volume has been built for " + mol_name)
+            return {'CANCELLED'}
+        with numpy.load(out_path + ".npz") as volume:
+            lo = volume["lo"].tolist()
+            hi = volume["hi"].tolist()
+
+        # A box over the bounds of the volume, so the texture's generated coordinates span the grid
+        name = "%s_density" % (mol_name)
+        verts = [(x, y, z) for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])]
+        faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+        obj = bpy.data.objects.get(name)
+        if obj is None:
+            mesh = bpy.data.meshes.new(name)
+            obj = bpy.data.objects.new(name, mesh)
+            context.scene.objects.link(obj)
+        else:
+            mesh = obj.data
+            bm = bmesh.new()
+            bm.to_mesh(mesh)
+            bm.free()
+        mesh.from_pydata(verts, [], faces)
+        mesh.update()
+
+        tex = bpy.data.textures.get(name)
+        if tex is None:
+            tex = bpy.data.textures.new(name, type='VOXEL_DATA')
+        tex.voxel_data.file_format = 'BLENDER_VOXEL'
+        tex.voxel_data.extension = 'CLIP'
+        tex.voxel_data.filepath = out_path + ".bvox"
+
+        mat = bpy.data.materials.get(name)
+        if mat is None:
+            mat = bpy.data.materials.new(name)
+            mat.type = 'VOLUME'
+            mat.volume.density = 0.0
+            slot = mat.texture_slots.add()
+            slot.texture = tex
+            slot.texture_coords = 'ORCO'
+            slot.use_map_density = True
+            slot.use_map_emission = True
+            mol_mat = bpy.data.materials.get("%s_mat" % (mol_name))
+            if mol_mat is not None:
+                mat.volume.emission_color = mol_mat.diffuse_color
+        if not mesh.materials.get(name):
+            mesh.materials.append(mat)
+        return {'FINISHED'}
+
+
 # Mol Viz callback functions
 
 
@@ -348,6 +555,53 @@ def set_viz_boundaries( context ):
         """
 
 
+def follow_mol_viz_files(context, final=False):
+    """ Append frames a running simulation has written since the last read.
+
+    Called from the simulation progress timers when "Follow Running Simulation"
+    is on. The directory listing is cached until the seed directory changes,
+    so polling an unchanged directory costs one stat. The newest file is only
+    added once it has stopped growing (or a later file exists, or final is
+    set because the simulation is done).
+    """
+    global global_mol_file_list
+    global global_follow_pending
+
+    mv = context.scene.mcell.mol_viz
+    if (not mv.follow_enable) or (mv.mol_file_dir == '') or (not os.path.isdir(mv.mol_file_dir)):
+        return
+    mol_file_list = list_mol_viz_files(mv.mol_file_dir)
+    num_old = len(global_mol_file_list)
+    if (len(mol_file_list) <= num_old) or (mol_file_list[:num_old] != global_mol_file_list):
+        # Nothing new (or the directory was rewritten, which needs a full Read)
+        return
+
+    new_files = mol_file_list[num_old:]
+    if not final:
+        newest = new_files[-1]
+        stamp = mol_viz_data.file_stamp(os.path.join(mv.mol_file_dir, newest))
+        if global_follow_pending != (newest, stamp):
+            global_follow_pending = (newest, stamp)
+            new_files = new_files[:-1]
+    if not new_files:
+        return
+    global_follow_pending = None
+
+    at_end = (mv.mol_file_stop_index >= num_old - 1)
+    global_mol_file_list.extend(new_files)
+    seed_state = global_seed_states.get(mv.mol_file_dir)
+    if seed_state is not None:
+        seed_state[0] = list(global_mol_file_list)
+    mv.mol_file_num = len(global_mol_file_list)
+    if at_end:
+        mv.mol_file_stop_index = mv.mol_file_num - 1
+    context.scene.frame_end = mv.mol_file_num - 1
+
+    if mv.follow_latest or (num_old == 0):
+        # frame_set runs the frame change handlers, which read the new frame
+        context.scene.frame_set(mv.mol_file_num - 1)
+
+
 class MCELL_OT_select_viz_data(bpy.types.Operator):
     bl_idname = "mcell.select_viz_data"
     bl_label = "Read Viz Data"
@@ -373,9 +627,8 @@ class MCELL_OT_select_viz_data(bpy.types.Operator):
 
         mcell.mol_viz.mol_file_dir = mol_file_dir
 
-        mol_file_list = [ f for f in glob.glob(os.path.join(mol_file_dir, "*")) if not f.endswith(os.sep + "viz_bngl") ]
+        mol_file_list = list_mol_viz_files(mol_file_dir)
         print ( "Select found " + str(len(mol_file_list)) + " files" )
-        mol_file_list.sort()
 
         # Reset mol_file_list and mol_viz_seed_list to empty
 #        mcell.mol_viz.mol_file_list.clear()
@@ -384,7 +637,7 @@ class MCELL_OT_select_viz_data(bpy.types.Operator):
         for mol_file_name in mol_file_list:
 #            new_item = mcell.mol_viz.mol_file_list.add()
 #            new_item.name = os.path.basename(mol_file_name)
-            global_mol_file_list.append(os.path.basename(mol_file_name))
+            global_mol_file_list.append(mol_file_name)
 
         create_color_list()
         set_viz_boundaries(context)
@@ -498,451 +751,381 @@ def mol_viz_update(self, context):
         global_undo = bpy.context.user_preferences.edit.use_global_undo
         bpy.context.user_preferences.edit.use_global_undo = False
 
-        mol_viz_clear(mcell)
+        # The standard code updates the molecule objects in place, custom code expects empty ones
+        if (mcell.mol_viz.viz_code != 'standard') or (not mcell.mol_viz.mol_viz_enable):
+            mol_viz_clear(mcell)
         if mcell.mol_viz.mol_viz_enable:
             mol_viz_file_read(mcell, filepath)
+            prefetch_mol_viz_frames(mcell)
 
         # Reset undo back to its original state
         bpy.context.user_preferences.edit.use_global_undo = global_undo
     return
 
 
-def mol_viz_clear(mcell_prop, force_clear=False):
-    """ Clear the viz data from the previous frame. """
+def get_frame_cache(mol_viz):
+    """ Return the frame cache, creating it or changing its size as needed. """
+    global global_frame_cache
 
-    mcell = mcell_prop
-    scn = bpy.context.scene
-    scn_objs = scn.objects
-    meshes = bpy.data.meshes
-    objs = bpy.data.objects
+    max_bytes = mol_viz.frame_cache_size_mb * 1048576
+    if global_frame_cache is None:
+        global_frame_cache = mol_viz_cache.FrameCache(max_bytes)
+    elif global_frame_cache.max_bytes != max_bytes:
+        global_frame_cache.resize(max_bytes)
+    return global_frame_cache
 
-    if force_clear:
-      mol_viz_list = [obj for obj in scn_objs if (obj.name[:4] == 'mol_') and (obj.name[-6:] != '_shape')]
-    else:
-      mol_viz_list = mcell.mol_viz.mol_viz_list
 
-    for mol_item in mol_viz_list:
-        mol_name = mol_item.name
-        mol_obj = scn_objs.get(mol_name)
-        if mol_obj:
-            hide = mol_obj.hide
+def shutdown_frame_cache():
+    """ Stop the frame cache's prefetch threads and free its frames (when the add-on is disabled or Blender quits). """
+    global global_frame_cache
+    if global_frame_cache is not None:
+        global_frame_cache.shutdown()
+        global_frame_cache = None
 
-            mol_pos_mesh = mol_obj.data
-            mol_pos_mesh_name = mol_pos_mesh.name
-            mol_shape_obj_name = "%s_shape" % (mol_name)
-            mol_shape_obj = objs.get(mol_shape_obj_name)
-            if mol_shape_obj:
-                mol_shape_obj.parent = None
 
-            scn_objs.unlink(mol_obj)
-            objs.remove(mol_obj)
-            meshes.remove(mol_pos_mesh)
+def frame_cache_update_callback(self, context):
+    """ Apply changes to the frame cache settings. """
+    if self.frame_cache_enable:
+        get_frame_cache(self)
+    elif global_frame_cache is not None:
+        global_frame_cache.clear()
+        global_frame_cache.reset_stats()
 
-            mol_pos_mesh = meshes.new(mol_pos_mesh_name)
-            mol_obj = objs.new(mol_name, mol_pos_mesh)
-            scn_objs.link(mol_obj)
 
-            if mol_shape_obj:
-                mol_shape_obj.parent = mol_obj
+def hidden_mol_viz_species(mcell):
+    """ Return the names of the molecule objects that don't need to be loaded. """
+    if not mcell.mol_viz.load_visible_only:
+        return frozenset()
+    return frozenset([obj.name for obj in bpy.context.scene.objects
+                      if (obj.name[:4] == 'mol_') and (obj.name[-6:] != '_shape') and obj.hide])
 
-            mol_obj.dupli_type = 'VERTS'
-            mol_obj.use_dupli_vertices_rotation = True
-            mols_obj = objs.get("molecules")
-            mol_obj.parent = mols_obj
 
-            mol_obj.hide = hide
+def get_clip_box(mcell):
+    """ Return the clip box (xmin, ymin, zmin, xmax, ymax, zmax) or None when not clipping. """
+    mv = mcell.mol_viz
+    if not mv.clip_enable:
+        return None
+    if mv.clip_mode == 'object':
+        clip_obj = bpy.data.objects.get(mv.clip_object_name)
+        if clip_obj is None:
+            return None
+        corners = [clip_obj.matrix_world * mathutils.Vector(corner) for corner in clip_obj.bound_box]
+        return tuple([min([c[i] for c in corners]) for i in range(3)] +
+                     [max([c[i] for c in corners]) for i in range(3)])
+    return tuple([min(mv.clip_box_min[i], mv.clip_box_max[i]) for i in range(3)] +
+                 [max(mv.clip_box_min[i], mv.clip_box_max[i]) for i in range(3)])
 
-    # Reset mol_viz_list to empty
-    for i in range(len(mcell.mol_viz.mol_viz_list)-1, -1, -1):
-        mcell.mol_viz.mol_viz_list.remove(i)
 
+def prefetch_mol_viz_frames(mcell):
+    """ Start decoding the next frames in the current playback direction. """
+    global global_last_mol_file_index
 
+    mv = mcell.mol_viz
+    index = mv.mol_file_index
+
+    # Guess the playback direction from the previous frame
+    direction = 1
+    if (global_last_mol_file_index is not None) and (index < global_last_mol_file_index):
+        direction = -1
+    global_last_mol_file_index = index
+
+    if not (mv.frame_cache_enable and (mv.frame_cache_prefetch > 0)):
+        return
+
+    start = mv.mol_file_start_index
+    stop = min(mv.mol_file_stop_index, len(global_mol_file_list)-1)
+    if stop < start:
+        return
+
+    filepaths = []
+    for step in range(1, mv.frame_cache_prefetch+1):
+        i = index + (direction * step)
+        # Wrap around like the timeline does during playback
+        if i > stop:
+            i = start + (i - stop - 1)
+        elif i < start:
+            i = stop - (start - i - 1)
+        if (start <= i <= stop) and (i != index):
+            filepaths.append(os.path.join(mv.mol_file_dir, global_mol_file_list[i]))
+
+    get_frame_cache(mv).prefetch(filepaths, hidden_mol_viz_species(mcell), get_clip_box(mcell))
+
+
+class MolVizSpeciesRegistry:
+    """ Set of the names in mol_viz.mol_viz_list, kept alongside the collection.
+
+    Looking names up in the RNA collection (or building a set from it) costs
+    a walk over the whole collection, which adds up with hundreds of species
+    on every frame change. The registry answers membership from a Python set
+    and diffs new frames against it, so only molecules that appear or vanish
+    touch the collection. Code that changes the collection behind its back
+    (custom viz scripts, loading a .blend file or a data model) invalidates
+    it, and the set is rebuilt from the collection on the next sync. A name
+    missing from the collection (an edit that kept its length) also forces
+    a rebuild.
+    """
 
+    def __init__(self):
+        self.owner = None
+        self.names = set()
+        self.stale = True
+
+    def invalidate(self):
+        """ Rebuild the set from the collection on the next sync. """
+        self.stale = True
+
+    def sync(self, mol_viz):
+        """ Return the names in mol_viz_list, rebuilding the set if it is out of date. """
+        if self.stale or (self.owner != mol_viz.as_pointer()) or (len(self.names) != len(mol_viz.mol_viz_list)):
+            self.owner = mol_viz.as_pointer()
+            self.names = set([mol_item.name for mol_item in mol_viz.mol_viz_list])
+            self.stale = False
+        return self.names
+
+    def update(self, mol_viz, mol_names):
+        """ Make mol_viz_list hold mol_names (new names are added in the given order). """
+        keep = set(mol_names)
+        mol_viz_list = mol_viz.mol_viz_list
+        names = self.sync(mol_viz)
+        gone = names.difference(keep)
+        indices = [mol_viz_list.find(mol_name) for mol_name in gone]
+        if -1 in indices:
+            # The set is out of date (the collection was edited without changing its length)
+            self.invalidate()
+            names = self.sync(mol_viz)
+            gone = names.difference(keep)
+        for mol_name in gone:
+            mol_viz_list.remove(mol_viz_list.find(mol_name))
+        for mol_name in mol_names:
+            if not (mol_name in names):
+                new_item = mol_viz_list.add()       # Create a new collection item to hold the name for this molecule
+                new_item.name = mol_name            # Assign the name to the new item
+        self.names = keep
+
+    def clear(self, mol_viz):
+        mol_viz.mol_viz_list.clear()
+        self.owner = mol_viz.as_pointer()
+        self.names = set()
+        self.stale = False
+
+
+global_mol_viz_species = MolVizSpeciesRegistry()
 
 
-def old_mol_viz_file_read(mcell_prop, filepath):
-    """ Draw the viz data for the current frame. """
+def mol_viz_clear(mcell_prop, force_clear=False):
+    """ Clear the viz data from the previous frame. """
+
     mcell = mcell_prop
-    try:
+    scn_objs = bpy.context.scene.objects
 
-#        begin = resource.getrusage(resource.RUSAGE_SELF)[0]
-#        print ("Processing molecules from file:    %s" % (filepath))
+    if force_clear:
+      mol_names = [obj.name for obj in scn_objs if (obj.name[:4] == 'mol_') and (obj.name[-6:] != '_shape')]
+    else:
+      mol_names = global_mol_viz_species.sync(mcell.mol_viz)
 
-        # Quick check for Binary or ASCII format of molecule file:
-        mol_file = open(filepath, "rb")
-        b = array.array("I")
-        b.fromfile(mol_file, 1)
+    # Empty the position meshes, keeping the objects (and their visibility) for the next frame
+    for mol_name in mol_names:
+        mol_obj = scn_objs.get(mol_name)
+        if mol_obj and (mol_obj.type == 'MESH') and (len(mol_obj.data.vertices) > 0):
+            set_mol_pos_mesh(mol_obj.data, [], [])
 
-        mol_dict = {}
+    # Reset mol_viz_list to empty
+    global_mol_viz_species.clear(mcell.mol_viz)
 
-        if b[0] == 1:
-            # Read Binary format molecule file:
-            bin_data = 1
-            while True:
-                try:
-                    # Variable names are a little hard to follow
-                    # Here's what I assume they mean:
-                    # ni = Initially, array of molecule name length.
-                    # Later, array of number of molecule positions in xyz
-                    # (essentially, the number of molecules multiplied by 3).
-                    # ns = Array of ascii character codes for molecule name.
-                    # s = String of molecule name.
-                    # mt = Surface molecule flag.
-                    ni = array.array("B")
-                    ni.fromfile(mol_file, 1)
-                    ns = array.array("B")
-                    ns.fromfile(mol_file, ni[0])
-                    s = ns.tostring().decode()
-                    mol_name = "mol_%s" % (s)
-                    mt = array.array("B")
-                    mt.fromfile(mol_file, 1)
-                    ni = array.array("I")
-                    ni.fromfile(mol_file, 1)
-                    mol_pos = array.array("f")
-                    mol_orient = array.array("f")
-                    mol_pos.fromfile(mol_file, ni[0])
-#                    tot += ni[0]/3
-                    if mt[0] == 1:
-                        mol_orient.fromfile(mol_file, ni[0])
-                    mol_dict[mol_name] = [mt[0], mol_pos, mol_orient]
-                    new_item = mcell.mol_viz.mol_viz_list.add()
-                    new_item.name = mol_name
-                except:
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
 
-        else:
-            # Read ASCII format molecule file:
-            bin_data = 0
-            mol_file.close()
-            # Create a list of molecule names, positions, and orientations
-            # Each entry in the list is ordered like this (afaik):
-            # [molec_name, [x_pos, y_pos, z_pos, x_orient, y_orient, z_orient]]
-            # Orientations are zero in the case of volume molecules.
-            mol_data = [[s.split()[0], [
-                float(x) for x in s.split()[2:]]] for s in open(
-                    filepath, "r").read().split("\n") if s != ""]
-
-            for mol in mol_data:
-                mol_name = "mol_%s" % (mol[0])
-                if not mol_name in mol_dict:
-                    mol_orient = mol[1][3:]
-                    mt = 0
-                    # Check to see if it's a surface molecule
-                    if ((mol_orient[0] != 0.0) | (mol_orient[1] != 0.0) |
-                            (mol_orient[2] != 0.0)):
-                        mt = 1
-                    mol_dict[mol_name] = [
-                        mt, array.array("f"), array.array("f")]
-                    new_item = mcell.mol_viz.mol_viz_list.add()
-                    new_item.name = mol_name
-                mt = mol_dict[mol_name][0]
-                mol_dict[mol_name][1].extend(mol[1][:3])
-                if mt == 1:
-                    mol_dict[mol_name][2].extend(mol[1][3:])
+def set_mol_pos_mesh(mol_pos_mesh, mol_pos, mol_orient):
+    """ Resize a molecule position mesh in place and fill in the positions and orientations.
 
-        # Get the parent object to all the molecule positions if it exists.
-        # Otherwise, create it.
-        mols_obj = bpy.data.objects.get("molecules")
-        if not mols_obj:
-            bpy.ops.object.add(location=[0, 0, 0])
-            mols_obj = bpy.context.selected_objects[0]
-            mols_obj.name = "molecules"
+    The orientations (vertex normals) are left alone when mol_orient is None.
+    """
 
-        #mol_viz_list
+    num_verts = len(mol_pos)
+    if len(mol_pos_mesh.vertices) > num_verts:
+        # Meshes can't drop vertices directly, but writing an empty bmesh empties the mesh in place
+        bm = bmesh.new()
+        bm.to_mesh(mol_pos_mesh)
+        bm.free()
+    if len(mol_pos_mesh.vertices) < num_verts:
+        mol_pos_mesh.vertices.add(num_verts - len(mol_pos_mesh.vertices))
+    if num_verts > 0:
+        mol_pos_mesh.vertices.foreach_set("co", mol_pos.ravel())
+        if mol_orient is not None:
+            mol_pos_mesh.vertices.foreach_set("normal", mol_orient.ravel())
+    mol_pos_mesh.update()
 
-        if mol_dict:
-            meshes = bpy.data.meshes
-            mats = bpy.data.materials
-            objs = bpy.data.objects
-            scn = bpy.context.scene
-            scn_objs = scn.objects
-            z_axis = mathutils.Vector((0.0, 0.0, 1.0))
-            #ident_mat = mathutils.Matrix.Translation(
-            #    mathutils.Vector((0.0, 0.0, 0.0)))
 
-            for mol_name in mol_dict.keys():
-                mol_mat_name = "%s_mat" % (mol_name)
-                mol_type = mol_dict[mol_name][0]
-                mol_pos = mol_dict[mol_name][1]
-                mol_orient = mol_dict[mol_name][2]
 
-                # Randomly orient volume molecules
-                if mol_type == 0:
-                    mol_orient.extend([random.uniform(
-                        -1.0, 1.0) for i in range(len(mol_pos))])
 
-                # Look-up mesh shape (glyph) template and create if needed
-                mol_shape_mesh_name = "%s_shape" % (mol_name)
-                mol_shape_obj_name = mol_shape_mesh_name
-                mol_shape_mesh = meshes.get(mol_shape_mesh_name)
-                if not mol_shape_mesh:
-                    bpy.ops.mesh.primitive_ico_sphere_add(
-                        subdivisions=0, size=0.005, location=[0, 0, 0])
-                    mol_shape_obj = bpy.context.active_object
-                    mol_shape_obj.name = mol_shape_obj_name
-                    mol_shape_obj.track_axis = "POS_Z"
-                    mol_shape_mesh = mol_shape_obj.data
-                    mol_shape_mesh.name = mol_shape_mesh_name
-                else:
-                    mol_shape_obj = objs.get(mol_shape_obj_name)
 
-                # Look-up material, create if needed.
-                # Associate material with mesh shape.
-                mol_mat = mats.get(mol_mat_name)
-                if not mol_mat:
-                    mol_mat = mats.new(mol_mat_name)
-                    mol_mat.diffuse_color = mcell.mol_viz.color_list[
-                        mcell.mol_viz.color_index].vec
-                    mcell.mol_viz.color_index = mcell.mol_viz.color_index + 1
-                    if (mcell.mol_viz.color_index >
-                            len(mcell.mol_viz.color_list)-1):
-                        mcell.mol_viz.color_index = 0
-                if not mol_shape_mesh.materials.get(mol_mat_name):
-                    mol_shape_mesh.materials.append(mol_mat)
-
-                # Create a "mesh" to hold instances of molecule positions
-                mol_pos_mesh_name = "%s_pos" % (mol_name)
-                mol_pos_mesh = meshes.get(mol_pos_mesh_name)
-                if not mol_pos_mesh:
-                    mol_pos_mesh = meshes.new(mol_pos_mesh_name)
-
-                # Add and place vertices at positions of molecules
-                mol_pos_mesh.vertices.add(len(mol_pos)//3)
-                mol_pos_mesh.vertices.foreach_set("co", mol_pos)
-                mol_pos_mesh.vertices.foreach_set("normal", mol_orient)
-
-                # Create object to contain the mol_pos_mesh data
-                mol_obj = objs.get(mol_name)
-                if not mol_obj:
-                    mol_obj = objs.new(mol_name, mol_pos_mesh)
-                    scn_objs.link(mol_obj)
-                    mol_shape_obj.parent = mol_obj
-                    mol_obj.dupli_type = 'VERTS'
-                    mol_obj.use_dupli_vertices_rotation = True
-                    mol_obj.parent = mols_obj
+import sys, traceback
 
-#        scn.update()
 
-#        utime = resource.getrusage(resource.RUSAGE_SELF)[0]-begin
-#        print ("     Processed %d molecules in %g seconds\n" % (
-#            len(mol_data), utime))
+def mol_viz_file_dump(filepath):
+    """ Read and Dump a molecule viz file. """
+    try:
+        for mol_name, (mol_type, mol_pos, mol_orient) in mol_viz_data.read_mol_viz_file(filepath).items():
+            mol_type_name = "Volume"
+            if mol_type == 1:
+                mol_type_name = "Surface"
+            print ( mol_type_name + " Molecule " + mol_name[4:] + " contains " + str(len(mol_pos)) + " instances" )
 
     except IOError:
-        print(("\n***** File not found: %s\n") % (filepath))
+        print(("\n***** IOError: File: %s\n") % (filepath))
 
     except ValueError:
-        print(("\n***** Invalid data in file: %s\n") % (filepath))
-
-
-
+        print(("\n***** ValueError: Invalid data in file: %s\n") % (filepath))
 
-import sys, traceback
 
 
-def mol_viz_file_dump(filepath):
-    """ Read and Dump a molecule viz file. """
-    tot = 0
-    try:
+# Compiled custom viz scripts: script name -> [key, code, namespace]
+global_viz_scripts = {}
+global_viz_script_time = 0.0
 
-        # Quick check for Binary or ASCII format of molecule file:
-        mol_file = open(filepath, "rb")
-        b = array.array("I")
-        b.fromfile(mol_file, 1)
 
-        mol_dict = {}
+def get_mol_viz_script(mv):
+    """ Return the [key, code, namespace] of the selected viz script (None if there isn't one).
 
-        if b[0] == 1:
-            # Read MCell/CellBlender Binary Format molecule file, version 1:
-            print ("Reading binary file " + filepath )
-            while True:
-                try:
-                    # ni = Initially, byte array of molecule name length.
-                    # Later, array of number of molecule positions in xyz
-                    # (essentially, the number of molecules multiplied by 3).
-                    # ns = Array of ascii character codes for molecule name.
-                    # s = String of molecule name.
-                    # mt = Surface molecule flag.
-                    ni = array.array("B")          # Create a binary byte ("B") array
-                    ni.fromfile(mol_file, 1)       # Read one byte which is the number of characters in the molecule name
-                    ns = array.array("B")          # Create another byte array to hold the molecule name
-                    ns.fromfile(mol_file, ni[0])   # Read ni bytes from the file
-                    s = ns.tostring().decode()     # Decode bytes as ASCII into a string (s)
-                    mol_name = "mol_%s" % (s)      # Construct name of blender molecule viz object
-                    mt = array.array("B")          # Create a byte array for the molecule type
-                    mt.fromfile(mol_file, 1)       # Read one byte for the molecule type
-                    ni = array.array("I")          # Re-use ni as an integer array to hold the number of molecules of this name in this frame
-                    ni.fromfile(mol_file, 1)       # Read the 4 byte integer value which is 3 times the number of molecules
-                    mol_pos = array.array("f")     # Create a floating point array to hold the positions
-                    mol_orient = array.array("f")  # Create a floating point array to hold the orientations
-                    mol_pos.fromfile(mol_file, ni[0])  # Read the positions which should be 3 floats per molecule
-                    mol_type_name = "Volume"
-                    tot += ni[0]/3
-                    if mt[0] == 1:                                        # If mt==1, it's a surface molecule
-                        mol_orient.fromfile(mol_file, ni[0])              # Read the surface molecule orientations
-                        mol_type_name = "Surface"
-                    print ( mol_type_name + " Molecule " + s + " contains " + str(tot) + " instances" )
-
-                except EOFError:
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
+    The script is only compiled again when it changes: internal (Blender
+    text) scripts are keyed by a hash of their text and external scripts by
+    the modification time and size of their file. A new namespace is None
+    until the script has run.
+    """
+    script_name = mv.internal_viz_file_name
+    if script_name in bpy.data.texts:
+        # It's an internal file
+        script_text = bpy.data.texts[script_name].as_string()
+        key = hashlib.md5(script_text.encode()).hexdigest()
+        script_path = "<" + script_name + ">"
+    elif script_name.startswith ( os.path.sep ):
+        # It must be an external file starting with an os.sep (typically '/')
+        script_path = os.path.join ( os.path.dirname(bpy.data.filepath), script_name[1:] )
+        st = os.stat(script_path)
+        key = (script_path, st.st_mtime, st.st_size)
+        script_text = None
+    else:
+        return None
 
-                except:
-                    print( "Unexpected Exception: " + str(sys.exc_info()) )
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
-        else:
-            print ( "Dump doesn't read text files." )
-    except IOError:
-        print(("\n***** IOError: File: %s\n") % (filepath))
+    script = global_viz_scripts.get(script_name)
+    if (script is None) or (script[0] != key):
+        if script_text is None:
+            print ( "Reading script text from " + script_path )
+            with open(script_path, 'r') as script_file:
+                script_text = script_file.read()
+        script = [key, compile(script_text, script_path, 'exec'), None]
+        global_viz_scripts[script_name] = script
+    return script
 
-    except ValueError:
-        print(("\n***** ValueError: Invalid data in file: %s\n") % (filepath))
 
-    except RuntimeError as rte:
-        print(("\n***** RuntimeError reading file: %s\n") % (filepath))
-        print("      str(error): \n" + str(rte) + "\n")
-        fail_error = sys.exc_info()
-        print ( "    Error Type: " + str(fail_error[0]) )
-        print ( "    Error Value: " + str(fail_error[1]) )
-        tb = fail_error[2]
-        # tb.print_stack()
-        print ( "=== Traceback Start ===" )
-        traceback.print_tb(tb)
-        print ( "=== Traceback End ===" )
+def run_mol_viz_script(mcell, filepath):
+    """ Run the custom viz script for a frame. Return False if no script is selected.
 
-    except Exception as uex:
-        # Catch any exception
-        print ( "\n***** Unexpected exception:" + str(uex) + "\n" )
-        raise
+    By default the whole script runs for every frame. A script that defines a
+    function mol_viz_frame(mcell, filepath) is run once (as setup) and after
+    that only mol_viz_frame is called for each frame, until the script changes.
+    """
+    global global_viz_script_time
 
+    mv = mcell.mol_viz
+    script = get_mol_viz_script(mv)
+    if script is None:
+        return False
+
+    # Store the filepath for this frame in a place where it can be used by the custom code
+    mv.frame_file_name = filepath
+
+    start = time.time()
+    namespace = script[2]
+    if (namespace is None) or not ('mol_viz_frame' in namespace):
+        namespace = dict(globals())
+        namespace.update(mcell=mcell, mv=mv, filepath=filepath)
+        exec(script[1], namespace)
+        if callable(namespace.get('mol_viz_frame')):
+            script[2] = namespace
+            namespace['mol_viz_frame'](mcell, filepath)
+    else:
+        namespace['mol_viz_frame'](mcell, filepath)
+    global_viz_script_time = time.time() - start
+    return True
 
 
 def mol_viz_file_read(mcell, filepath):
     """ Read and Draw the molecule viz data for the current frame. """
 
     mv = mcell.mol_viz
-    if (mv.viz_code in ['custom','both']):
-
-      script_text = None
 
-      if mv.internal_viz_file_name in bpy.data.texts:
-        # It's an internal file
-        script_text = bpy.data.texts[mv.internal_viz_file_name].as_string()
-      elif mv.internal_viz_file_name.startswith ( os.path.sep ):
-        # It must be an external file starting with an os.sep (typically '/')
-        script_file = open ( os.path.join ( os.path.dirname(bpy.data.filepath), mv.internal_viz_file_name[1:] ), 'r' )
-        print ( "Reading script text from " + str(script_file) )
-        script_text = script_file.read()
-
-      if script_text != None:
-        # Store the filepath for this frame in a place where it can be used by the custom code
-        mcell.mol_viz.frame_file_name = filepath
-
-        # Convert the text to code (this might be done earlier when the file is selected)
-        code = compile ( script_text, "<string>", 'exec' )
+    # Molecules shown in the previous frame (empty unless the standard code drew it)
+    prev_mol_names = set(global_mol_viz_species.sync(mv))
 
-        # Execute the code
-        exec ( code )
+    if (mv.viz_code in ['custom','both']):
 
-        if mv.viz_code == 'custom':
-            return
+      ran_script = run_mol_viz_script(mcell, filepath)
+      if ran_script:
+          # The script may have changed mol_viz_list
+          global_mol_viz_species.invalidate()
+      if ran_script and (mv.viz_code == 'custom'):
+          return
 
 
-    dup_check = False
     try:
 
 #        begin = resource.getrusage(resource.RUSAGE_SELF)[0]
 #        print ("Processing molecules from file:    %s" % (filepath))
 
-        # Quick check for Binary or ASCII format of molecule file:
-        mol_file = open(filepath, "rb")
-        b = array.array("I")
-        b.fromfile(mol_file, 1)
-
-        mol_dict = {}
-
-        if b[0] == 1:
-            # Read MCell/CellBlender Binary Format molecule file, version 1:
-            # print ("Reading binary file " + filepath )
-            bin_data = 1
-            while True:
-                try:
-                    # ni = Initially, byte array of molecule name length.
-                    # Later, array of number of molecule positions in xyz
-                    # (essentially, the number of molecules multiplied by 3).
-                    # ns = Array of ascii character codes for molecule name.
-                    # s = String of molecule name.
-                    # mt = Surface molecule flag.
-                    ni = array.array("B")          # Create a binary byte ("B") array
-                    ni.fromfile(mol_file, 1)       # Read one byte which is the number of characters in the molecule name
-                    ns = array.array("B")          # Create another byte array to hold the molecule name
-                    ns.fromfile(mol_file, ni[0])   # Read ni bytes from the file
-                    s = ns.tostring().decode()     # Decode bytes as ASCII into a string (s)
-                    mol_name = "mol_%s" % (s)      # Construct name of blender molecule viz object
-                    mt = array.array("B")          # Create a byte array for the molecule type
-                    mt.fromfile(mol_file, 1)       # Read one byte for the molecule type
-                    ni = array.array("I")          # Re-use ni as an integer array to hold the number of molecules of this name in this frame
-                    ni.fromfile(mol_file, 1)       # Read the 4 byte integer value which is 3 times the number of molecules
-                    mol_pos = array.array("f")     # Create a floating point array to hold the positions
-                    mol_orient = array.array("f")  # Create a floating point array to hold the orientations
-                    mol_pos.fromfile(mol_file, ni[0])  # Read the positions which should be 3 floats per molecule
-#                    tot += ni[0]/3
-                    if mt[0] == 1:                                        # If mt==1, it's a surface molecule
-                        mol_orient.fromfile(mol_file, ni[0])              # Read the surface molecule orientations
-                    mol_dict[mol_name] = [mt[0], mol_pos, mol_orient]     # Create a dictionary entry for this molecule containing a list of relevant data
-                    if len(mcell.mol_viz.mol_viz_list) > 0:
-                      for i in range(len(mcell.mol_viz.mol_viz_list)):
-                        if mcell.mol_viz.mol_viz_list[i].name[4:] == mol_name:
-                          dup_check = True
-                    if dup_check == False:
-                      new_item = mcell.mol_viz.mol_viz_list.add()           # Create a new collection item to hold the name for this molecule
-                      new_item.name = mol_name                              # Assign the name to the new item
-
-                except EOFError:
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
-
-                except:
-                    print( "Unexpected Exception: " + str(sys.exc_info()) )
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
-
+        # Hidden molecules are left out of the frame (their objects are just emptied)
+        skip = hidden_mol_viz_species(mcell)
+
+        # Molecules outside of the clip region are dropped while decoding
+        clip = get_clip_box(mcell)
+
+        # Decode the file (or pick up the frame already decoded by the prefetch threads,
+        # or the frame last shown for this seed when switching back to it)
+        seed_state = global_seed_states.get(mv.mol_file_dir)
+        last_frame = None
+        if seed_state is not None:
+            last_frame = seed_state[1]
+        if (last_frame is not None) and (last_frame[0] == filepath) and mol_viz_cache.FrameCache.covers(last_frame[1], last_frame[2], skip, clip):
+            mol_dict = last_frame[3]
+        elif mv.frame_cache_enable:
+            mol_dict = get_frame_cache(mv).get(filepath, skip, clip)
         else:
-            # Read ASCII format molecule file:
-            # print ("Reading ASCII file " + filepath )
-            bin_data = 0
-            mol_file.close()
-            # Create a list of molecule names, positions, and orientations
-            # Each entry in the list is ordered like this (afaik):
-            # [molec_name, [x_pos, y_pos, z_pos, x_orient, y_orient, z_orient]]
-            # Orientations are zero in the case of volume molecules.
-            mol_data = [[s.split()[0], [
-                float(x) for x in s.split()[2:]]] for s in open(
-                    filepath, "r").read().split("\n") if s != ""]
-
-            for mol in mol_data:
-                mol_name = "mol_%s" % (mol[0])
-                if not mol_name in mol_dict:
-                    mol_orient = mol[1][3:]
-                    mt = 0
-                    # Check to see if it's a surface molecule
-                    if ((mol_orient[0] != 0.0) | (mol_orient[1] != 0.0) |
-                            (mol_orient[2] != 0.0)):
-                        mt = 1
-                    mol_dict[mol_name] = [
-                        mt, array.array("f"), array.array("f")]
-                    new_item = mcell.mol_viz.mol_viz_list.add()
-                    new_item.name = mol_name
-                mt = mol_dict[mol_name][0]
-                mol_dict[mol_name][1].extend(mol[1][:3])
-                if mt == 1:
-                    mol_dict[mol_name][2].extend(mol[1][3:])
+            mol_dict = mol_viz_cache.load_frame(filepath, skip, clip, copy=False)
+        if seed_state is not None:
+            seed_state[1] = (filepath, frozenset(skip), clip, mol_dict)
+
+        mol_names = list(mol_dict.keys()) + sorted(skip.difference(mol_dict.keys()))
+
+        # Empty the objects of molecules that are hidden or not in this frame
+        scn_objs = bpy.context.scene.objects
+        for mol_name in prev_mol_names.difference(mol_dict.keys()):
+            mol_obj = scn_objs.get(mol_name)
+            if mol_obj and (mol_obj.type == 'MESH') and (len(mol_obj.data.vertices) > 0):
+                set_mol_pos_mesh(mol_obj.data, [], [])
+
+        # Bring mol_viz_list up to date with the molecules in this frame
+        global_mol_viz_species.update(mcell.mol_viz, mol_names)
+
+        # Decide how many of each molecule to display (and record the full counts for the panel)
+        budget_list = mcell.mol_viz.species_budget_list
+        for mol_name in mol_dict.keys():
+            if not (mol_name in budget_list):
+                new_item = budget_list.add()
+                new_item.name = mol_name
+        budget = 0
+        if mv.display_budget_enable:
+            budget = mv.display_budget
+        shown_counts = mol_viz_data.display_counts(
+            [len(mol_data[1]) for mol_data in mol_dict.values()],
+            [budget_list[mol_name].max_displayed for mol_name in mol_dict.keys()], budget)
+        shown_counts = dict(zip(mol_dict.keys(), shown_counts))
+        for budget_item in budget_list:
+            if budget_item.name in mol_dict:
+                budget_item.total_count = len(mol_dict[budget_item.name][1])
+                budget_item.displayed_count = shown_counts[budget_item.name]
+            else:
+                if not (budget_item.name in skip):
+                    # Hidden molecules keep the count from when they were last loaded
+                    budget_item.total_count = 0
+                budget_item.displayed_count = 0
 
         # Get the parent object to all the molecule positions if it exists.
         # Otherwise, create it.
@@ -973,10 +1156,9 @@ def mol_viz_file_read(mcell, filepath):
 
                 # print ( "in mol_viz_file_read with mol_name = " + mol_name + ", mol_mat_name = " + mol_mat_name + ", file = " + filepath[filepath.rfind(os.sep)+1:] )
 
-                # Randomly orient volume molecules
-                if mol_type == 0:
-                    mol_orient.extend([random.uniform(
-                        -1.0, 1.0) for i in range(len(mol_pos))])
+                # Only display a (stable) subset of the molecules if there are too many
+                if shown_counts[mol_name] < len(mol_pos):
+                    mol_pos, mol_orient = mol_viz_data.subsample_mol_data(mol_pos, mol_orient, shown_counts[mol_name])
 
                 # Look up the glyph, color, size, and other attributes from the molecules list
 
@@ -989,6 +1171,15 @@ def mol_viz_file_read(mcell, filepath):
                     # The color below doesn't seem to be used ... the color comes from a material
                     # print ( "Mol " + mname + " has color " + str(mol.color) )
 
+                # Orient volume molecules (spheres look the same whichever way they point)
+                if mol_type == 0:
+                    if (mv.volume_orient_mode == 'none') or ((mol != None) and (mol.glyph in ['Sphere_1', 'Sphere_2'])):
+                        mol_orient = None
+                    elif mv.volume_orient_mode == 'stable':
+                        mol_orient = mol_viz_data.stable_orientations(mol_name, len(mol_pos))
+                    else:
+                        mol_orient = mol_viz_data.random_orientations(len(mol_pos))
+
                 # Look-up mesh shape (glyph) template and create if needed
 
                 # This may end up calling a member function of the molecule class to create a new default molecule (including glyph)
@@ -1014,8 +1205,8 @@ def mol_viz_file_read(mcell, filepath):
                     # print ( "Using a " + str(mol.glyph) + " molecule glyph" )
                     mol_shape_obj = objs.get(mol_shape_obj_name)
 
-                # Save the current layer(s) that the molecule positions are on.
-                # We'll apply this to the new position and glyph objects later.
+                # Get the current layer(s) that the molecule glyph is on.
+                # We'll apply this to the position object if it has to be created.
                 mol_layers = None
                 if not (mol_shape_obj is None):
                     mol_layers = mol_shape_obj.layers[:]
@@ -1040,46 +1231,40 @@ def mol_viz_file_read(mcell, filepath):
                 #    mol_mat.diffuse_color = mol.color
                 #    mol_mat.emit = mol.emit
 
-                # Look-up mesh to hold instances of molecule positions, create if needed
-                mol_pos_mesh_name = "%s_pos" % (mol_name)
-                mol_pos_mesh = meshes.get(mol_pos_mesh_name)
-                if not mol_pos_mesh:
-                    mol_pos_mesh = meshes.new(mol_pos_mesh_name)
+                # Look-up the object holding the molecule positions, create it (and its mesh) if needed.
+                # The object is kept from frame to frame, so its visibility and layers are left alone.
+                mol_obj = objs.get(mol_name)
+                if (mol_obj is None) or (mol_obj.type != 'MESH'):
+                    if mol_obj:
+                        if scn_objs.get(mol_name):
+                            scn_objs.unlink(mol_obj)
+                        objs.remove(mol_obj)
+                    mol_pos_mesh_name = "%s_pos" % (mol_name)
+                    mol_pos_mesh = meshes.get(mol_pos_mesh_name)
+                    if not mol_pos_mesh:
+                        mol_pos_mesh = meshes.new(mol_pos_mesh_name)
+                    mol_obj = objs.new(mol_name, mol_pos_mesh)
+                    mol_obj.dupli_type = 'VERTS'
+                    mol_obj.use_dupli_vertices_rotation = True
+                    mol_obj.parent = mols_obj
+                    mol_obj.hide_select = True
+                    if mol_layers is not None:
+                        mol_obj.layers = mol_layers[:]
+                if not scn_objs.get(mol_name):
+                    scn_objs.link(mol_obj)
+                if mol_shape_obj.parent != mol_obj:
+                    mol_shape_obj.parent = mol_obj
 
-                # Add and set values of vertices at positions of molecules
-                # This uses vertices.add(), but where are the old vertices removed?
-                mol_pos_mesh.vertices.add(len(mol_pos)//3)
-                mol_pos_mesh.vertices.foreach_set("co", mol_pos)
-                mol_pos_mesh.vertices.foreach_set("normal", mol_orient)
+                if mol_obj.use_dupli_vertices_rotation != (mol_orient is not None):
+                    mol_obj.use_dupli_vertices_rotation = (mol_orient is not None)
+
+                # Resize the position mesh and set the positions and orientations of the molecules
+                set_mol_pos_mesh(mol_obj.data, mol_pos, mol_orient)
 
                 if mcell.cellblender_preferences.debug_level > 100:
 
                   __import__('code').interact(local={k: v for ns in (globals(), locals()) for k, v in ns.items()})
 
-                # Save the molecule's visibility state, so it can be restored later
-                mol_obj = objs.get(mol_name)
-                if mol_obj:
-                    hide = mol_obj.hide
-                    scn_objs.unlink(mol_obj)
-                    objs.remove(mol_obj)
-                else:
-                    hide = False
-
-                # Create object to contain the mol_pos_mesh data
-                mol_obj = objs.new(mol_name, mol_pos_mesh)
-                scn_objs.link(mol_obj)
-                mol_shape_obj.parent = mol_obj
-                mol_obj.dupli_type = 'VERTS'
-                mol_obj.use_dupli_vertices_rotation = True
-                mol_obj.parent = mols_obj
-                mol_obj.hide_select = True
-                if (not (mol_obj is None)) and (not (mol_shape_obj is None)):
-                    mol_obj.layers = mol_layers[:]
-                    mol_shape_obj.layers = mol_layers[:]
-
-                # Restore the visibility state
-                mol_obj.hide = hide
-
                 """
                 if mol_obj:
                     if (mol_name == "mol_volume_proxy") or (mol_name == "mol_surface_proxy"):
@@ -1151,6 +1336,17 @@ class MCELL_UL_visualization_export_list(bpy.types.UIList):
             layout.prop(item, "export_viz", text="Export")
 
 
+class MCELL_UL_mol_viz_species_budget(bpy.types.UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data,
+                  active_propname, index):
+        if item.displayed_count < item.total_count:
+            layout.label(item.name[4:], icon='ERROR')
+        else:
+            layout.label(item.name[4:], icon='FILE_TICK')
+        layout.label("%d / %d" % (item.displayed_count, item.total_count))
+        layout.prop(item, "max_displayed", text="Max")
+
+
 class MCELL_PT_visualization_output_settings(bpy.types.Panel):
     bl_label = "CellBlender - Visualization Output Settings"
     bl_space_type = "PROPERTIES"
@@ -1175,6 +1371,24 @@ class MolVizStringProperty(bpy.types.PropertyGroup):
         pass
 
 
+def mol_viz_settings_update(self, context):
+    """ Redraw the current frame after a display setting change. """
+    mol_viz_update(self, context)
+
+
+class MolVizSpeciesBudgetProperty(bpy.types.PropertyGroup):
+    """ Display limit and counts for one molecule species in the viz data """
+    name = StringProperty(name="Molecule Object Name")
+    max_displayed = IntProperty(
+        name="Max Displayed", default=0, min=0,
+        description="Maximum number of these molecules to display (0 for no limit)",
+        update=mol_viz_settings_update)
+    total_count = IntProperty(name="Molecules in Frame", default=0)
+    displayed_count = IntProperty(name="Molecules Displayed", default=0)
+    def remove_properties ( self, context ):
+        pass
+
+
 class MCellFloatVectorProperty(bpy.types.PropertyGroup):
     """ Generic PropertyGroup to hold float vector for a CollectionProperty """
     vec = bpy.props.FloatVectorProperty(name="Float Vector")
@@ -1211,7 +1425,7 @@ def select_test_case_callback(self, context):
     data_layout = mcell.mol_viz['data_layout']
     bpy.ops.mcell.update_data_layout()
     mcell.model_objects.update_scene(context.scene, force=True)
-    bpy.ops.mcell.read_viz_data()
+    bpy.ops.mcell.read_viz_data(use_cache=True)
 
 class DynamicChoicePropGroup(bpy.types.PropertyGroup):
     enum_choice = EnumProperty( name="Parameter Value", description="Dynamic List of Choices.", items=generate_choices_callback, update=select_test_case_callback )
@@ -1312,6 +1526,85 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
 
     frame_file_name = StringProperty(description="Place to store the file name")
 
+    volume_orient_mode_enum = [
+        ('random', "Random", "Give volume molecules a new random orientation every frame"),
+        ('stable', "Stable Random", "Give each volume molecule a random orientation that stays the same between frames"),
+        ('none',   "No Rotation", "Don't rotate volume molecules (fastest)")]
+    volume_orient_mode = EnumProperty(
+        items=volume_orient_mode_enum, name="Volume Orientation", default='random',
+        description="How volume molecule glyphs are oriented (sphere glyphs are never rotated)",
+        update=mol_viz_settings_update)
+
+    frame_cache_enable = BoolProperty(
+        name="Cache Frames", default=True,
+        description="Keep decoded frames in memory and decode upcoming frames in the background",
+        update=frame_cache_update_callback)
+    frame_cache_size_mb = IntProperty(
+        name="Cache Size (MB)", default=512, min=16,
+        description="Memory budget for decoded frames (least recently used frames are dropped first)",
+        update=frame_cache_update_callback)
+    load_visible_only = BoolProperty(
+        name="Load Visible Molecules Only", default=True, update=mol_viz_update,
+        description="Skip hidden molecules when reading viz files (uses a species index stored with the viz data)")
+    frame_cache_prefetch = IntProperty(
+        name="Prefetch", default=4, min=0, max=64,
+        description="Number of frames to decode ahead in the current playback direction")
+
+    clip_enable = BoolProperty(
+        name="Clip Region", default=False,
+        description="Only load the molecules inside a box (uses a voxel index stored with the viz data)",
+        update=mol_viz_settings_update)
+    clip_mode_enum = [
+        ('box',    "Clip Box", ""),
+        ('object', "Clip Object", "")]
+    clip_mode = EnumProperty(
+        items=clip_mode_enum, name="Clip Mode", default='box',
+        description="Clip to a box given by its corners or to the bounding box of an object",
+        update=mol_viz_settings_update)
+    clip_box_min = FloatVectorProperty(
+        name="Min", default=(-1.0, -1.0, -1.0), subtype='XYZ', size=3,
+        description="Lower corner of the clip box", update=mol_viz_settings_update)
+    clip_box_max = FloatVectorProperty(
+        name="Max", default=(1.0, 1.0, 1.0), subtype='XYZ', size=3,
+        description="Upper corner of the clip box", update=mol_viz_settings_update)
+    clip_object_name = StringProperty(
+        name="Clip Object", default="",
+        description="Object whose bounding box is the clip region", update=mol_viz_settings_update)
+
+    follow_enable = BoolProperty(
+        name="Follow Running Simulation", default=False,
+        description="Add frames to the viz data as a running simulation writes them")
+    follow_latest = BoolProperty(
+        name="Jump to Newest Frame", default=True,
+        description="Show each new frame as it is added while following a simulation")
+
+    density_mol_name = StringProperty(
+        name="Density Molecule", default="",
+        description="Molecule whose density over all seeds is built into a volume")
+    density_bins = IntProperty(
+        name="Voxels", default=64, min=4, max=512,
+        description="Number of voxels along each side of the density volume")
+    density_use_frames = BoolProperty(
+        name="Frame Window", default=False,
+        description="Only accumulate the density over a window of frames of each seed")
+    density_frame_start = IntProperty(
+        name="First", default=0, min=0, description="First frame of the density window")
+    density_frame_stop = IntProperty(
+        name="Last", default=0, min=0, description="Last frame of the density window")
+
+    species_budget_list = CollectionProperty(
+        type=MolVizSpeciesBudgetProperty, name="Molecule Display Limits")
+    active_species_budget_index = IntProperty(
+        name="Active Molecule Display Limit Index", default=0)
+    display_budget_enable = BoolProperty(
+        name="Limit Total Displayed", default=False,
+        description="Share a limit on the number of displayed molecules among the visible species by population",
+        update=mol_viz_settings_update)
+    display_budget = IntProperty(
+        name="Max Molecules", default=1000000, min=1,
+        description="Maximum number of molecules displayed over all visible species",
+        update=mol_viz_settings_update)
+
     #mol_viz_sweep_list = CollectionProperty(type=DynamicChoicePropGroup, name="Choice Dimensions")
     choices_list = CollectionProperty(type=DynamicChoicePropGroup, name="Choice Dimensions")
 
@@ -1429,6 +1722,7 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
         for s in dm["viz_list"]:
             new_item = self.mol_viz_list.add()
             new_item.name = s
+        global_mol_viz_species.invalidate()
 
         self.render_and_save = dm['render_and_save']
         self.mol_viz_enable = dm['viz_enable']
@@ -1490,6 +1784,7 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
         for item in self.mol_viz_list:
             item.remove_properties(context)
         self.mol_viz_list.clear()
+        global_mol_viz_species.invalidate()
         for item in self.color_list:
             item.remove_properties(context)
         self.color_list.clear()
@@ -1530,9 +1825,7 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
 
             # Check if the current structure reflects the recent run
 
-            f = open ( os.path.join(files_path,"data_layout.json"), 'r' )
-            layout_spec = json.loads ( f.read() )
-            f.close()
+            layout_spec = mol_viz_cache.directory_listings.data_layout(files_path)
             data_layout = layout_spec['data_layout']
 
             self['data_layout'] = data_layout
@@ -1599,6 +1892,7 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
                 row.operator("mcell.select_viz_data", icon='IMPORT')
             else:
                 row.operator("mcell.read_viz_data", icon='IMPORT')
+            row.operator("mcell.pack_viz_data", icon='PACKAGE', text="")
             row = layout.row()
             row.label(text="Molecule Viz Directory: " + self.mol_file_dir,icon='FILE_FOLDER')
             row = layout.row()
@@ -1618,6 +1912,60 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
             row = layout.row()
             layout.prop(mcell.mol_viz, "mol_viz_enable")
 
+            row = layout.row()
+            row.prop(self, "frame_cache_enable")
+            if self.frame_cache_enable:
+                row.prop(self, "frame_cache_size_mb")
+                row.prop(self, "frame_cache_prefetch")
+                if global_frame_cache is not None:
+                    row = layout.row()
+                    row.label(text=global_frame_cache.stats_string(), icon='INFO')
+            if self.viz_code in [ 'custom', 'both' ]:
+                row = layout.row()
+                row.label(text="Script: %.1f ms" % (1000 * global_viz_script_time), icon='INFO')
+            row = layout.row()
+            row.prop(self, "load_visible_only")
+            row.prop(self, "volume_orient_mode", text="")
+
+            row = layout.row()
+            row.prop(self, "follow_enable")
+            if self.follow_enable:
+                row.prop(self, "follow_latest")
+
+            row = layout.row()
+            row.prop(self, "clip_enable")
+            if self.clip_enable:
+                row.prop(self, "clip_mode", text="")
+                if self.clip_mode == 'object':
+                    row = layout.row()
+                    row.prop_search(self, "clip_object_name", context.scene, "objects", text="Object")
+                else:
+                    row = layout.row()
+                    row.prop(self, "clip_box_min")
+                    row.prop(self, "clip_box_max")
+
+            row = layout.row()
+            row.prop_search(self, "density_mol_name", self, "mol_viz_list", text="Density")
+            row.prop(self, "density_bins")
+            row = layout.row()
+            row.prop(self, "density_use_frames")
+            if self.density_use_frames:
+                row.prop(self, "density_frame_start")
+                row.prop(self, "density_frame_stop")
+            row = layout.row()
+            row.operator("mcell.build_density_volume", icon='MOD_PARTICLES')
+            row.operator("mcell.show_density_volume", icon='MATERIAL')
+
+            row = layout.row()
+            row.prop(self, "display_budget_enable")
+            if self.display_budget_enable:
+                row.prop(self, "display_budget")
+            if len(self.species_budget_list) > 0:
+                row = layout.row()
+                row.template_list("MCELL_UL_mol_viz_species_budget", "species_budget",
+                                  self, "species_budget_list",
+                                  self, "active_species_budget_index", rows=2)
+
 
             layout.box()
             for i in range(len(self.choices_list)):
@@ -450,6 +450,9 @@ def glyph_visibility_callback(self, context):
     objs = context.scene.objects
     objs[show_name].hide = not self.glyph_visibility
     objs[show_shape_name].hide = not self.glyph_visibility
+    if self.glyph_visibility and (len(objs[show_name].data.vertices) == 0):
+        # Hidden molecules may not have been loaded, so reload the current frame
+        cellblender_mol_viz.mol_viz_update(self, context)
     return
 
 def glyph_show_only_callback(self, context):
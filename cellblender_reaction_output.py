@@ -22,8 +22,9 @@ This file contains the classes for CellBlender's Reaction Output.
 
 """
 
-import glob
+import concurrent.futures
 import os
+import subprocess
 import tempfile
 import json
 
@@ -49,6 +50,9 @@ from . import parameter_system
 from . import cellblender_release
 from . import cellblender_utils
 from . import cellblender_pbc
+from .data_plotters import plot_manifest
+from . import output_catalog
+from . import react_data_store
 from cellblender.cellblender_utils import project_files_path, mcell_files_path, get_python_path
 
 
@@ -176,6 +180,18 @@ class MCELL_OT_plot_rxn_output_with_selected(bpy.types.Operator):
 
         combine_seeds = mcell.rxn_output.combine_seeds
         mol_colors = mcell.rxn_output.mol_colors
+        aggregate_seeds = mcell.rxn_output.aggregate_seeds
+        summary_band = mcell.rxn_output.summary_band
+        summary_quantiles = []
+        if aggregate_seeds:
+            try:
+                summary_quantiles = react_data_store.parse_quantiles(mcell.rxn_output.summary_quantiles)
+            except ValueError as e:
+                self.report({'ERROR'}, "Invalid quantiles (expected percentiles between 0 and 100): " + str(e))
+                return {'CANCELLED'}
+            if (summary_band == 'quantiles') and (len(summary_quantiles) == 0):
+                self.report({'ERROR'}, "A quantile band needs at least one quantile")
+                return {'CANCELLED'}
 
         # Look up the plotting module by its name
         
@@ -336,144 +352,229 @@ class MCELL_OT_plot_rxn_output_with_selected(bpy.types.Operator):
         # The mcell_files_path is now where the MDL lives:
         create_reactdata_tmpfile(files_path)
 
-        plot_spec_string = "xlabel=time(s) ylabel=count "
-        if plot_legend != 'x':
-            plot_spec_string = plot_spec_string + "legend=" + plot_legend
-
-        for data_path in data_paths:
-
-            for rxn_output in mcell.rxn_output.rxn_output_list:
-
-                if rxn_output.plotting_enabled:
-
-                    molecule_name = rxn_output.molecule_name
-                    object_name = rxn_output.object_name
-                    region_name = rxn_output.region_name
-                    file_name = None
-
-                    if rxn_output.rxn_or_mol == 'Molecule':
-                        if rxn_output.count_location == 'World':
-                            file_name = "%s.World.dat" % (molecule_name)
-                        elif rxn_output.count_location == 'Object':
-                            file_name = "%s.%s.dat" % (molecule_name, object_name)
-                        elif rxn_output.count_location == 'Region':
-                            file_name = "%s.%s.%s.dat" % (molecule_name,
-                                                   object_name, region_name)
-                    elif rxn_output.rxn_or_mol == 'Reaction':
-                        rxn_name = rxn_output.reaction_name
-                        if rxn_output.count_location == 'World':
-                            file_name = "%s.World.dat" % (rxn_name)
-                        elif rxn_output.count_location == 'Object':
-                            file_name = "%s.%s.dat" % (rxn_name, object_name)
-                        elif rxn_output.count_location == 'Region':
-                            file_name = "%s.%s.%s.dat" % (rxn_name,
-                                                   object_name, region_name)
-
-                    elif rxn_output.rxn_or_mol == 'MDLString':
-                        file_name = rxn_output.mdl_file_prefix + "_MDLString.dat"
-
-                    elif rxn_output.rxn_or_mol == 'File':
-                        file_name = rxn_output.data_file_name
-                        print ( "Preparing to plot a File with file_name = " + file_name )
+        # Find the seed files of every output in one catalog of the run directories
+        if use_sweep:
+          catalog = output_catalog.get_catalog(os.path.join(files_path, "output_data"))
+        else:
+          catalog = output_catalog.get_catalog(root_path)
+        # Read from start_time.txt when the first seed file is looked up (plotting just 'File' outputs doesn't need it)
+        start_time = None
+        need_start_time = not mcell.rxn_output.ignore_start_time
 
-                    if file_name:
-                        first_pass = True
+        legend = -1
+        if plot_legend != 'x':
+            legend = int(plot_legend)
+        manifest = plot_manifest.PlotManifest(root_path, xlabel="time(s)", ylabel="count", legend=legend,
+                                              params=["tf=" + ReactionDataTmpFile.reactdata_tmpfile],
+                                              decimate=mcell.rxn_output.decimate_method, pixels=mcell.rxn_output.plot_width)
+
+        # The seeds of each output are summarized in parallel while the plot manifest is built
+        summary_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(8, os.cpu_count() or 1)))
+        summary_futures = []
+
+        try:
+            for data_path in data_paths:
+
+                for rxn_output in mcell.rxn_output.rxn_output_list:
+
+                    if rxn_output.plotting_enabled:
+
+                        molecule_name = rxn_output.molecule_name
+                        object_name = rxn_output.object_name
+                        region_name = rxn_output.region_name
+                        file_name = None
+
+                        if rxn_output.rxn_or_mol == 'Molecule':
+                            if rxn_output.count_location == 'World':
+                                file_name = "%s.World.dat" % (molecule_name)
+                            elif rxn_output.count_location == 'Object':
+                                file_name = "%s.%s.dat" % (molecule_name, object_name)
+                            elif rxn_output.count_location == 'Region':
+                                file_name = "%s.%s.%s.dat" % (molecule_name,
+                                                       object_name, region_name)
+                        elif rxn_output.rxn_or_mol == 'Reaction':
+                            rxn_name = rxn_output.reaction_name
+                            if rxn_output.count_location == 'World':
+                                file_name = "%s.World.dat" % (rxn_name)
+                            elif rxn_output.count_location == 'Object':
+                                file_name = "%s.%s.dat" % (rxn_name, object_name)
+                            elif rxn_output.count_location == 'Region':
+                                file_name = "%s.%s.%s.dat" % (rxn_name,
+                                                       object_name, region_name)
+
+                        elif rxn_output.rxn_or_mol == 'MDLString':
+                            file_name = rxn_output.mdl_file_prefix + "_MDLString.dat"
+
+                        elif rxn_output.rxn_or_mol == 'File':
+                            file_name = rxn_output.data_file_name
+                            print ( "Preparing to plot a File with file_name = " + file_name )
+
+                        if file_name:
+                            first_pass = True
 
-                        if rxn_output.rxn_or_mol == 'File':
-                            # Assume that the file path is blend file relative (begins with "//")
-                            if file_name.startswith ( "//" ):
-                                # Convert the file name from blend file relative to react_data folder relative:
-                                candidate_file_list = [ os.path.pardir + os.path.sep + os.path.pardir + os.path.sep + file_name[2:] ]
-                            else:
-                                # Use the file name as absolute
-                                candidate_file_list = [ file_name ]
-                        else:
-                            # Prepend a search across all seeds for this file
-                            file_name = os.path.join("seed_*", file_name)
-                            if len(data_path[0]) > 0:
-                              print ( "glob of " + os.path.join(root_path, data_path[0], file_name) )
-                              candidate_file_list = glob.glob(os.path.join(root_path, data_path[0], file_name))
-                            else:
-                              print ( "glob of " + os.path.join(root_path, file_name) )
-                              candidate_file_list = glob.glob(os.path.join(root_path, file_name))
-                            # Without sorting, the seeds may not be increasing
-                            candidate_file_list.sort()
-                            #print("Candidate file list for %s:" % (file_name))
-                            #print("  ", candidate_file_list)
-                            if not mcell.rxn_output.ignore_start_time:
-                              # Use the start_time.txt file to find files modified since MCell was started
-                              start_time = os.stat(os.path.join(project_files_path(), "start_time.txt")).st_mtime
-                              # This file is both in the list and newer than the run time for MCell
-                              candidate_file_list = [ffn for ffn in candidate_file_list if os.stat(ffn).st_mtime >= start_time]
-
-                        print ( "Candidate list = " + str(candidate_file_list) )
-
-                        for ffn in candidate_file_list:
-
-                            print ( "   Files path      = " + str(files_path) )
-                            print ( "    Candidate file = " + str(ffn) )
-                            print ( "    Parameter Point = " + str(data_path[1]) )
-
-                            par_string = ""
-                            if len(data_path[1]) > 0:
-                              par_string = " ppt=" + data_path[1]
-
-                            f = None
                             if rxn_output.rxn_or_mol == 'File':
-                              # Use the file name as it is
-                              f = ffn
-                            else:
-                              # Create f as a relative path containing seed/file
-                              #split1 = os.path.split(ffn)
-                              #split2 = os.path.split(split1[0])
-                              #f = os.path.join(split2[1], split1[1])
-
-                              f = ffn[len(root_path)+1:]
-
-                            color_string = ""
-                            if rxn_output.rxn_or_mol == 'Molecule' and mol_colors:
-                                # Use molecule colors for graphs
-                                # Should be standardized!!
-                                mol_mat_name = "mol_%s_mat" % (molecule_name)
-                                #print ("Molecule Material Name = ", mol_mat_name)
-                                #Look up the material
-                                mats = bpy.data.materials
-                                mol_color = mats.get(mol_mat_name).diffuse_color
-                                #print("Molecule color = ", mol_mat.diffuse_color)
-
-                                mol_color_red = int(255 * mol_color.r)
-                                mol_color_green = int(255 * mol_color.g)
-                                mol_color_blue = int(255 * mol_color.b)
-                                color_string = " color=#%2.2x%2.2x%2.2x " % (
-                                    mol_color_red, mol_color_green, mol_color_blue)
-
-                            base_name = os.path.basename(f)
-
-                            if combine_seeds:
-                                title_string = " title=" + base_name
+                                # Assume that the file path is blend file relative (begins with "//")
+                                if file_name.startswith ( "//" ):
+                                    # Convert the file name from blend file relative to react_data folder relative:
+                                    candidate_file_list = [ os.path.pardir + os.path.sep + os.path.pardir + os.path.sep + file_name[2:] ]
+                                else:
+                                    # Use the file name as absolute
+                                    candidate_file_list = [ file_name ]
                             else:
-                                title_string = " title=" + f
-
-                            if plot_sep == ' ':
-                                # No title when all are on the same plot since only
-                                # last will show
-                                title_string = ""
-
-                            if combine_seeds:
-                                psep = " "
-                                if first_pass:
-                                    psep = plot_sep
-                                    first_pass = False
-                                plot_spec_string = (plot_spec_string + psep + color_string + title_string + par_string + " f=" + f)
-                            else:
-                                plot_spec_string = (plot_spec_string + plot_sep + color_string + title_string + par_string + " f=" + f)
+                                # Look up this file in all seeds (in seed order) of this run
+                                run_path = os.path.relpath(os.path.join(root_path, data_path[0]), catalog.top_dir)
+                                if run_path == os.curdir:
+                                  run_path = ""
+                                if need_start_time:
+                                  # Use the start_time.txt file to find files modified since MCell was started
+                                  need_start_time = False
+                                  try:
+                                    start_time = os.stat(os.path.join(project_files_path(), "start_time.txt")).st_mtime
+                                  except OSError as e:
+                                    self.report({'ERROR'}, "Unable to read the MCell start time (or check Ignore Start Time): " + str(e))
+                                    return {'CANCELLED'}
+                                # With a start time, only files modified since MCell was started are used
+                                candidate_file_list = catalog.files(run_path, file_name, newer_than=start_time)
+
+                            band_files = None
+                            if aggregate_seeds and (rxn_output.rxn_or_mol != 'File') and (len(candidate_file_list) > 1):
+                                # Plot the mean and band of the seeds (written to a "summary" directory next to them) in place of the seeds
+                                summary_dir = os.path.join(root_path, data_path[0], react_data_store.SUMMARY_DIR_NAME)
+                                summary_futures.append ( summary_executor.submit ( react_data_store.write_seed_summary,
+                                                         candidate_file_list, summary_dir, summary_quantiles, summary_band ) )
+                                summary_path, mean_path, lower_path, upper_path = react_data_store.seed_summary_paths(candidate_file_list[0], summary_dir)
+                                candidate_file_list = [ mean_path ]
+                                band_files = [ lower_path[len(root_path)+1:], upper_path[len(root_path)+1:] ]
+
+                            print ( "Candidate list = " + str(candidate_file_list) )
+
+                            for ffn in candidate_file_list:
+
+                                print ( "   Files path      = " + str(files_path) )
+                                print ( "    Candidate file = " + str(ffn) )
+                                print ( "    Parameter Point = " + str(data_path[1]) )
+
+                                par_name = None
+                                if len(data_path[1]) > 0:
+                                  par_name = data_path[1]
+
+                                f = None
+                                if rxn_output.rxn_or_mol == 'File':
+                                  # Use the file name as it is
+                                  f = ffn
+                                else:
+                                  # Create f as a relative path containing seed/file
+                                  #split1 = os.path.split(ffn)
+                                  #split2 = os.path.split(split1[0])
+                                  #f = os.path.join(split2[1], split1[1])
+
+                                  f = ffn[len(root_path)+1:]
+
+                                color = None
+                                if rxn_output.rxn_or_mol == 'Molecule' and mol_colors:
+                                    # Use molecule colors for graphs
+                                    # Should be standardized!!
+                                    mol_mat_name = "mol_%s_mat" % (molecule_name)
+                                    #print ("Molecule Material Name = ", mol_mat_name)
+                                    #Look up the material
+                                    mats = bpy.data.materials
+                                    mol_color = mats.get(mol_mat_name).diffuse_color
+                                    #print("Molecule color = ", mol_mat.diffuse_color)
+
+                                    mol_color_red = int(255 * mol_color.r)
+                                    mol_color_green = int(255 * mol_color.g)
+                                    mol_color_blue = int(255 * mol_color.b)
+                                    color = "#%2.2x%2.2x%2.2x" % (
+                                        mol_color_red, mol_color_green, mol_color_blue)
+
+                                base_name = os.path.basename(f)
+
+                                if combine_seeds:
+                                    title = base_name
+                                else:
+                                    title = f
+
+                                if plot_sep == ' ':
+                                    # No title when all are on the same plot since only
+                                    # last will show
+                                    title = None
+
+                                layout = plot_sep
+                                if combine_seeds:
+                                    if first_pass:
+                                        first_pass = False
+                                    else:
+                                        layout = " "
+
+                                lower = None
+                                upper = None
+                                if band_files:
+                                    lower, upper = band_files
+                                manifest.add_series ( f, layout=layout, title=title, color=color, name=par_name, lower=lower, upper=upper )
+
+            summary_executor.shutdown(wait=True)
+            for future in summary_futures:
+                try:
+                    future.result()
+                except (IOError, OSError, ValueError) as e:
+                    print ( "Unable to summarize the seeds: " + str(e) )
+                    self.report({'ERROR'}, "Unable to summarize the seeds: " + str(e))
+                    return {'CANCELLED'}
+        finally:
+            # Don't leave the summary threads behind when the plot is cancelled
+            summary_executor.shutdown(wait=False)
 
-        plot_spec_string += " tf="+ReactionDataTmpFile.reactdata_tmpfile
         print("Plotting from", root_path)
-        print("Plotting spec", plot_spec_string)
+        print("Plotting " + str(manifest.num_series()) + " files")
         python_path = get_python_path(mcell=mcell)
-        plot_module.plot(root_path, plot_spec_string, python_path)
+        if hasattr(plot_module, "plot_manifest"):
+            try:
+                manifest_path = plot_manifest.new_manifest_path(root_path)
+                manifest.write(manifest_path)
+            except (IOError, OSError) as e:
+                self.report({'ERROR'}, "Unable to write the plot manifest: " + str(e))
+                return {'CANCELLED'}
+            print("Plotting manifest", manifest_path)
+            plot_module.plot_manifest(root_path, manifest_path, python_path)
+        else:
+            plot_spec_string = manifest.plot_spec()
+            print("Plotting spec", plot_spec_string)
+            plot_module.plot(root_path, plot_spec_string, python_path)
+
+        return {'FINISHED'}
+
 
+class MCELL_OT_plot_sweep_summary(bpy.types.Operator):
+    bl_idname = "mcell.plot_sweep_summary"
+    bl_label = "Plot Sweep Summary"
+    bl_description = "Summarize every reaction output over the sweep and plot one statistic of one output against the swept parameters (runs in the background)"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        mcell = context.scene.mcell
+        rxn_output = mcell.rxn_output
+        if rxn_output.sweep_summary_file == '':
+            self.report({'ERROR'}, "Enter the reaction data file to plot (such as a.World.dat)")
+            return {'CANCELLED'}
+        python_path = get_python_path(mcell=mcell)
+        if python_path is None:
+            self.report({'ERROR'}, "Unable to find a Python to run the sweep summary")
+            return {'CANCELLED'}
+
+        files_path = mcell_files_path()
+        script_file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sweep_summary.py")
+        args = [python_path, script_file_path,
+                "-plot=" + rxn_output.sweep_summary_file, "-stat=" + rxn_output.sweep_summary_stat]
+        if rxn_output.sweep_summary_threshold.strip() != '':
+            try:
+                args.append("-threshold=%.15g" % (float(rxn_output.sweep_summary_threshold)))
+            except ValueError:
+                self.report({'ERROR'}, "The threshold must be a number (or blank for half of the peak)")
+                return {'CANCELLED'}
+        args.append(files_path)
+        print ( "Summarizing the sweep with: " + " ".join(args) )
+        subprocess.Popen(args, stdout=None, stderr=None)
+        self.report({'INFO'}, "Summarizing the sweep into " + os.path.join(files_path, "sweep_summary"))
         return {'FINISHED'}
 
 
@@ -851,6 +952,49 @@ class MCellReactionOutputPropertyGroup(bpy.types.PropertyGroup):
         name="Molecule Colors",
         description="Use Molecule Colors for line colors.",
         default=False)
+    aggregate_seeds = BoolProperty(
+        name="Summarize Seeds",
+        description="Plot the mean of all seeds with a band around it instead of every seed.",
+        default=False)
+    summary_band_enum = [
+        ('std', "Standard Deviation", "Band of one standard deviation around the mean"),
+        ('sem', "Standard Error", "Band of one standard error of the mean around the mean"),
+        ('quantiles', "Quantiles", "Band from the lowest to the highest quantile")]
+    summary_band = EnumProperty(
+        items=summary_band_enum, name="Band",
+        description="Band to plot around the mean of the seeds",
+        default='std')
+    decimate_method_enum = [
+        ('minmax', "Min/Max", "Keep the lowest and highest point of each pixel (spikes stay visible)"),
+        ('lttb', "Largest Triangle", "Keep the points that best preserve the shape of the curve (LTTB)")]
+    decimate_method = EnumProperty(
+        items=decimate_method_enum, name="Thinning",
+        description="How to thin long curves before plotting",
+        default='minmax')
+    plot_width = IntProperty(
+        name="Plot Width", min=0, default=2000,
+        description="Thin curves to about this many points (pixels) before plotting (0 plots every point)")
+    sweep_summary_file = StringProperty(
+        name="Output File",
+        description="Reaction data file to plot against the swept parameters (such as a.World.dat)",
+        default="")
+    sweep_summary_stat_enum = [
+        ('final', "Final Value", "Last value of the run"),
+        ('mean', "Time Average", "Average over the whole run"),
+        ('peak', "Peak", "Highest value of the run"),
+        ('t_threshold', "Time to Threshold", "First time the value reaches the threshold")]
+    sweep_summary_stat = EnumProperty(
+        items=sweep_summary_stat_enum, name="Statistic",
+        description="Statistic of each run to plot against the swept parameters",
+        default='final')
+    sweep_summary_threshold = StringProperty(
+        name="Threshold",
+        description="Value for Time to Threshold (blank uses half of each run's peak)",
+        default="")
+    summary_quantiles = StringProperty(
+        name="Quantiles",
+        description="Percentiles to compute over the seeds (comma separated, e.g. 5,50,95).",
+        default="5,50,95")
     #use_sweep = BoolProperty(
     #    name="Use Sweep",
     #    description="Plot from the sweep file.",
@@ -1170,6 +1314,34 @@ class MCellReactionOutputPropertyGroup(bpy.types.PropertyGroup):
             col = row.column()
             col.prop ( self, "ignore_start_time" )
 
+            row = layout.row()
+            col = row.column()
+            col.prop ( self, "plot_width" )
+            col = row.column()
+            col.prop ( self, "decimate_method" )
+
+            row = layout.row()
+            col = row.column()
+            col.prop ( self, "aggregate_seeds" )
+            if self.aggregate_seeds:
+                col = row.column()
+                col.prop ( self, "summary_band" )
+                row = layout.row()
+                row.prop ( self, "summary_quantiles" )
+
+            row = layout.row()
+            row.label(text="Sweep Summary:")
+            row = layout.row()
+            col = row.column()
+            col.prop ( self, "sweep_summary_file" )
+            col = row.column()
+            col.prop ( self, "sweep_summary_stat" )
+            row = layout.row()
+            col = row.column()
+            col.prop ( self, "sweep_summary_threshold" )
+            col = row.column()
+            col.operator("mcell.plot_sweep_summary")
+
 
 
     def draw_panel ( self, context, panel ):
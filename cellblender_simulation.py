@@ -693,6 +693,9 @@ class MCELL_OT_percentage_done_timer(bpy.types.Operator):
                 else:
                     simulation_process.name = "PID: %d, Seed: %d, %d%%" % (pid, seed, percent)
 
+            # Pick up any new viz frames when following the simulation
+            cellblender.cellblender_mol_viz.follow_mol_viz_files(context, final=(task_len == task_ctr))
+
             # just a silly way of forcing a screen update. ¯\_(ツ)_/¯
             color = context.user_preferences.themes[0].view_3d.space.gradients.high_gradient
             color.h += 0.01
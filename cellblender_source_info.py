@@ -38,6 +38,13 @@ cellblender_info = {
         "cellblender_partitions.py",
         "cellblender_simulation.py",
         "cellblender_mol_viz.py",
+        "mol_viz_data.py",
+        "mol_viz_cache.py",
+        "mol_viz_pack.py",
+        "mol_viz_analysis.py",
+        "react_data_store.py",
+        "output_catalog.py",
+        "sweep_summary.py",
         "cellblender_meshalyzer.py",
         "cellblender_objects.py",
         "cellblender_scripting.py",
@@ -99,6 +106,7 @@ cellblender_info = {
         "io_mesh_mcell_mdl"+os.sep+"vector.h",
 
         "data_plotters"+os.sep+"__init__.py",
+        "data_plotters"+os.sep+"plot_manifest.py",
         "data_plotters"+os.sep+"mpl_simple"+os.sep+"__init__.py",
         "data_plotters"+os.sep+"mpl_simple"+os.sep+"mpl_simple.py",
         "data_plotters"+os.sep+"mpl_plot"+os.sep+"__init__.py",
@@ -200,6 +208,7 @@ cellblender_info = {
 
         "sim_engines"+os.sep+"smoldyn248"+os.sep+"makefile",
         "sim_engines"+os.sep+"smoldyn248"+os.sep+"__init__.py",
+        "sim_engines"+os.sep+"smoldyn248"+os.sep+"smoldyn_viz_convert.py",
 
         "sim_engines"+os.sep+"limited_cpp"+os.sep+"makefile",
         "sim_engines"+os.sep+"limited_cpp"+os.sep+"__init__.py",
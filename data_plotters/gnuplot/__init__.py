@@ -2,6 +2,8 @@ import os
 import subprocess
 import math
 
+from cellblender.data_plotters.plot_manifest import read_manifest, manifest_series
+
 
 def find_in_path(program_name):
     for path in os.environ.get('PATH', '').split(os.pathsep):
@@ -25,10 +27,6 @@ def requirements_met():
 
 
 def plot(data_path, plot_spec, python_path=None):
-    program_path = os.path.dirname(__file__)
-
-    plot_cmd = find_in_path("gnuplot")
-    
     # Get the file names from the generic command (f=seed_00001/file1.dat f=seed_00001/file2.dat)
     
     file_list = []
@@ -40,6 +38,25 @@ def plot(data_path, plot_spec, python_path=None):
       elif plot_param[0:6] == "legend":
         legend = ""
 
+    plot_files ( data_path, file_list, legend )
+
+
+def plot_manifest(data_path, manifest_path, python_path=None):
+    # Get the file names from the manifest (the files are sent to gnuplot through its input, not the command line)
+
+    manifest = read_manifest ( manifest_path )
+
+    file_list = [ series["file"] for page, plot, series in manifest_series(manifest) ]
+    legend = " notitle"
+    if manifest["legend"] >= 0:
+      legend = ""
+
+    plot_files ( data_path, file_list, legend )
+
+
+def plot_files(data_path, file_list, legend):
+    plot_cmd = find_in_path("gnuplot")
+
     num_plots = len(file_list)
 
     print("This figure has " + str(num_plots) + " plots")
@@ -18,11 +18,29 @@ def requirements_met():
     return ok
 
 
+def plot_command(data_path, python_cmd):
+    """ Return the start of the command running mpl_plot.py (with the defaults file if any). """
+    program_path = os.path.dirname(__file__)
+
+    plot_cmd = []
+    plot_cmd.append(python_cmd)
+    plot_cmd.append(os.path.join(program_path, "mpl_plot.py"))
+
+    defaults_name = os.path.join(data_path, "mpl_defaults.py")
+    print("Checking for defaults file at: " + defaults_name)
+    if os.path.exists(defaults_name):
+        plot_cmd.append("defs=" + defaults_name)
+    else:
+        defaults_name = os.path.join(program_path, "mpl_defaults.py")
+        print("Checking for defaults file at: " + defaults_name)
+        if os.path.exists(defaults_name):
+            plot_cmd.append("defs=" + defaults_name)
+    return plot_cmd
+
+
 def plot(data_path, plot_spec, python_path=None):
     # The bundled version of python now has maplotlib, so we can use it here.
-    program_path = os.path.dirname(__file__)
     # print("MPL Plotter called with %s, %s" % (data_path, plot_spec))
-    # print("Plotter-specific files are located here: %s" %(program_path))
 
     # mpl_plot.py accepts all generic parameters, so no translation is needed
 
@@ -31,19 +49,7 @@ def plot(data_path, plot_spec, python_path=None):
     if python_cmd is None:
         print("Unable to plot: python not found in path")
     else:
-        plot_cmd = []
-        plot_cmd.append(python_cmd)
-        plot_cmd.append(os.path.join(program_path, "mpl_plot.py"))
-
-        defaults_name = os.path.join(data_path, "mpl_defaults.py")
-        print("Checking for defaults file at: " + defaults_name)
-        if os.path.exists(defaults_name):
-            plot_cmd.append("defs=" + defaults_name)
-        else:
-            defaults_name = os.path.join(program_path, "mpl_defaults.py")
-            print("Checking for defaults file at: " + defaults_name)
-            if os.path.exists(defaults_name):
-                plot_cmd.append("defs=" + defaults_name)
+        plot_cmd = plot_command(data_path, python_cmd)
 
         for generic_param in plot_spec.split():
             plot_cmd.append(generic_param)
@@ -51,3 +57,19 @@ def plot(data_path, plot_spec, python_path=None):
         print ( "Plotting from: " + data_path )
         print ( "Plotting with: \"" + ' '.join(plot_cmd) + "\"" )
         pid = subprocess.Popen(plot_cmd, cwd=data_path)
+
+
+def plot_manifest(data_path, manifest_path, python_path=None):
+    # mpl_plot.py reads the manifest itself (see plot_manifest.py)
+
+    python_cmd = python_path
+
+    if python_cmd is None:
+        print("Unable to plot: python not found in path")
+    else:
+        plot_cmd = plot_command(data_path, python_cmd)
+        plot_cmd.append("manifest=" + manifest_path)
+
+        print ( "Plotting from: " + data_path )
+        print ( "Plotting with: \"" + ' '.join(plot_cmd) + "\"" )
+        pid = subprocess.Popen(plot_cmd, cwd=data_path)
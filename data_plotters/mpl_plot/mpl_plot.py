@@ -16,20 +16,32 @@ This is the current plan for a simple plotting syntax:
   color=clr : set color
   xaxis=label : set label for x axis
   yaxis=label : set label for y axis
+
+ A plot manifest (see plot_manifest.py) can be given instead of the commands:
+
+  manifest=name : read the commands from manifest file "name"
 '''
 
-from numpy import math, fromfile
+from numpy import math, fromfile, interp
+import os
 import sys
 import matplotlib as mpl
 mpl.use("TkAgg")
 import matplotlib.pyplot as plt
 
+# Reaction data files are read through the shared binary cache (see react_data_store.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import react_data_store
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import plot_manifest
+
 
 if (len(sys.argv) < 2):
     print('')
     print('\nUsage: %s commands...' % (sys.argv[0]))
     print('  Defines plots via commands:')
     print('    defs=filename        ... Loads default parameters from a python file')
+    print('    manifest=filename    ... Reads the commands from a plot manifest (JSON) file')
     print('    page                 ... Starts a new page (figure in MatPlotLib)')
     print('    plot                 ... Starts a new plot (subplot in MatPlotLib)')
     print('    color=#rrggbb        ... Selects a color via Red,Green,Blue values')
@@ -40,11 +52,31 @@ if (len(sys.argv) < 2):
     print('    ylabel=label_string  ... Sets the label for the y axis')
     print('    legend=code          ... Adds a legend with code = 0..10 (-1=none)')
     print('    n=name               ... Name used to over-ride file name in legend')
+    print('    decimate=method      ... Thins long curves with minmax or lttb (see pixels)')
+    print('    pixels=width         ... Thins long curves to about this many points (0=off)')
+    print('    lower=filename       ... Lower bound of a band around the next file')
+    print('    upper=filename       ... Upper bound of a band around the next file')
     print('    f=filename           ... Plots the file with current settings')
     print('')
     exit(1)
 
 
+decimate_method = "minmax"
+decimate_pixels = 0
+
+
+def read_xy(fn):
+    ''' Returns the x and y values of a data file (decimated when pixels is set) '''
+    try:
+        x, y = react_data_store.read_react_xy(fn)
+    except ValueError:
+        # Not a regular reaction data file, so read it as pairs of values
+        data = fromfile(fn,sep=' ')
+        x = data[0::2]
+        y = data[1::2]
+    return react_data_store.decimate(x, y, decimate_pixels, decimate_method)
+
+
 def subdivide(l, sep):
     ''' Splits a list into sublists by dividing at (and removing) instances of sep '''
     nl = []
@@ -75,6 +107,9 @@ for cmd in params:
         # print "Executing " + command
 #        execfile(command)
         exec(open(command).read())
+    elif cmd[0:9] == "manifest=":
+        print("Manifest: " + cmd)
+        remaining_params = remaining_params + plot_manifest.manifest_commands(plot_manifest.read_manifest(cmd[9:]))
     else:
         remaining_params = remaining_params + [cmd]
 
@@ -117,6 +152,8 @@ ylabel = ""
 color = None
 legend = -1
 name = None
+lower = None
+upper = None
 
 for page in plot_cmds:
     # print "Plotting " + str(page)
@@ -175,20 +212,35 @@ for page in plot_cmds:
             elif cmd[0:4] == "ppt=":
                 # print "Name command: " + cmd
                 name = cmd[4:]
+            elif cmd[0:9] == "decimate=":
+                decimate_method = cmd[9:]
+            elif cmd[0:7] == "pixels=":
+                decimate_pixels = int(cmd[7:])
+            elif cmd[0:6] == "lower=":
+                lower = cmd[6:]
+            elif cmd[0:6] == "upper=":
+                upper = cmd[6:]
             elif cmd[0:2] == "f=":
                 # print "File command: " + cmd
                 fn = cmd[2:]
                 # print "    File name = " + fn
-                data = fromfile(fn,sep=' ')
-                x = data[0::2]
-                y = data[1::2]
+                x, y = read_xy(fn)
                 if name is None:
                     name = fn
                 if color is None:
-                    ax.plot(x, y, label=name)
+                    lines = ax.plot(x, y, label=name)
                 else:
-                    ax.plot(x, y, label=name, c=color)
+                    lines = ax.plot(x, y, label=name, c=color)
+                if (lower is not None) and (upper is not None):
+                    # Shade the band in the color of the line
+                    lower_x, lower_y = read_xy(lower)
+                    upper_x, upper_y = read_xy(upper)
+                    # Decimated bounds may keep different times, so the upper bound is interpolated
+                    upper_y = interp(lower_x, upper_x, upper_y)
+                    ax.fill_between(lower_x, lower_y, upper_y, color=lines[0].get_color(), alpha=0.25, linewidth=0)
                 name = None
+                lower = None
+                upper = None
                 ax.spines['top'].set_color('none')
                 ax.spines['right'].set_color('none')
                 ax.xaxis.set_ticks_position('bottom')
@@ -55,3 +55,19 @@ def plot(data_path, plot_spec, python_path=None):
         print ( "Plotting from: " + data_path )
         print ( "Plot Command:  " + " ".join(plot_cmd) )
         pid = subprocess.Popen(plot_cmd, cwd=data_path)
+
+
+def plot_manifest(data_path, manifest_path, python_path=None):
+    # mpl_simple.py reads the manifest itself (see plot_manifest.py)
+    program_path = os.path.dirname(__file__)
+
+    python_cmd = python_path
+
+    if python_cmd is None:
+        print("Unable to plot: python not found in path")
+    else:
+        plot_cmd = [python_cmd, os.path.join(program_path, "mpl_simple.py"), "-manifest=" + manifest_path]
+
+        print ( "Plotting from: " + data_path )
+        print ( "Plot Command:  " + " ".join(plot_cmd) )
+        pid = subprocess.Popen(plot_cmd, cwd=data_path)
@@ -1,17 +1,52 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import numpy
 import matplotlib as mpl
 mpl.use("TkAgg")
 import matplotlib.pyplot as plt
 
+# Reaction data files are read through the shared binary cache (see react_data_store.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import react_data_store
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import plot_manifest
+
+
+def read_xy(filename, decimate=None):
+    try:
+        x, y = react_data_store.read_react_xy(filename)
+    except ValueError:
+        # Not a regular reaction data file, so read it as pairs of values
+        data = numpy.fromfile(filename,sep=' ')
+        x = data[0::2]
+        y = data[1::2]
+    if decimate is not None:
+        x, y = react_data_store.decimate(x, y, decimate["pixels"], decimate["method"])
+    return (x, y)
+
+
+def plot_file(ax, filename, label, lower=None, upper=None, decimate=None):
+    print('Plotting %s' % (filename))
+    x, y = read_xy(filename, decimate)
+    lines = ax.plot(x, y, label=label)
+    if (lower is not None) and (upper is not None):
+        # Shade the band in the color of the line
+        lower_x, lower_y = read_xy(lower, decimate)
+        upper_x, upper_y = read_xy(upper, decimate)
+        upper_y = numpy.interp(lower_x, upper_x, upper_y)
+        ax.fill_between(lower_x, lower_y, upper_y, color=lines[0].get_color(), alpha=0.25, linewidth=0)
+
+
 if (__name__ == '__main__'):
 
     if (len(sys.argv) < 2):
         print('')
         print('\nUsage: %s f1 [f2 [f3 [...]]] ' % (sys.argv[0]))
         print('          Plot all listed files using simple defaults.')
+        print('       %s -manifest=filename' % (sys.argv[0]))
+        print('          Plot all files of a plot manifest (JSON) file.')
         print('')
         exit(1)
 
@@ -37,14 +72,16 @@ if (__name__ == '__main__'):
             legend = False
         elif filename[0:3] == "-n=":
             label = filename[3:]
+        elif filename[0:10] == "-manifest=":
+            manifest = plot_manifest.read_manifest(filename[10:])
+            legend = manifest["legend"] >= 0
+            for page, plot, series in plot_manifest.manifest_series(manifest):
+                plot_file(ax, series["file"], series.get("name", series["file"]), series.get("lower"), series.get("upper"),
+                          manifest.get("decimate"))
         else:
-            print('Plotting %s' % (filename))
             if len(label) == 0:
               label = filename
-            data = numpy.fromfile(sys.argv[i],sep=' ')
-            x = data[0::2]
-            y = data[1::2]
-            ax.plot(x, y, label=label)
+            plot_file(ax, filename, label)
             label = ""
 
     if legend:
@@ -0,0 +1,229 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the plot manifest: a JSON description of what to plot.
+
+Instead of passing every file on the command line (the generic plot spec
+"page plot color=... title=... f=file ..."), the plot operator writes a
+manifest file and passes its path to plotters that define:
+
+    plot_manifest(data_path, manifest_path, python_path=None)
+
+Plotters without it are still called with the generic plot spec string
+built from the manifest (see PlotManifest.plot_spec).
+
+A manifest looks like:
+
+    {
+      "version": 1,
+      "data_path": "/path/to/react_data",
+      "xlabel": "time(s)", "ylabel": "count", "legend": 0,
+      "decimate": {"method": "minmax", "pixels": 2000},
+      "params": ["tf=/tmp/cellblenderXXXX"],
+      "pages": [
+        {"title": "", "plots": [
+          {"title": "a.World.dat", "series": [
+            {"file": "seed_00001/a.World.dat", "title": "a.World.dat",
+             "color": "#ff0000", "name": "a=1"},
+            {"file": "summary/a.World.mean.dat",
+             "lower": "summary/a.World.lower.dat", "upper": "summary/a.World.upper.dat"}
+          ]}
+        ]}
+      ]
+    }
+
+The operator writes each manifest to a new file in a scratch directory of
+the project (see new_manifest_path), where only the latest few are kept.
+
+File paths are relative to data_path (or absolute). A legend of -1 means
+no legend. The optional "decimate" asks plotters to thin long curves down
+to about "pixels" points (see react_data_store.decimate). Every series key
+other than "file" is optional: "lower" and "upper" name pre-aggregated
+files bounding a band around the series.
+
+Nothing in here depends on Blender, so the plotting scripts can import it.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import time
+
+
+MANIFEST_VERSION = 1
+
+# Scratch directory (below the data directory) of the manifest files written for plotting
+MANIFEST_DIR_NAME = ".plot_manifests"
+MANIFEST_PREFIX = "plot_"
+MANIFEST_SUFFIX = ".json"
+
+# Number of manifest files kept, and the age (in seconds) a file must reach
+# before it is pruned (a plotter started just before may not have read it yet)
+MANIFEST_KEEP = 10
+MANIFEST_MIN_AGE = 60.0
+
+# Series keys and the generic plot spec commands they are written as
+SERIES_SPEC_KEYS = [("color", "color="), ("title", "title="), ("name", "ppt=")]
+
+
+class PlotManifest:
+    """ Builder for a plot manifest (see the module documentation). """
+
+    def __init__(self, data_path, xlabel="", ylabel="", legend=-1, params=(), decimate=None, pixels=0):
+        self.manifest = collections.OrderedDict()
+        self.manifest["version"] = MANIFEST_VERSION
+        self.manifest["data_path"] = data_path
+        self.manifest["xlabel"] = xlabel
+        self.manifest["ylabel"] = ylabel
+        self.manifest["legend"] = legend
+        if decimate and (pixels > 0):
+            self.manifest["decimate"] = collections.OrderedDict([("method", decimate), ("pixels", pixels)])
+        self.manifest["params"] = list(params)
+        self.manifest["pages"] = []
+
+    def new_page(self, title=""):
+        self.manifest["pages"].append(collections.OrderedDict([("title", title), ("plots", [])]))
+
+    def new_plot(self, title=""):
+        if len(self.manifest["pages"]) == 0:
+            self.new_page()
+        self.manifest["pages"][-1]["plots"].append(collections.OrderedDict([("title", title), ("series", [])]))
+
+    def add_series(self, filename, layout="", title=None, color=None, name=None, lower=None, upper=None):
+        """ Add a file to the plot, first starting a new "page" or "plot" when layout says so. """
+        layout = layout.strip()
+        if (layout == "page") or (len(self.manifest["pages"]) == 0):
+            self.new_page()
+        if (layout in ("page", "plot")) or (len(self.manifest["pages"][-1]["plots"]) == 0):
+            self.new_plot()
+        plot = self.manifest["pages"][-1]["plots"][-1]
+        series = collections.OrderedDict([("file", filename)])
+        for key, value in (("title", title), ("color", color), ("name", name), ("lower", lower), ("upper", upper)):
+            if value:
+                series[key] = value
+        if title:
+            plot["title"] = title
+        plot["series"].append(series)
+        return series
+
+    def num_series(self):
+        return sum([len(plot["series"]) for page in self.manifest["pages"] for plot in page["plots"]])
+
+    def write(self, manifest_path):
+        """ Write the manifest (through a temporary file, so readers never see a partial one). """
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def plot_spec(self):
+        """ Return the manifest as a generic plot spec string (for plotters without plot_manifest). """
+        return " ".join(manifest_commands(self.manifest, band_commands=False))
+
+
+def read_manifest(manifest_path):
+    """ Read a plot manifest, checking its version. """
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f, object_pairs_hook=collections.OrderedDict)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Unsupported plot manifest version %s in %s" % (str(manifest.get("version")), manifest_path))
+    return manifest
+
+
+def manifest_series(manifest):
+    """ Yield (page, plot, series) for every series of a manifest, in order. """
+    for page in manifest["pages"]:
+        for plot in page["plots"]:
+            for series in plot["series"]:
+                yield (page, plot, series)
+
+
+def manifest_commands(manifest, band_commands=True):
+    """ Return the manifest as a list of generic plot spec commands.
+
+    Values are not split on spaces, so a plotting script that takes the list
+    directly (rather than a command line) keeps titles with spaces intact.
+    Band files are written as "lower=" and "upper=" commands before their
+    series' "f=", or without band_commands as two more "f=" lines after it.
+    """
+    commands = []
+    if manifest["xlabel"]:
+        commands.append("xlabel=" + manifest["xlabel"])
+    if manifest["ylabel"]:
+        commands.append("ylabel=" + manifest["ylabel"])
+    if manifest["legend"] >= 0:
+        commands.append("legend=%d" % (manifest["legend"]))
+    if "decimate" in manifest:
+        commands.append("decimate=" + manifest["decimate"]["method"])
+        commands.append("pixels=%d" % (manifest["decimate"]["pixels"]))
+    for page_num, page in enumerate(manifest["pages"]):
+        if page_num > 0:
+            commands.append("page")
+        if page.get("title"):
+            commands.append("pagetitle=" + page["title"])
+        for plot_num, plot in enumerate(page["plots"]):
+            if plot_num > 0:
+                commands.append("plot")
+            for series in plot["series"]:
+                for key, command in SERIES_SPEC_KEYS:
+                    if key in series:
+                        commands.append(command + series[key])
+                band_keys = [key for key in ("lower", "upper") if key in series]
+                if band_commands:
+                    commands.extend([key + "=" + series[key] for key in band_keys])
+                commands.append("f=" + series["file"])
+                if not band_commands:
+                    commands.extend(["f=" + series[key] for key in band_keys])
+    commands.extend(manifest["params"])
+    return commands
+
+
+def prune_manifests(manifest_dir, keep=MANIFEST_KEEP, min_age=MANIFEST_MIN_AGE):
+    """ Delete all but the newest keep manifest files of a scratch directory (sparing recent ones). """
+    entries = []
+    try:
+        for entry in os.scandir(manifest_dir):
+            if entry.name.startswith(MANIFEST_PREFIX) and entry.is_file():
+                entries.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        return
+    entries.sort(reverse=True)
+    now = time.time()
+    for mtime, path in entries[keep:]:
+        if now - mtime >= min_age:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def new_manifest_path(data_path):
+    """ Return the path of a new (empty) manifest file in the scratch directory below data_path.
+
+    Each plot gets its own file, since a plotter may read its manifest after
+    the next plot is started. Old files are pruned first.
+    """
+    manifest_dir = os.path.join(data_path, MANIFEST_DIR_NAME)
+    os.makedirs(manifest_dir, exist_ok=True)
+    prune_manifests(manifest_dir)
+    fd, manifest_path = tempfile.mkstemp(prefix=MANIFEST_PREFIX, suffix=MANIFEST_SUFFIX, dir=manifest_dir)
+    os.close(fd)
+    return manifest_path
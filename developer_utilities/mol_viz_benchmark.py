@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+'''
+Benchmark for decoding CellBlender binary viz files.
+
+Writes a synthetic frame with the requested number of molecules (split over
+a few volume and surface species) and times the original array.array based
+reading loop against the memory mapped NumPy decoder in mol_viz_data.py.
+With -ascii the frame is written as ASCII and the original line by line
+parser is timed against the chunked NumPy parser instead.
+
+Usage:
+
+    python mol_viz_benchmark.py [-ascii] [num_molecules ...]
+
+The default is to run with 1 million and 10 million molecules per frame.
+'''
+
+import array
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mol_viz_data
+
+
+def write_frame(filepath, num_molecules, num_species=4):
+    """ Write a version 1 binary frame with every other species on a surface. """
+    per_species = num_molecules // num_species
+    with open(filepath, "wb") as f:
+        array.array("I", [1]).tofile(f)
+        for i in range(num_species):
+            name = ("species_%d" % i).encode()
+            mol_type = i % 2
+            f.write(bytearray([len(name)]))
+            f.write(name)
+            f.write(bytearray([mol_type]))
+            array.array("I", [3*per_species]).tofile(f)
+            numpy.random.uniform(-1.0, 1.0, 3*per_species).astype(numpy.float32).tofile(f)
+            if mol_type == 1:
+                numpy.random.uniform(-1.0, 1.0, 3*per_species).astype(numpy.float32).tofile(f)
+
+
+def write_ascii_frame(filepath, num_molecules, num_species=4):
+    """ Write an ASCII frame with every other species on a surface. """
+    per_species = num_molecules // num_species
+    with open(filepath, "w") as f:
+        for i in range(num_species):
+            data = numpy.zeros((per_species, 6), dtype=numpy.float32)
+            data[:, :3] = numpy.random.uniform(-1.0, 1.0, (per_species, 3))
+            if i % 2 == 1:
+                data[:, 3:] = numpy.random.uniform(-1.0, 1.0, (per_species, 3))
+            lines = ["species_%d %d %.6g %.6g %.6g %.6g %.6g %.6g\n" % ((i, j) + tuple(row))
+                     for j, row in enumerate(data.tolist())]
+            f.write("".join(lines))
+
+
+def legacy_read_ascii(filepath):
+    """ The ASCII reading loop that cellblender_mol_viz.py used before mol_viz_data.py. """
+    mol_dict = {}
+    mol_file = open(filepath, "r")
+    mol_data = [[s.split()[0], [
+        float(x) for x in s.split()[2:]]] for s in mol_file.read().split("\n") if s != ""]
+    mol_file.close()
+    for mol in mol_data:
+        mol_name = "mol_%s" % (mol[0])
+        if not mol_name in mol_dict:
+            mol_orient = mol[1][3:]
+            mt = 0
+            if ((mol_orient[0] != 0.0) | (mol_orient[1] != 0.0) |
+                    (mol_orient[2] != 0.0)):
+                mt = 1
+            mol_dict[mol_name] = [mt, array.array("f"), array.array("f")]
+        mt = mol_dict[mol_name][0]
+        mol_dict[mol_name][1].extend(mol[1][:3])
+        if mt == 1:
+            mol_dict[mol_name][2].extend(mol[1][3:])
+    return mol_dict
+
+
+def legacy_read(filepath):
+    """ The reading loop that cellblender_mol_viz.py used before mol_viz_data.py. """
+    mol_file = open(filepath, "rb")
+    b = array.array("I")
+    b.fromfile(mol_file, 1)
+    mol_dict = {}
+    while True:
+        try:
+            ni = array.array("B")
+            ni.fromfile(mol_file, 1)
+            ns = array.array("B")
+            ns.fromfile(mol_file, ni[0])
+            s = ns.tobytes().decode()
+            mol_name = "mol_%s" % (s)
+            mt = array.array("B")
+            mt.fromfile(mol_file, 1)
+            ni = array.array("I")
+            ni.fromfile(mol_file, 1)
+            mol_pos = array.array("f")
+            mol_orient = array.array("f")
+            mol_pos.fromfile(mol_file, ni[0])
+            if mt[0] == 1:
+                mol_orient.fromfile(mol_file, ni[0])
+            mol_dict[mol_name] = [mt[0], mol_pos, mol_orient]
+        except EOFError:
+            mol_file.close()
+            break
+    return mol_dict
+
+
+def best_time(function, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    ascii = "-ascii" in args
+    if ascii:
+        args.remove("-ascii")
+    counts = [1000000, 10000000]
+    if len(args) > 0:
+        counts = [int(float(a)) for a in args]
+
+    tmp_dir = tempfile.mkdtemp(prefix="mol_viz_benchmark")
+    for num_molecules in counts:
+        filepath = os.path.join(tmp_dir, "Scene.cellbin.%d.dat" % num_molecules)
+        if ascii:
+            write_ascii_frame(filepath, num_molecules)
+        else:
+            write_frame(filepath, num_molecules)
+        size_mb = os.stat(filepath).st_size / 1048576.0
+
+        print("%d molecules (%.1f MB):" % (num_molecules, size_mb))
+        if ascii:
+            legacy = best_time(lambda: legacy_read_ascii(filepath), repeat=1)
+            chunked = best_time(lambda: mol_viz_data.read_mol_viz_file(filepath))
+            print("  line by line parser:   %8.2f ms" % (1000 * legacy))
+            print("  chunked NumPy parser:  %8.2f ms" % (1000 * chunked))
+        else:
+            legacy = best_time(lambda: legacy_read(filepath))
+            mapped = best_time(lambda: mol_viz_data.read_mol_viz_file(filepath))
+            copied = best_time(lambda: mol_viz_data.read_mol_viz_file(filepath, copy=True))
+            print("  array.array loop:      %8.2f ms" % (1000 * legacy))
+            print("  mmap + NumPy views:    %8.2f ms" % (1000 * mapped))
+            print("  mmap + NumPy (copied): %8.2f ms" % (1000 * copied))
+        os.remove(filepath)
+    os.rmdir(tmp_dir)
@@ -21,6 +21,10 @@ import mathutils
 import array
 import random
 
+import numpy
+
+from cellblender import mol_viz_data
+
 import os
 import json
 
@@ -143,90 +147,13 @@ mol_orient = [random.uniform(-1.0, 1.0) for i in range(len(mol_pos))]
 ############## Traditional Molecule Display (disable when using CellBlender's internal display) ############
 
 
-dup_check = False
 try:
 
-    # Quick check for Binary or ASCII format of molecule file:
-    mol_file = open(filepath, "rb")
-    b = array.array("I")
-    b.fromfile(mol_file, 1)
-
-    mol_dict = {}
-
-    if b[0] == 1:
-        # Read MCell/CellBlender Binary Format molecule file, version 1:
-        bin_data = 1
-        while True:
-            try:
-                # ni = Initially, byte array of molecule name length.
-                # Later, array of number of molecule positions in xyz
-                # (essentially, the number of molecules multiplied by 3).
-                # ns = Array of ascii character codes for molecule name.
-                # s = String of molecule name.
-                # mt = Surface molecule flag.
-                ni = array.array("B")          # Create a binary byte ("B") array
-                ni.fromfile(mol_file, 1)       # Read one byte which is the number of characters in the molecule name
-                ns = array.array("B")          # Create another byte array to hold the molecule name
-                ns.fromfile(mol_file, ni[0])   # Read ni bytes from the file
-                s = ns.tostring().decode()     # Decode bytes as ASCII into a string (s)
-                mol_name = "mol_%s" % (s)      # Construct name of blender molecule viz object
-                mt = array.array("B")          # Create a byte array for the molecule type
-                mt.fromfile(mol_file, 1)       # Read one byte for the molecule type
-                ni = array.array("I")          # Re-use ni as an integer array to hold the number of molecules of this name in this frame
-                ni.fromfile(mol_file, 1)       # Read the 4 byte integer value which is 3 times the number of molecules
-                mol_pos = array.array("f")     # Create a floating point array to hold the positions
-                mol_orient = array.array("f")  # Create a floating point array to hold the orientations
-                mol_pos.fromfile(mol_file, ni[0])  # Read the positions which should be 3 floats per molecule
-                if mt[0] == 1:                                        # If mt==1, it's a surface molecule
-                    mol_orient.fromfile(mol_file, ni[0])              # Read the surface molecule orientations
-                mol_dict[mol_name] = [mt[0], mol_pos, mol_orient]     # Create a dictionary entry for this molecule containing a list of relevant data                    
-                if len(mcell.mol_viz.mol_viz_list) > 0:
-                  for i in range(len(mcell.mol_viz.mol_viz_list)):
-                    if mcell.mol_viz.mol_viz_list[i].name[4:] == mol_name:
-                      dup_check = True      
-                if dup_check == False:
-                  new_item = mcell.mol_viz.mol_viz_list.add()           # Create a new collection item to hold the name for this molecule
-                  new_item.name = mol_name                              # Assign the name to the new item                              
-
-            except EOFError:
-                mol_file.close()
-                break
-
-            except:
-                print( "Unexpected Exception: " + str(sys.exc_info()) )
-                mol_file.close()
-                break
-
-    else:
-        # Read ASCII format molecule file:
-        # print ("Reading ASCII file " + filepath )
-        bin_data = 0
-        mol_file.close()
-        # Create a list of molecule names, positions, and orientations
-        # Each entry in the list is ordered like this (afaik):
-        # [molec_name, [x_pos, y_pos, z_pos, x_orient, y_orient, z_orient]]
-        # Orientations are zero in the case of volume molecules.
-        mol_data = [[s.split()[0], [
-            float(x) for x in s.split()[2:]]] for s in open(
-                filepath, "r").read().split("\n") if s != ""]
-
-        for mol in mol_data:
-            mol_name = "mol_%s" % (mol[0])
-            if not mol_name in mol_dict:
-                mol_orient = mol[1][3:]
-                mt = 0
-                # Check to see if it's a surface molecule
-                if ((mol_orient[0] != 0.0) | (mol_orient[1] != 0.0) |
-                        (mol_orient[2] != 0.0)):
-                    mt = 1
-                mol_dict[mol_name] = [
-                    mt, array.array("f"), array.array("f")]
-                new_item = mcell.mol_viz.mol_viz_list.add()
-                new_item.name = mol_name
-            mt = mol_dict[mol_name][0]
-            mol_dict[mol_name][1].extend(mol[1][:3])
-            if mt == 1:
-                mol_dict[mol_name][2].extend(mol[1][3:])
+    # Decode the file with the same reader used by cellblender_mol_viz.py
+    mol_dict = mol_viz_data.read_mol_viz_file(filepath)
+    for mol_name in mol_dict.keys():
+        new_item = mcell.mol_viz.mol_viz_list.add()           # Create a new collection item to hold the name for this molecule
+        new_item.name = mol_name                              # Assign the name to the new item
 
     # Get the parent object to all the molecule positions if it exists.
     # Otherwise, create it.
@@ -267,7 +194,7 @@ try:
 
             # Randomly orient volume molecules
             if True and (mol_type == 0):
-                mol_orient.extend([random.uniform(-1.0, 1.0) for i in range(len(mol_pos))])
+                mol_orient = numpy.random.uniform(-1.0, 1.0, mol_pos.size).astype(numpy.float32)
 
             # Look-up mesh shape (glyph) template and create if needed
             # This may end up calling a member function of the molecule class to create a new default molecule (including glyph)
@@ -315,9 +242,9 @@ try:
 
             # Add and set values of vertices at positions of molecules
             # This uses vertices.add(), but where are the old vertices removed?
-            mol_pos_mesh.vertices.add(len(mol_pos)//3)
-            mol_pos_mesh.vertices.foreach_set("co", mol_pos)
-            mol_pos_mesh.vertices.foreach_set("normal", mol_orient)
+            mol_pos_mesh.vertices.add(len(mol_pos))
+            mol_pos_mesh.vertices.foreach_set("co", mol_pos.ravel())
+            mol_pos_mesh.vertices.foreach_set("normal", mol_orient.ravel())
 
             # Save the molecule's visibility state, so it can be restored later
             mol_obj = objs.get(mol_name)
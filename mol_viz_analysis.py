@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+
+"""
+Compute per species statistics over the molecule viz frames of seed directories.
+
+Usage:
+
+    python mol_viz_analysis.py [-procs=N] [-bins=B] [-dt=T] [-out=DIR] directory [directory ...]
+    python mol_viz_analysis.py -density=NAME [-frames=F0:F1] [-procs=N] [-bins=B] [-out=DIR] directory [directory ...]
+
+Each directory can either be a seed directory (holding the viz files, or the
+frame pack, of one run, e.g. "viz_data/seed_00001") or a directory of seed
+directories (e.g. "viz_data"). The frames of each seed are streamed through
+the viz decoder in mol_viz_data.py (one frame in memory at a time) and for
+every species and frame this computes:
+
+    count      number of molecules
+    centroid   mean position (x, y, z)
+    rg         radius of gyration about the centroid
+    msd        mean squared displacement from the first frame the species
+               appears in (only for species whose count never changes, since
+               the viz files don't identify molecules and the molecules are
+               matched by their place in the file)
+
+along with a B x B x B occupancy histogram of each species, summed over the
+frames (default B = 32, rounded up to an even number). The frames are only
+read once, so the histogram's box starts out around the species' first
+frame and doubles along an axis whenever a molecule falls outside of it
+(merging pairs of bins). It covers all of the molecules, but may be up to
+twice as wide as their bounding box along each axis.
+
+The results of a seed are written to DIR/<seed> (default: "viz_analysis"
+next to the directory holding the seed directories): "analysis.npz" holds
+all of the arrays and each time series is also written as a two column
+(time, value) text file, such as "a.msd.dat" for species a, which the
+plotters in data_plotters can plot like reaction data. Times are frame
+numbers multiplied by T (default 1, so plain frame numbers).
+
+With -density the molecules of species NAME are instead accumulated over all
+of the seeds (and the frames F0 through F1, counted from 0, of each seed) in
+a B x B x B grid over their bounding box (default B = 64). Only one frame
+and one grid per process are held in memory, whatever the number of seeds.
+The mean number of molecules per voxel and frame is written to
+DIR/density_NAME.npz, and scaled to [0, 1] in DIR/density_NAME.bvox
+(Blender voxel data) which can be shown as a volume in Blender.
+
+The seed directories are processed in parallel by N processes (default: the
+number of CPUs).
+"""
+
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mol_viz_cache
+import mol_viz_data
+
+
+def find_seed_dirs(path):
+    """ Return the seed directories at (or just below) a path. """
+    if mol_viz_cache.directory_listings.frame_files(path):
+        return [path]
+    seed_dirs = []
+    for name in mol_viz_cache.directory_listings.seed_dirs(path):
+        sub_path = os.path.join(path, name)
+        if mol_viz_cache.directory_listings.frame_files(sub_path):
+            seed_dirs.append(sub_path)
+    return seed_dirs
+
+
+def occupancy_bins(mol_pos, lo, hi, bins):
+    """ Return the flat histogram bin of each molecule in a bins**3 grid over [lo, hi]. """
+    size = (hi - lo) / bins
+    size[size <= 0.0] = 1.0
+    cell = ((mol_pos - lo) / size).astype(numpy.int64)
+    numpy.clip(cell, 0, bins-1, out=cell)
+    return (cell[:, 0] * bins + cell[:, 1]) * bins + cell[:, 2]
+
+
+def grow_histogram(hist, lo, size, pos_lo, pos_hi):
+    """ Double a (bins, bins, bins) histogram's box along each axis until it holds [pos_lo, pos_hi].
+
+    Pairs of bins are merged into one, so the counts stay exact. Returns the
+    new (hist, lo, size).
+    """
+    bins = hist.shape[0]
+    half = bins // 2
+    for axis in range(3):
+        while (pos_lo[axis] < lo[axis]) or (pos_hi[axis] >= lo[axis] + bins * size[axis]):
+            shape = list(hist.shape)
+            shape[axis:axis+1] = [half, 2]
+            merged = hist.reshape(shape).sum(axis=axis+1)
+            padding = [(0, 0)] * 3
+            if pos_lo[axis] < lo[axis]:
+                # Grow downwards: the old box becomes the upper half
+                padding[axis] = (bins - half, 0)
+                lo[axis] -= bins * size[axis]
+            else:
+                padding[axis] = (0, bins - half)
+            hist = numpy.pad(merged, padding, mode="constant")
+            size[axis] *= 2.0
+    return (hist, lo, size)
+
+
+def analyze_frames(filepaths, bins=32):
+    """ Stream over the frames once and return {mol_name: {statistic: array}} (see the module docstring). """
+    num_frames = len(filepaths)
+    bins += bins % 2
+    stats = {}
+    boxes = {}       # mol_name -> [lo, bin size] of the histogram
+    first_pos = {}   # mol_name -> positions in the first frame (None once the count changes)
+
+    for frame, filepath in enumerate(filepaths):
+        for mol_name, mol_data in mol_viz_data.read_mol_viz_file(filepath).items():
+            mol_pos = mol_data[1]
+            if len(mol_pos) == 0:
+                continue
+            mol_pos = mol_pos.astype(numpy.float64)
+            pos_lo = mol_pos.min(axis=0)
+            pos_hi = mol_pos.max(axis=0)
+            if not (mol_name in stats):
+                stats[mol_name] = {
+                    "count": numpy.zeros(num_frames, dtype=numpy.int64),
+                    "centroid": numpy.full((num_frames, 3), numpy.nan),
+                    "rg": numpy.full(num_frames, numpy.nan),
+                    "msd": numpy.full(num_frames, numpy.nan),
+                    "hist": numpy.zeros((bins, bins, bins), dtype=numpy.int64)}
+                # Start with the box of this frame (or a tiny one along flat axes, it grows quickly)
+                size = (pos_hi - pos_lo) / bins
+                size[size <= 0.0] = max(1e-12, 1e-9 * numpy.abs(mol_pos).max())
+                boxes[mol_name] = [pos_lo.copy(), size]
+            mol_stats = stats[mol_name]
+            lo, size = boxes[mol_name]
+            mol_stats["hist"], lo, size = grow_histogram(mol_stats["hist"], lo, size, pos_lo, pos_hi)
+            centroid = mol_pos.mean(axis=0)
+            mol_stats["count"][frame] = len(mol_pos)
+            mol_stats["centroid"][frame] = centroid
+            mol_stats["rg"][frame] = numpy.sqrt(((mol_pos - centroid)**2).sum(axis=1).mean())
+            mol_stats["hist"] += numpy.bincount(
+                occupancy_bins(mol_pos, lo, lo + bins * size, bins), minlength=bins**3).reshape((bins, bins, bins))
+
+            if not (mol_name in first_pos):
+                first_pos[mol_name] = mol_pos
+            ref_pos = first_pos[mol_name]
+            if (ref_pos is not None) and (len(ref_pos) != len(mol_pos)):
+                first_pos[mol_name] = ref_pos = None
+            if ref_pos is not None:
+                mol_stats["msd"][frame] = ((mol_pos - ref_pos)**2).sum(axis=1).mean()
+
+        # Species that were seen before but are missing now have changed count
+        for mol_name in first_pos.keys():
+            if stats[mol_name]["count"][frame] == 0:
+                first_pos[mol_name] = None
+
+    for mol_name, mol_stats in stats.items():
+        if first_pos.get(mol_name) is None:
+            mol_stats["msd"][:] = numpy.nan
+        lo, size = boxes[mol_name]
+        mol_stats["lo"] = lo
+        mol_stats["hi"] = lo + bins * size
+    return stats
+
+
+def write_analysis(out_dir, times, stats):
+    """ Write analysis.npz and the two column time series text files. """
+    os.makedirs(out_dir, exist_ok=True)
+    names = sorted(stats.keys())
+    arrays = {"time": times, "names": numpy.array(names)}
+    for i, mol_name in enumerate(names):
+        for key, values in stats[mol_name].items():
+            arrays["%s_%d" % (key, i)] = values
+    with open(os.path.join(out_dir, "analysis.npz.tmp"), "wb") as f:
+        numpy.savez_compressed(f, **arrays)
+    os.replace(os.path.join(out_dir, "analysis.npz.tmp"), os.path.join(out_dir, "analysis.npz"))
+
+    for mol_name in names:
+        mol_stats = stats[mol_name]
+        series = [("count", mol_stats["count"]), ("rg", mol_stats["rg"]), ("msd", mol_stats["msd"])]
+        for axis, axis_name in enumerate("xyz"):
+            series.append(("centroid_" + axis_name, mol_stats["centroid"][:, axis]))
+        for key, values in series:
+            keep = numpy.isfinite(values)
+            if not keep.any():
+                continue
+            numpy.savetxt(os.path.join(out_dir, "%s.%s.dat" % (mol_name[4:], key)),
+                          numpy.column_stack((times[keep], values[keep])), fmt="%.15g")
+
+
+def analyze_seed_dir(arglist):
+    """ Analyze one seed directory. """
+
+    seed_dir, out_dir, bins, dt = arglist
+    frame_files = mol_viz_cache.directory_listings.frame_files(seed_dir)
+    filepaths = [os.path.join(seed_dir, name) for name in frame_files.values()]
+    numbers = numpy.array(list(frame_files.keys()), dtype=numpy.float64)
+    if (numbers < 0).any():
+        # Some files have no frame number, so fall back to their place in the list
+        numbers = numpy.arange(len(filepaths), dtype=numpy.float64)
+    try:
+        stats = analyze_frames(filepaths, bins)
+        write_analysis(out_dir, numbers * dt, stats)
+    except (IOError, OSError, ValueError) as e:
+        return "Unable to analyze %s: %s" % (seed_dir, str(e))
+    return "Analyzed %d frames of %d species from %s into %s" % (len(filepaths), len(stats), seed_dir, out_dir)
+
+
+def seed_frame_paths(seed_dir, frames=None):
+    """ Return the paths of the frames of a seed in frame order (frames is a (first, last) window). """
+    names = list(mol_viz_cache.directory_listings.frame_files(seed_dir).values())
+    if frames is not None:
+        names = names[frames[0]:frames[1]+1]
+    return [os.path.join(seed_dir, name) for name in names]
+
+
+def density_bounds(arglist):
+    """ Return [lo, hi] of one species over the frames of a seed (None if it never appears). """
+    seed_dir, mol_name, frames = arglist
+    filepaths = seed_frame_paths(seed_dir, frames)
+    # Reading the other species is skipped (just their headers are looked at)
+    skip = set()
+    bounds = None
+    for filepath in filepaths:
+        for name, mol_data in mol_viz_data.read_mol_viz_file(filepath, skip=skip).items():
+            if name != mol_name:
+                skip.add(name)
+                continue
+            if len(mol_data[1]) == 0:
+                continue
+            lo = mol_data[1].min(axis=0).astype(numpy.float64)
+            hi = mol_data[1].max(axis=0).astype(numpy.float64)
+            if bounds is None:
+                bounds = [lo, hi]
+            else:
+                numpy.minimum(bounds[0], lo, out=bounds[0])
+                numpy.maximum(bounds[1], hi, out=bounds[1])
+    return bounds
+
+
+def density_histogram(arglist):
+    """ Return (histogram, number of frames) of one species over the frames of a seed. """
+    seed_dir, mol_name, frames, lo, hi, bins = arglist
+    filepaths = seed_frame_paths(seed_dir, frames)
+    hist = numpy.zeros(bins**3, dtype=numpy.int64)
+    skip = set()
+    for filepath in filepaths:
+        for name, mol_data in mol_viz_data.read_mol_viz_file(filepath, skip=skip).items():
+            if name != mol_name:
+                skip.add(name)
+            elif len(mol_data[1]) > 0:
+                hist += numpy.bincount(occupancy_bins(mol_data[1].astype(numpy.float64), lo, hi, bins), minlength=bins**3)
+    return (hist, len(filepaths))
+
+
+def write_bvox(filepath, density):
+    """ Write a 3D array (indexed x, y, z) as a single frame Blender voxel data file. """
+    with open(filepath, "wb") as f:
+        numpy.array(list(density.shape) + [1], dtype=numpy.int32).tofile(f)
+        # Blender voxel data runs x fastest
+        numpy.ascontiguousarray(density.transpose(), dtype=numpy.float32).tofile(f)
+
+
+def build_density(pool, seed_dirs, mol_name, frames, bins, out_dir):
+    """ Accumulate the density of one species over all of the seeds and write it. Return a message. """
+    bounds = None
+    for seed_bounds in pool.imap_unordered(density_bounds, [[seed_dir, mol_name, frames] for seed_dir in seed_dirs]):
+        if seed_bounds is None:
+            continue
+        if bounds is None:
+            bounds = seed_bounds
+        else:
+            numpy.minimum(bounds[0], seed_bounds[0], out=bounds[0])
+            numpy.maximum(bounds[1], seed_bounds[1], out=bounds[1])
+    if bounds is None:
+        return "No %s molecules found" % (mol_name)
+    lo, hi = bounds
+
+    hist = numpy.zeros(bins**3, dtype=numpy.int64)
+    num_frames = 0
+    arglists = [[seed_dir, mol_name, frames, lo, hi, bins] for seed_dir in seed_dirs]
+    for seed_hist, seed_frames in pool.imap_unordered(density_histogram, arglists):
+        hist += seed_hist
+        num_frames += seed_frames
+    density = hist.reshape((bins, bins, bins)) / float(max(num_frames, 1))
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, "density_" + mol_name[4:])
+    with open(out_path + ".npz.tmp", "wb") as f:
+        numpy.savez_compressed(f, density=density, lo=lo, hi=hi, seeds=len(seed_dirs), frames=num_frames)
+    os.replace(out_path + ".npz.tmp", out_path + ".npz")
+    peak = density.max()
+    if peak > 0.0:
+        density = density / peak
+    write_bvox(out_path + ".bvox.tmp", density)
+    os.replace(out_path + ".bvox.tmp", out_path + ".bvox")
+    return "Wrote the density of %s over %d frames of %d seeds to %s.bvox" % (mol_name, num_frames, len(seed_dirs), out_path)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    processes = None
+    bins = None
+    dt = 1.0
+    out_top = None
+    density_name = None
+    frames = None
+    paths = []
+    for arg in args:
+        if arg.startswith("-density="):
+            density_name = arg[len("-density="):]
+            if not density_name.startswith("mol_"):
+                density_name = "mol_" + density_name
+        elif arg.startswith("-frames="):
+            try:
+                frames = [int(f) for f in arg[len("-frames="):].split(":")]
+            except ValueError:
+                frames = None
+            if (frames is None) or (len(frames) != 2):
+                print(__doc__)
+                sys.exit(1)
+        elif arg.startswith("-procs="):
+            processes = int(arg[len("-procs="):])
+        elif arg.startswith("-bins="):
+            bins = int(arg[len("-bins="):])
+        elif arg.startswith("-dt="):
+            dt = float(arg[len("-dt="):])
+        elif arg.startswith("-out="):
+            out_top = arg[len("-out="):]
+        else:
+            paths.append(arg)
+
+    if len(paths) == 0:
+        print(__doc__)
+        sys.exit(1)
+
+    seed_dirs = []
+    for path in paths:
+        if not os.path.isdir(path):
+            print("No such directory: %s" % (path))
+            continue
+        seed_dirs.extend([os.path.abspath(seed_dir) for seed_dir in find_seed_dirs(path)])
+    if len(seed_dirs) == 0:
+        print("No viz data found in %s" % (", ".join(paths)))
+        sys.exit(1)
+
+    pool = multiprocessing.Pool(processes=processes)
+    if density_name is not None:
+        if out_top is None:
+            out_top = os.path.join(os.path.dirname(os.path.dirname(seed_dirs[0])), "viz_analysis")
+        print(build_density(pool, seed_dirs, density_name, frames, bins or 64, out_top))
+    else:
+        arglists = []
+        for seed_dir in seed_dirs:
+            top = out_top
+            if top is None:
+                top = os.path.join(os.path.dirname(os.path.dirname(seed_dir)), "viz_analysis")
+            arglists.append([seed_dir, os.path.join(top, os.path.basename(seed_dir)), bins or 32, dt])
+        for message in pool.imap(analyze_seed_dir, arglists):
+            print(message)
+    pool.close()
+    pool.join()
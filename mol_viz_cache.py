@@ -0,0 +1,476 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the caches used by CellBlender's Molecule Visualization.
+
+The FrameCache keeps recently decoded viz frames in memory (up to a fixed
+byte budget) and decodes upcoming frames on a small pool of worker threads
+so that the Blender thread only has to upload the data into meshes.
+
+The SpeciesIndex records where each species lives in every binary viz file
+of a seed directory (in a hidden ".viz_index.json" file next to the viz
+files), so that frames can be read without touching hidden species.
+
+The VoxelIndex keeps a coarse voxel grid of each species of each frame (in
+a hidden ".viz_voxels" directory next to the viz files), so that frames can
+be clipped to a box without looking at every molecule.
+
+The DirectoryListingCache remembers the seed directories, viz files and
+data layout of a project (until the directories change), so that switching
+between seeds and sweep points doesn't rescan directories already seen.
+
+The StateCache is a small LRU for values (such as the seeds of recently
+viewed sweep points) that are reused without touching the filesystem.
+
+Nothing in here depends on Blender.
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+import numpy
+
+try:
+    from . import mol_viz_data
+except (ImportError, SystemError):
+    import mol_viz_data
+
+
+class SpeciesIndex:
+    """ Per seed directory index of the species layout of each viz file. """
+
+    index_file_name = ".viz_index.json"
+    index_version = 1
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.lock = threading.Lock()
+        self.files = {}   # file name -> [size, mtime, species layout or None for ASCII]
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.dirpath, self.index_file_name), "r") as f:
+                index = json.load(f)
+            if index.get("version") == self.index_version:
+                self.files = index["files"]
+        except (IOError, OSError, ValueError, KeyError):
+            self.files = {}
+
+    def save(self):
+        """ Write the index if it changed (quietly giving up on read-only directories). """
+        with self.lock:
+            if not self.dirty:
+                return
+            # Dump a copy, since prefetch threads may add entries while it is written
+            index = {"version": self.index_version, "files": dict(self.files)}
+            self.dirty = False
+        index_path = os.path.join(self.dirpath, self.index_file_name)
+        try:
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(index, f)
+            os.replace(index_path + ".tmp", index_path)
+        except (IOError, OSError) as e:
+            print("Unable to save viz species index %s: %s" % (index_path, str(e)))
+
+    def entry(self, filename):
+        """ Return the species layout of a file, indexing it if it is new or changed. """
+        st = os.stat(os.path.join(self.dirpath, filename))
+        with self.lock:
+            entry = self.files.get(filename)
+        if (entry is not None) and (entry[0] == st.st_size) and (entry[1] == st.st_mtime):
+            return entry[2]
+        species = mol_viz_data.index_mol_viz_file(os.path.join(self.dirpath, filename))
+        with self.lock:
+            self.files[filename] = [st.st_size, st.st_mtime, species]
+            self.dirty = True
+        return species
+
+    def update(self, filenames):
+        """ Bring the index up to date with the files in the directory and save it. """
+        for filename in filenames:
+            self.entry(filename)
+        with self.lock:
+            for filename in set(self.files.keys()).difference(filenames):
+                self.files.pop(filename)
+                self.dirty = True
+        self.save()
+
+
+species_indexes = {}   # absolute directory path -> SpeciesIndex
+species_indexes_lock = threading.Lock()
+
+
+def get_species_index(dirpath):
+    """ Return the (shared) species index for a seed directory. """
+    dirpath = os.path.abspath(dirpath)
+    with species_indexes_lock:
+        index = species_indexes.get(dirpath)
+        if index is None:
+            index = SpeciesIndex(dirpath)
+            species_indexes[dirpath] = index
+    return index
+
+
+class VoxelIndex:
+    """ Per seed directory store of the voxel grids of each viz file. """
+
+    index_dir_name = ".viz_voxels"
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+
+    def grids(self, filepath, mol_dict):
+        """ Return the voxel grids for the species in mol_dict, building any that are missing. """
+        stamp = numpy.array(mol_viz_data.file_stamp(filepath))
+        index_path = os.path.join(self.dirpath, self.index_dir_name, os.path.basename(filepath) + ".npz")
+        grids = self.read(index_path, stamp)
+        missing = [mol_name for mol_name in mol_dict.keys() if not (mol_name in grids)]
+        if missing:
+            for mol_name in missing:
+                grids[mol_name] = mol_viz_data.build_voxel_grid(mol_dict[mol_name][1])
+            self.write(index_path, stamp, grids)
+        return grids
+
+    def read(self, index_path, stamp):
+        grids = {}
+        try:
+            with numpy.load(index_path, allow_pickle=False) as index:
+                if numpy.array_equal(index["stamp"], stamp):
+                    for i, mol_name in enumerate(index["names"]):
+                        grids[str(mol_name)] = tuple([index["%s_%d" % (part, i)] for part in ("lo", "hi", "starts", "order")])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return grids
+
+    def write(self, index_path, stamp, grids):
+        arrays = {"stamp": stamp, "names": numpy.array(list(grids.keys()))}
+        for i, grid in enumerate(grids.values()):
+            for part, values in zip(("lo", "hi", "starts", "order"), grid):
+                arrays["%s_%d" % (part, i)] = values
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path + ".tmp", "wb") as f:
+                numpy.savez(f, **arrays)
+            os.replace(index_path + ".tmp", index_path)
+        except (IOError, OSError) as e:
+            print("Unable to save viz voxel index %s: %s" % (index_path, str(e)))
+
+
+voxel_indexes = {}   # absolute directory path -> VoxelIndex
+voxel_indexes_lock = threading.Lock()
+
+
+def get_voxel_index(dirpath):
+    """ Return the (shared) voxel index for a seed directory. """
+    dirpath = os.path.abspath(dirpath)
+    with voxel_indexes_lock:
+        index = voxel_indexes.get(dirpath)
+        if index is None:
+            index = VoxelIndex(dirpath)
+            voxel_indexes[dirpath] = index
+    return index
+
+
+class DirectoryListingCache:
+    """ Cache of directory scans, each kept until the directory's mtime changes. """
+
+    # Directories changed this recently are rescanned every time, since a
+    # coarse mtime doesn't change again for files added within the same tick
+    settle_time = 2.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listings = {}   # (kind, absolute path) -> [stamp, value]
+
+    def _cached(self, kind, path, build):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        key = (kind, path)
+        with self.lock:
+            listing = self.listings.get(key)
+        if (listing is not None) and (listing[0] == stamp):
+            return listing[1]
+        value = build(path)
+        if time.time() - st.st_mtime > self.settle_time:
+            with self.lock:
+                self.listings[key] = [stamp, value]
+        return value
+
+    def seed_dirs(self, top_dir):
+        """ Return the sorted names of the (seed) directories in a directory. """
+        def build(path):
+            return sorted([entry.name for entry in os.scandir(path)
+                           if entry.is_dir() and not entry.name.startswith(".")])
+        return self._cached("seed_dirs", top_dir, build)
+
+    def frame_files(self, mol_file_dir):
+        """ Return an OrderedDict of frame number -> viz file name, in frame order.
+
+        When the directory holds a frame pack (see mol_viz_pack.py) its frames
+        are used instead, named "<pack file>/<original file name>".
+        """
+        pack_names = self._cached("packs", mol_file_dir, self._scan_packs)
+        if pack_names:
+            pack_path = os.path.join(mol_file_dir, pack_names[0])
+            try:
+                return self._cached("pack_frames", pack_path, self._scan_pack_frames)
+            except (IOError, OSError, ValueError) as e:
+                print("Unable to read viz pack %s: %s" % (pack_path, str(e)))
+        return self._cached("frame_files", mol_file_dir, self._scan_frame_files)
+
+    def data_layout(self, files_path):
+        """ Return the parsed data_layout.json of a project's files directory. """
+        def build(path):
+            with open(path, "r") as f:
+                return json.load(f)
+        return self._cached("data_layout", os.path.join(files_path, "data_layout.json"), build)
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
+
+    @staticmethod
+    def _scan_packs(path):
+        return sorted([entry.name for entry in os.scandir(path)
+                       if entry.name.endswith(mol_viz_data.PACK_SUFFIX) and entry.is_file()])
+
+    @staticmethod
+    def _scan_pack_frames(path):
+        pack = mol_viz_data.open_pack(path)
+        names = sorted(pack.frames.keys(), key=mol_viz_data.frame_sort_key)
+        pack_name = os.path.basename(path)
+        return frame_file_map([os.path.join(pack_name, name) for name in names])
+
+    @staticmethod
+    def _scan_frame_files(path):
+        names = [entry.name for entry in os.scandir(path)
+                 if entry.is_file() and not (entry.name.startswith(".") or entry.name.endswith(mol_viz_data.PACK_SUFFIX))]
+        names.sort(key=mol_viz_data.frame_sort_key)
+        return frame_file_map(names)
+
+
+def frame_file_map(names):
+    """ Map the frame number of each (sorted) file name to the name. """
+    frame_files = collections.OrderedDict()
+    for position, name in enumerate(names):
+        number = mol_viz_data.frame_number(name)
+        if (number is None) or (number in frame_files):
+            # Unnumbered or clashing names keep their place in the list
+            number = -1 - position
+        frame_files[number] = name
+    return frame_files
+
+
+directory_listings = DirectoryListingCache()
+
+
+class StateCache:
+    """ Small LRU of values that are reused without checking the filesystem.
+
+    The owner decides when the values may be stale and clears the cache.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def load_frame(filepath, skip=frozenset(), clip=None, copy=True):
+    """ Default FrameCache loader: decode a frame without the species in skip.
+
+    With a clip box (xmin, ymin, zmin, xmax, ymax, zmax) only the molecules
+    inside the box are returned, found with the voxel index of the file.
+    """
+    # Frames in a pack have their own species table, so the species index is just for plain files
+    real_path = mol_viz_data.real_file_path(filepath)
+    species = None
+    if skip and (real_path == filepath):
+        species = get_species_index(os.path.dirname(filepath)).entry(os.path.basename(filepath))
+    if clip is None:
+        # Copy out of the memory map so the worker thread does the actual reading
+        return mol_viz_data.read_mol_viz_file(filepath, copy=copy, skip=skip, species=species)
+    mol_dict = mol_viz_data.read_mol_viz_file(filepath, skip=skip, species=species)
+    grids = get_voxel_index(os.path.dirname(real_path)).grids(filepath, mol_dict)
+    # Clipping copies the molecules that are kept
+    return mol_viz_data.clip_mol_dict(mol_dict, clip, grids)
+
+
+class FrameCache:
+    """ LRU cache of decoded viz frames with background prefetching.
+
+    Frames may be decoded without some (hidden) species and clipped to a
+    box. A cached frame is reused as long as everything it left out is still
+    being skipped and the clip box hasn't changed.
+    """
+
+    def __init__(self, max_bytes, num_workers=2, loader=None):
+        if loader is None:
+            loader = load_frame
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        self.frames = collections.OrderedDict()  # filepath -> [stamp, mol_dict, nbytes, skip, clip]
+        self.pending = {}                        # filepath -> (Future, skip, clip)
+        self.total_bytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decode_count = 0
+        self.decode_time = 0.0
+        self.last_decode_time = 0.0
+        self.last_wait_time = 0.0
+
+    def stamp(self, filepath):
+        """ Return a value that changes whenever the file is rewritten. """
+        return mol_viz_data.file_stamp(filepath)
+
+    @staticmethod
+    def covers(decoded_skip, decoded_clip, skip, clip):
+        """ Return True if a frame decoded with (decoded_skip, decoded_clip) can serve (skip, clip). """
+        return decoded_skip.issubset(skip) and (decoded_clip == clip)
+
+    def get(self, filepath, skip=frozenset(), clip=None):
+        """ Return the decoded frame, waiting for (or doing) the decode as needed. """
+        stamp = self.stamp(filepath)
+        with self.lock:
+            entry = self.frames.get(filepath)
+            if (entry is not None) and (entry[0] == stamp) and self.covers(entry[3], entry[4], skip, clip):
+                self.frames.move_to_end(filepath)
+                self.hits += 1
+                self.last_wait_time = 0.0
+                return entry[1]
+            future = None
+            request = self.pending.get(filepath)
+            if (request is not None) and self.covers(request[1], request[2], skip, clip):
+                # The frame is already being decoded, so just wait for it
+                future = request[0]
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        start = time.time()
+        if future is None:
+            mol_dict = self._decode(filepath, stamp, skip, clip)
+        else:
+            mol_dict = future.result()
+        self.last_wait_time = time.time() - start
+        return mol_dict
+
+    def prefetch(self, filepaths, skip=frozenset(), clip=None):
+        """ Decode the listed frames in the background, dropping stale requests. """
+        with self.lock:
+            # Cancel requests that haven't started and are no longer wanted (fast scrubbing)
+            for filepath in list(self.pending.keys()):
+                future, pending_skip, pending_clip = self.pending[filepath]
+                if (not (filepath in filepaths)) or (not self.covers(pending_skip, pending_clip, skip, clip)):
+                    if future.cancel():
+                        self.pending.pop(filepath)
+            for filepath in filepaths:
+                entry = self.frames.get(filepath)
+                if ((entry is not None) and self.covers(entry[3], entry[4], skip, clip)) or (filepath in self.pending):
+                    continue
+                self.pending[filepath] = (self.executor.submit(self._prefetch_worker, filepath, skip, clip), skip, clip)
+
+    def clear(self):
+        with self.lock:
+            for request in self.pending.values():
+                request[0].cancel()
+            self.pending.clear()
+            self.frames.clear()
+            self.total_bytes = 0
+
+    def shutdown(self):
+        """ Drop the cached frames and stop the prefetch threads (without waiting for a decode in progress). """
+        self.clear()
+        self.executor.shutdown(wait=False)
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats_string(self):
+        avg = 0.0
+        if self.decode_count > 0:
+            avg = self.decode_time / self.decode_count
+        return "Cache: %d hits, %d misses, %d frames (%.1f MB), decode %.1f ms (avg %.1f ms)" % (
+            self.hits, self.misses, len(self.frames), self.total_bytes / 1048576.0,
+            1000 * self.last_decode_time, 1000 * avg)
+
+    def _prefetch_worker(self, filepath, skip, clip):
+        try:
+            return self._decode(filepath, self.stamp(filepath), skip, clip)
+        finally:
+            with self.lock:
+                self.pending.pop(filepath, None)
+
+    def _decode(self, filepath, stamp, skip, clip):
+        start = time.time()
+        mol_dict = self.loader(filepath, skip, clip)
+        elapsed = time.time() - start
+        nbytes = mol_viz_data.mol_dict_nbytes(mol_dict)
+        with self.lock:
+            self.decode_count += 1
+            self.decode_time += elapsed
+            self.last_decode_time = elapsed
+            old_entry = self.frames.pop(filepath, None)
+            if old_entry is not None:
+                self.total_bytes -= old_entry[2]
+            self.frames[filepath] = [stamp, mol_dict, nbytes, frozenset(skip), clip]
+            self.total_bytes += nbytes
+            self._evict()
+        return mol_dict
+
+    def _evict(self):
+        # Always keep the most recently added frame, even if it's over budget by itself
+        while (self.total_bytes > self.max_bytes) and (len(self.frames) > 1):
+            filepath, entry = self.frames.popitem(last=False)
+            self.total_bytes -= entry[2]
+            self.evictions += 1
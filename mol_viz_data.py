@@ -0,0 +1,862 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the readers for CellBlender's molecule visualization files.
+
+Nothing in here depends on Blender, so the readers can be called from worker
+threads (see mol_viz_cache.py) or from scripts running outside of Blender.
+
+A frame is returned as an OrderedDict (in file order) of the form:
+
+    { "mol_name": [ mol_type, mol_pos, mol_orient ], ... }
+
+where mol_type is 1 for surface molecules and 0 for volume molecules, and
+mol_pos and mol_orient are float32 NumPy arrays with one x,y,z row per
+molecule. The orientations are empty (shape 0x3) for volume molecules.
+
+Binary files are memory mapped and the arrays returned for them are read-only
+views into the map, so decoding a frame costs one pass over the species
+headers no matter how many molecules are in the file.
+
+The frames of a seed directory can also be packed into a single container
+file (see write_pack and mol_viz_pack.py). A frame inside a pack is named
+by the path of the pack followed by the frame's original file name, as in
+"seed_00001/frames.vizpack/Scene.cellbin.0001.dat", and can be read with
+read_mol_viz_file like any other viz file.
+"""
+
+import collections
+import lzma
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+import numpy
+
+
+EMPTY_ORIENT = numpy.empty((0, 3), dtype=numpy.float32)
+EMPTY_ORIENT.flags.writeable = False
+
+# Amount of ASCII viz text converted at a time
+ASCII_CHUNK_BYTES = 1 << 24
+
+# Number of voxel grid cells along each axis (see build_voxel_grid)
+VOXEL_CELLS = 16
+
+# Frame container files (see write_pack)
+PACK_SUFFIX = ".vizpack"
+PACK_FILE_NAME = "frames" + PACK_SUFFIX
+PACK_MAGIC = b"CBVIZPAK"
+PACK_VERSION = 1
+
+# The frame (iteration) number is the last run of digits in a viz file name
+FRAME_NUMBER_RE = re.compile(r"(\d+)(?=\D*$)")
+
+
+def read_mol_viz_file(filepath, copy=False, skip=None, species=None):
+    """ Read one molecule viz file (binary or ASCII) into a species dictionary.
+
+    The version of the binary format is detected from its first value (see
+    mol_viz_file_version). With copy=True the arrays are copied out of the
+    memory map, which forces the file to be read now rather than when the
+    arrays are first used.
+
+    The molecule names ("mol_...") in skip are left out of the result. The
+    species argument is the file's entry from a species index (see
+    index_mol_viz_file) and lets a binary file be read without walking its
+    species headers.
+    """
+
+    if species is not None:
+        mol_dict = read_indexed_mol_viz_file(filepath, species, skip)
+    else:
+        buf, start, end = frame_buffer(filepath)
+        version = buffer_version(buf, start, end)
+        if version == 1:
+            mol_dict = decode_binary_mol_viz(buf, start+4, end, skip)
+        elif version == 2:
+            mol_dict = dequantize_mol_viz(read_quantized_mol_viz(filepath), skip)
+        else:
+            mol_dict = read_ascii_mol_viz_file(filepath)
+            if skip:
+                for mol_name in skip:
+                    mol_dict.pop(mol_name, None)
+
+    if copy:
+        # Only the arrays that are views of a memory map are read-only
+        for mol_data in mol_dict.values():
+            if not mol_data[1].flags.writeable:
+                mol_data[1] = numpy.array(mol_data[1])
+            if (len(mol_data[2]) > 0) and (not mol_data[2].flags.writeable):
+                mol_data[2] = numpy.array(mol_data[2])
+    return mol_dict
+
+
+def frame_buffer(filepath):
+    """ Return (buffer, start, end) holding the bytes of a viz file or of a frame in a pack. """
+    pack_path = split_pack_path(filepath)
+    if pack_path is not None:
+        return open_pack(pack_path[0]).frame_buffer(pack_path[1])
+    buf = map_file(filepath)
+    if buf is None:
+        return (b"", 0, 0)
+    return (buf, 0, len(buf))
+
+
+def buffer_version(buf, start, end):
+    """ Return the binary format version of the frame at start (0 for ASCII). """
+    if end - start < 4:
+        return 0
+    version = struct.unpack_from("I", buf, start)[0]
+    if version in (1, 2):
+        return version
+    return 0
+
+
+def mol_viz_file_version(filepath):
+    """ Return the binary format version of a viz file (1 or 2), or 0 for ASCII files. """
+    buf, start, end = frame_buffer(filepath)
+    return buffer_version(buf, start, end)
+
+
+def split_pack_path(filepath):
+    """ Return (pack path, frame name) for a frame inside a pack, None for a plain file. """
+    pack_path = os.path.dirname(filepath)
+    if pack_path.endswith(PACK_SUFFIX) and os.path.isfile(pack_path):
+        return (pack_path, os.path.basename(filepath))
+    return None
+
+
+def real_file_path(filepath):
+    """ Return the path of the file holding a frame (the pack for frames inside a pack). """
+    pack_path = split_pack_path(filepath)
+    if pack_path is not None:
+        return pack_path[0]
+    return filepath
+
+
+def file_stamp(filepath):
+    """ Return a value that changes whenever the file holding a frame is rewritten. """
+    st = os.stat(real_file_path(filepath))
+    return (st.st_mtime, st.st_size)
+
+
+def frame_number(filename):
+    """ Return the frame number of a viz file name (None if it has no digits). """
+    match = FRAME_NUMBER_RE.search(filename)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def frame_sort_key(filename):
+    """ Sort key ordering viz file names by frame number, whatever the zero padding. """
+    match = FRAME_NUMBER_RE.search(filename)
+    if match is None:
+        return (filename, -1, filename)
+    return (filename[:match.start()], int(match.group(1)), filename)
+
+
+def map_file(filepath):
+    """ Return a read-only memory map of a whole file (None for an empty file). """
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        # The map stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def decode_binary_mol_viz(buf, offset=4, end=None, skip=None):
+    """ Decode version 1 species records from a buffer without copying them.
+
+    Each species record is laid out as:
+
+        uint8   number of characters in the molecule name
+        char[]  molecule name
+        uint8   molecule type (1 = surface, 0 = volume)
+        uint32  number of position values (3 times the number of molecules)
+        float32 positions (x,y,z for each molecule)
+        float32 orientations (surface molecules only, same count as positions)
+
+    A truncated final record is dropped, as the original reader did.
+    """
+
+    if end is None:
+        end = len(buf)
+    mol_dict = collections.OrderedDict()
+    while offset < end:
+        header = species_header(buf, offset, end)
+        if header is None:
+            break
+        name, mol_type, count, data_offset, next_offset = header
+        offset = next_offset
+        mol_name = "mol_%s" % (name)
+        if skip and (mol_name in skip):
+            continue
+        mol_pos = numpy.frombuffer(buf, dtype=numpy.float32, count=count,
+                                   offset=data_offset).reshape(-1, 3)
+        mol_orient = EMPTY_ORIENT
+        if mol_type == 1:
+            mol_orient = numpy.frombuffer(buf, dtype=numpy.float32, count=count,
+                                          offset=data_offset+(4*count)).reshape(-1, 3)
+        mol_dict[mol_name] = [mol_type, mol_pos, mol_orient]
+    return mol_dict
+
+
+def index_mol_viz_file(filepath):
+    """ Return the species layout of a binary viz file (None for ASCII files).
+
+    The layout is a list (in file order) with one [mol_name, mol_type, count,
+    offset] entry per species, where count is the number of float values in
+    the positions and offset is the byte offset of the first position.
+    """
+    buf = map_file(filepath)
+    if buf is None:
+        return []
+    try:
+        if struct.unpack_from("I", buf, 0)[0] != 1:
+            return None
+        species = []
+        offset = 4
+        end = len(buf)
+        while offset < end:
+            header = species_header(buf, offset, end)
+            if header is None:
+                break
+            name, mol_type, count, data_offset, offset = header
+            species.append(["mol_%s" % (name), mol_type, count, data_offset])
+        return species
+    finally:
+        buf.close()
+
+
+def read_indexed_mol_viz_file(filepath, species, skip=None):
+    """ Read the species of a binary viz file using its index entry.
+
+    Only the requested species are touched, so hidden species cost nothing.
+    """
+    mol_dict = collections.OrderedDict()
+    if not species:
+        return mol_dict
+    buf = map_file(filepath)
+    for mol_name, mol_type, count, data_offset in species:
+        if skip and (mol_name in skip):
+            continue
+        mol_pos = numpy.frombuffer(buf, dtype=numpy.float32, count=count,
+                                   offset=data_offset).reshape(-1, 3)
+        mol_orient = EMPTY_ORIENT
+        if mol_type == 1:
+            mol_orient = numpy.frombuffer(buf, dtype=numpy.float32, count=count,
+                                          offset=data_offset+(4*count)).reshape(-1, 3)
+        mol_dict[mol_name] = [mol_type, mol_pos, mol_orient]
+    return mol_dict
+
+
+def species_header(buf, offset, end):
+    """ Parse one species header at offset.
+
+    Returns (name, mol_type, count, data_offset, next_offset) where count is
+    the number of float values in the positions, or None at a truncated record.
+    """
+    if offset + 1 > end:
+        return None
+    name_len = buf[offset]
+    offset += 1
+    if offset + name_len + 5 > end:
+        return None
+    name = bytes(buf[offset:offset+name_len]).decode()
+    offset += name_len
+    mol_type = buf[offset]
+    offset += 1
+    count = struct.unpack_from("I", buf, offset)[0]
+    offset += 4
+    next_offset = offset + (4 * count)
+    if mol_type == 1:
+        next_offset += 4 * count
+    if next_offset > end:
+        return None
+    return (name, mol_type, count, offset, next_offset)
+
+
+V2_COMPRESSION = collections.OrderedDict([("none", 0), ("zlib", 1), ("lzma", 2)])
+V2_QUANT_MAX = 65535
+V2_ORIENT_SCALE = 32767.0
+
+
+def quantize_species(mol_type, mol_pos, mol_orient, reference=None):
+    """ Quantize one species for a version 2 frame.
+
+    Positions become 16 bit steps across the species' bounding box and
+    orientations become 16 bit fractions. When the reference (the quantized
+    species from the frame this one is delta encoded against) has the same
+    number of molecules and its box holds all of them, its box is used so
+    that only the differences need to be stored.
+
+    Returns [mol_type, delta, lo, hi, q_pos, q_orient] where q_pos holds
+    absolute steps and delta tells if they should be stored as differences.
+    """
+    mol_pos = numpy.asarray(mol_pos, dtype=numpy.float32).reshape(-1, 3)
+    delta = False
+    if len(mol_pos) == 0:
+        lo = numpy.zeros(3, dtype=numpy.float32)
+        hi = numpy.zeros(3, dtype=numpy.float32)
+    else:
+        lo = mol_pos.min(axis=0)
+        hi = mol_pos.max(axis=0)
+        if (reference is not None) and (len(reference[4]) == len(mol_pos)) and \
+                numpy.all(reference[2] <= lo) and numpy.all(hi <= reference[3]):
+            lo = reference[2]
+            hi = reference[3]
+            delta = True
+    step = (hi.astype(numpy.float64) - lo) / V2_QUANT_MAX
+    step[step <= 0.0] = 1.0
+    q_pos = numpy.rint((mol_pos - lo) / step)
+    numpy.clip(q_pos, 0, V2_QUANT_MAX, out=q_pos)
+    q_pos = q_pos.astype(numpy.uint16)
+    q_orient = numpy.zeros((0, 3), dtype=numpy.int16)
+    if mol_type == 1:
+        q_orient = numpy.rint(numpy.clip(mol_orient, -1.0, 1.0) * V2_ORIENT_SCALE).astype(numpy.int16).reshape(-1, 3)
+    return [mol_type, delta, lo, hi, q_pos, q_orient]
+
+
+def encode_v2(mol_dict, compression="zlib", reference=None):
+    """ Encode a species dictionary in the Binary Format, version 2.
+
+    The reference is (frame name, quantized frame) of the frame to delta
+    encode against, which must be in the same directory (or pack) as the
+    new frame. The differences are taken from the reference's quantized
+    values, so errors don't build up along a chain of delta frames.
+
+    Returns (the encoded bytes, the quantized frame), where the quantized
+    frame can be used as the reference for the next frame. The layout is:
+
+        uint32  2
+        uint8   compression (0 = none, 1 = zlib, 2 = lzma)
+        uint8   number of characters in the reference frame name (0 = none)
+        char[]  reference frame name
+        uint32  number of bytes in the block (before compression)
+        block, holding for each species:
+            uint8   number of characters in the molecule name
+            char[]  molecule name
+            uint8   molecule type (1 = surface, 0 = volume)
+            uint8   1 if the positions are differences from the reference
+            uint32  number of molecules
+            float32 lower and upper corners of the bounding box (6 values)
+            uint16  x,y,z position steps (or their differences) per molecule
+            int16   x,y,z orientations (surface molecules only)
+    """
+    quantized = collections.OrderedDict()
+    ref_name = b""
+    ref_frame = {}
+    if reference is not None:
+        ref_name = reference[0].encode()
+        ref_frame = reference[1]
+    block = []
+    for mol_name, (mol_type, mol_pos, mol_orient) in mol_dict.items():
+        q = quantize_species(mol_type, mol_pos, mol_orient, ref_frame.get(mol_name))
+        quantized[mol_name] = q
+        mol_type, delta, lo, hi, q_pos, q_orient = q
+        q_data = q_pos
+        if delta:
+            # Differences wrap around in 16 bits, and are undone the same way
+            q_data = q_pos - ref_frame[mol_name][4]
+        name = mol_name[4:].encode()
+        block.append(struct.pack("B", len(name)) + name + struct.pack("=BBI", mol_type, delta, len(q_pos)))
+        block.append(numpy.concatenate((lo, hi)).astype(numpy.float32).tobytes())
+        block.append(q_data.tobytes())
+        if mol_type == 1:
+            block.append(q_orient.tobytes())
+    block = b"".join(block)
+    block_len = len(block)
+    if compression == "zlib":
+        block = zlib.compress(block, 6)
+    elif compression == "lzma":
+        block = lzma.compress(block)
+    header = struct.pack("=IBB", 2, V2_COMPRESSION[compression], len(ref_name)) + ref_name + struct.pack("=I", block_len)
+    return (header + block, quantized)
+
+
+def decode_v2_quantized(buf, start, end, filepath):
+    """ Decode a version 2 frame into its quantized form (resolving any delta encoding). """
+    marker, compression, ref_len = struct.unpack_from("=IBB", buf, start)
+    offset = start + 6
+    ref_name = bytes(buf[offset:offset+ref_len]).decode()
+    offset += ref_len
+    block_len = struct.unpack_from("=I", buf, offset)[0]
+    offset += 4
+    block = bytes(buf[offset:end])
+    if compression == 1:
+        block = zlib.decompress(block)
+    elif compression == 2:
+        block = lzma.decompress(block)
+    if len(block) != block_len:
+        raise ValueError("Corrupt version 2 viz frame: %s" % (filepath))
+
+    ref_frame = None
+    quantized = collections.OrderedDict()
+    offset = 0
+    while offset < block_len:
+        name_len = block[offset]
+        name = block[offset+1:offset+1+name_len].decode()
+        offset += 1 + name_len
+        mol_type, delta, count = struct.unpack_from("=BBI", block, offset)
+        offset += 6
+        corners = numpy.frombuffer(block, dtype=numpy.float32, count=6, offset=offset)
+        offset += 24
+        q_pos = numpy.frombuffer(block, dtype=numpy.uint16, count=3*count, offset=offset).reshape(-1, 3)
+        offset += 6 * count
+        q_orient = numpy.zeros((0, 3), dtype=numpy.int16)
+        if mol_type == 1:
+            q_orient = numpy.frombuffer(block, dtype=numpy.int16, count=3*count, offset=offset).reshape(-1, 3)
+            offset += 6 * count
+        mol_name = "mol_%s" % (name)
+        if delta:
+            if ref_frame is None:
+                ref_frame = read_quantized_mol_viz(os.path.join(os.path.dirname(filepath), ref_name))
+            q_pos = q_pos + ref_frame[mol_name][4]
+        quantized[mol_name] = [mol_type, delta, corners[:3], corners[3:], q_pos, q_orient]
+    return quantized
+
+
+def dequantize_mol_viz(quantized, skip=None):
+    """ Turn a quantized version 2 frame into a species dictionary. """
+    mol_dict = collections.OrderedDict()
+    for mol_name, (mol_type, delta, lo, hi, q_pos, q_orient) in quantized.items():
+        if skip and (mol_name in skip):
+            continue
+        step = (hi.astype(numpy.float64) - lo) / V2_QUANT_MAX
+        mol_pos = (lo + q_pos * step).astype(numpy.float32)
+        mol_orient = EMPTY_ORIENT
+        if mol_type == 1:
+            mol_orient = (q_orient * numpy.float32(1.0 / V2_ORIENT_SCALE)).astype(numpy.float32)
+        mol_dict[mol_name] = [mol_type, mol_pos, mol_orient]
+    return mol_dict
+
+
+quantized_frames = collections.OrderedDict()   # filepath -> (stamp, quantized frame)
+quantized_frames_lock = threading.Lock()
+QUANTIZED_FRAMES_KEPT = 8
+
+
+def read_quantized_mol_viz(filepath):
+    """ Return the quantized form of a version 2 frame.
+
+    The last few frames are kept, so that stepping through a chain of delta
+    encoded frames only decodes each frame once.
+    """
+    stamp = file_stamp(filepath)
+    with quantized_frames_lock:
+        entry = quantized_frames.get(filepath)
+        if (entry is not None) and (entry[0] == stamp):
+            quantized_frames.move_to_end(filepath)
+            return entry[1]
+    buf, start, end = frame_buffer(filepath)
+    if buffer_version(buf, start, end) != 2:
+        raise ValueError("Not a version 2 viz frame: %s" % (filepath))
+    quantized = decode_v2_quantized(buf, start, end, filepath)
+    with quantized_frames_lock:
+        quantized_frames[filepath] = (stamp, quantized)
+        while len(quantized_frames) > QUANTIZED_FRAMES_KEPT:
+            quantized_frames.popitem(last=False)
+    return quantized
+
+
+def read_ascii_mol_viz_file(filepath, chunk_bytes=ASCII_CHUNK_BYTES):
+    """ Read the species of an ASCII format molecule viz file.
+
+    Each line holds "name id x y z nx ny nz", where the orientation is zero
+    for volume molecules. The file is read in chunks of about chunk_bytes.
+    Each chunk is split once, and its numbers are converted and grouped by
+    species with NumPy, so memory use doesn't depend on the size of the file
+    (beyond the molecules themselves).
+    """
+
+    species = collections.OrderedDict()   # mol_name -> [mol_type, [position blocks], [orientation blocks]]
+
+    with open(filepath, "r") as mol_file:
+        while True:
+            text = mol_file.read(chunk_bytes)
+            if not text:
+                break
+            if not text.endswith("\n"):
+                # Finish the last line of this chunk
+                text += mol_file.readline()
+
+            # Split the whole chunk at once, then drop the ids and pull out the names
+            tokens = text.split()
+            text = None
+            if len(tokens) % 8 != 0:
+                raise ValueError("Expected 8 fields per line in %s" % (filepath))
+            if not tokens:
+                continue
+            del tokens[1::8]
+            names = tokens[0::7]
+            del tokens[0::7]
+
+            data = numpy.fromstring(" ".join(tokens), dtype=numpy.float32, sep=" ")
+            tokens = None
+            if data.size != 6 * len(names):
+                raise ValueError("Invalid numbers in %s" % (filepath))
+            data = data.reshape(-1, 6)
+
+            # Group the rows of this chunk by species (a stable sort keeps the file order within each species)
+            chunk_names, first_rows, codes = numpy.unique(names, return_index=True, return_inverse=True)
+            order = numpy.argsort(codes, kind="mergesort")
+            bounds = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(codes))))
+
+            for i in numpy.argsort(first_rows):
+                rows = data[order[bounds[i]:bounds[i+1]]]
+                mol_name = "mol_%s" % (chunk_names[i])
+                mol_data = species.get(mol_name)
+                if mol_data is None:
+                    mt = 0
+                    # Check to see if it's a surface molecule
+                    if numpy.any(rows[0, 3:] != 0.0):
+                        mt = 1
+                    mol_data = [mt, [], []]
+                    species[mol_name] = mol_data
+                mol_data[1].append(rows[:, :3])
+                if mol_data[0] == 1:
+                    mol_data[2].append(rows[:, 3:])
+
+    mol_dict = collections.OrderedDict()
+    for mol_name, (mt, pos_blocks, orient_blocks) in species.items():
+        mol_pos = numpy.concatenate(pos_blocks)
+        mol_orient = EMPTY_ORIENT
+        if mt == 1:
+            mol_orient = numpy.concatenate(orient_blocks)
+        mol_dict[mol_name] = [mt, mol_pos, mol_orient]
+
+    return mol_dict
+
+
+def display_counts(counts, max_counts, budget=0):
+    """ Return the number of molecules of each species to display.
+
+    Each species is first limited to its own maximum (0 for no limit). If
+    the total is still over the budget (0 for no budget), every species is
+    scaled down by the same factor, so the budget is shared in proportion to
+    the populations. A species with any molecules keeps at least one.
+    """
+    shown = []
+    for count, max_count in zip(counts, max_counts):
+        if (max_count > 0) and (count > max_count):
+            count = max_count
+        shown.append(count)
+    total = sum(shown)
+    if (budget > 0) and (total > budget):
+        scale = budget / float(total)
+        shown = [max(1, int(count * scale)) if count > 0 else 0 for count in shown]
+    return shown
+
+
+def subsample_indices(count, max_count):
+    """ Return the (sorted, int32) indices of max_count out of count molecules.
+
+    Molecules are ranked by a hash of their index, so the same molecules
+    are picked every time (as long as they keep their place in the file)
+    and the choice is spread evenly over the list. The indices aren't
+    cached, since the display budget rescales max_count almost every frame.
+    """
+    if max_count >= count:
+        indices = numpy.arange(count, dtype=numpy.int32)
+    else:
+        h = numpy.arange(count, dtype=numpy.uint64) * numpy.uint64(0x9E3779B97F4A7C15)
+        h ^= h >> numpy.uint64(31)
+        h *= numpy.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> numpy.uint64(29)
+        indices = numpy.sort(numpy.argpartition(h, max_count)[:max_count]).astype(numpy.int32)
+    return indices
+
+
+def subsample_mol_data(mol_pos, mol_orient, max_count):
+    """ Return the positions and orientations of a stable subset of max_count molecules. """
+    if len(mol_pos) <= max_count:
+        return (mol_pos, mol_orient)
+    indices = subsample_indices(len(mol_pos), max_count)
+    if len(mol_orient) > 0:
+        mol_orient = mol_orient[indices]
+    return (mol_pos[indices], mol_orient)
+
+
+def random_orientations(count):
+    """ Return count random orientations (one x,y,z row per molecule, each in [-1, 1]). """
+    return numpy.random.uniform(-1.0, 1.0, (count, 3)).astype(numpy.float32)
+
+
+stable_orientation_tables = {}   # mol_name -> orientations of molecules 0..n-1
+stable_orientations_lock = threading.Lock()
+
+
+def stable_orientations(mol_name, count):
+    """ Return random orientations that stay the same from frame to frame.
+
+    Molecule i of a species always gets the same orientation, so volume
+    molecules don't visibly jitter when a frame changes. The orientations of
+    each species are generated once (and extended when more molecules appear).
+    """
+    with stable_orientations_lock:
+        table = stable_orientation_tables.get(mol_name)
+        if (table is None) or (len(table) < count):
+            more = random_orientations(max(count, 1024) - (0 if table is None else len(table)))
+            if table is not None:
+                more = numpy.concatenate((table, more))
+            more.flags.writeable = False
+            table = more
+            stable_orientation_tables[mol_name] = table
+    return table[:count]
+
+
+def voxel_cell_size(lo, hi, cells):
+    size = (hi - lo) / cells
+    size[size <= 0.0] = 1.0
+    return size
+
+
+def build_voxel_grid(mol_pos, cells=VOXEL_CELLS):
+    """ Sort the molecules of one species into a coarse grid over their bounding box.
+
+    Returns (lo, hi, starts, order) where lo and hi are the corners of the
+    box, order lists the molecule indices sorted by grid cell, and the
+    molecules in cell c are order[starts[c]:starts[c+1]].
+    """
+    if len(mol_pos) == 0:
+        lo = numpy.zeros(3)
+        hi = numpy.zeros(3)
+        cell = numpy.zeros(0, dtype=numpy.int64)
+    else:
+        lo = mol_pos.min(axis=0).astype(numpy.float64)
+        hi = mol_pos.max(axis=0).astype(numpy.float64)
+        ijk = ((mol_pos - lo) / voxel_cell_size(lo, hi, cells)).astype(numpy.int64)
+        numpy.clip(ijk, 0, cells-1, out=ijk)
+        cell = (ijk[:, 0] * cells + ijk[:, 1]) * cells + ijk[:, 2]
+    order = numpy.argsort(cell, kind="mergesort").astype(numpy.int32)
+    starts = numpy.zeros(cells**3 + 1, dtype=numpy.int64)
+    starts[1:] = numpy.cumsum(numpy.bincount(cell, minlength=cells**3))
+    return (lo, hi, starts, order)
+
+
+def clip_indices(mol_pos, box, grid=None):
+    """ Return the (sorted) indices of the molecules inside a box.
+
+    The box is (xmin, ymin, zmin, xmax, ymax, zmax). With a voxel grid (see
+    build_voxel_grid) only the molecules in cells overlapping the box are
+    looked at.
+    """
+    box_lo = numpy.array(box[:3])
+    box_hi = numpy.array(box[3:])
+    candidates = None
+    if grid is not None:
+        lo, hi, starts, order = grid
+        if len(order) == 0 or numpy.any(box_hi < lo) or numpy.any(box_lo > hi):
+            return numpy.zeros(0, dtype=numpy.int64)
+        cells = int(round((len(starts) - 1) ** (1.0 / 3)))
+        size = voxel_cell_size(lo, hi, cells)
+        i0 = numpy.clip(numpy.floor((box_lo - lo) / size), 0, cells-1).astype(numpy.int64)
+        i1 = numpy.clip(numpy.floor((box_hi - lo) / size), 0, cells-1).astype(numpy.int64)
+        i, j, k = numpy.meshgrid(numpy.arange(i0[0], i1[0]+1), numpy.arange(i0[1], i1[1]+1),
+                                 numpy.arange(i0[2], i1[2]+1), indexing="ij")
+        overlap = ((i * cells + j) * cells + k).ravel()
+        candidates = numpy.concatenate([order[starts[c]:starts[c+1]] for c in overlap])
+        candidates.sort()
+        mol_pos = mol_pos[candidates]
+    inside = numpy.all((mol_pos >= box_lo) & (mol_pos <= box_hi), axis=1)
+    if candidates is None:
+        return numpy.nonzero(inside)[0]
+    return candidates[inside]
+
+
+def clip_mol_dict(mol_dict, box, grids=None):
+    """ Return a new species dictionary with only the molecules inside a box.
+
+    The arrays in the result are copies holding just the molecules kept.
+    grids optionally maps molecule names to voxel grids (see build_voxel_grid).
+    """
+    clipped = collections.OrderedDict()
+    for mol_name, (mol_type, mol_pos, mol_orient) in mol_dict.items():
+        grid = None
+        if grids is not None:
+            grid = grids.get(mol_name)
+        indices = clip_indices(mol_pos, box, grid)
+        if len(mol_orient) > 0:
+            mol_orient = mol_orient[indices]
+        clipped[mol_name] = [mol_type, mol_pos[indices], mol_orient]
+    return clipped
+
+
+def binary_mol_viz_size(mol_dict):
+    """ Return the number of bytes write_binary_mol_viz will write for a species dictionary. """
+    nbytes = 4
+    for mol_name, (mol_type, mol_pos, mol_orient) in mol_dict.items():
+        nbytes += 1 + len(mol_name[4:].encode()) + 1 + 4 + (4 * mol_pos.size)
+        if mol_type == 1:
+            nbytes += 4 * mol_pos.size
+    return nbytes
+
+
+def write_binary_mol_viz(f, mol_dict):
+    """ Write a species dictionary to an open file in the Binary Format, version 1. """
+    f.write(struct.pack("I", 1))
+    for mol_name, (mol_type, mol_pos, mol_orient) in mol_dict.items():
+        name = mol_name[4:].encode()
+        f.write(struct.pack("B", len(name)))
+        f.write(name)
+        f.write(struct.pack("=BI", mol_type, mol_pos.size))
+        f.write(numpy.ascontiguousarray(mol_pos, dtype=numpy.float32).tobytes())
+        if mol_type == 1:
+            f.write(numpy.ascontiguousarray(mol_orient, dtype=numpy.float32).tobytes())
+
+
+class PackFile:
+    """ A read-only frame container made by write_pack.
+
+    The file starts with a header holding a species dictionary and a frame
+    table, followed by the frames:
+
+        char[8] "CBVIZPAK"
+        uint32  version
+        uint32  number of species
+        uint32  number of frames
+        for each species:
+            uint8   number of characters in the molecule name
+            char[]  molecule name
+            uint8   molecule type (1 = surface, 0 = volume)
+        for each frame:
+            uint64  byte offset of the frame
+            uint64  number of bytes in the frame
+            uint16  number of characters in the frame (file) name
+            char[]  frame name
+        frames
+
+    Frames are stored in the Binary Format (version 1 or 2), and reading one
+    is a dictionary lookup and a slice of the memory map.
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.stamp = file_stamp(pack_path)
+        self.buf = map_file(pack_path)
+        if (self.buf is None) or (bytes(self.buf[0:8]) != PACK_MAGIC):
+            raise ValueError("Not a viz pack file: %s" % (pack_path))
+        version, num_species, num_frames = struct.unpack_from("=III", self.buf, 8)
+        if version != PACK_VERSION:
+            raise ValueError("Unsupported viz pack version %d in %s" % (version, pack_path))
+        offset = 20
+        self.species = collections.OrderedDict()   # mol_name -> mol_type
+        for i in range(num_species):
+            name_len = self.buf[offset]
+            name = bytes(self.buf[offset+1:offset+1+name_len]).decode()
+            self.species["mol_%s" % (name)] = self.buf[offset+1+name_len]
+            offset += name_len + 2
+        self.frames = collections.OrderedDict()    # frame name -> (offset, number of bytes)
+        for i in range(num_frames):
+            frame_offset, frame_len, name_len = struct.unpack_from("=QQH", self.buf, offset)
+            offset += struct.calcsize("=QQH")
+            self.frames[bytes(self.buf[offset:offset+name_len]).decode()] = (frame_offset, frame_len)
+            offset += name_len
+
+    def frame_buffer(self, frame_name):
+        """ Return (buffer, start, end) for one frame. """
+        frame_offset, frame_len = self.frames[frame_name]
+        return (self.buf, frame_offset, frame_offset+frame_len)
+
+
+open_packs = {}                    # pack path -> PackFile
+open_packs_lock = threading.Lock()
+
+
+def open_pack(pack_path):
+    """ Return the PackFile for a pack, (re)opening it if it is new or has been rewritten. """
+    with open_packs_lock:
+        pack = open_packs.get(pack_path)
+        if (pack is None) or (pack.stamp != file_stamp(pack_path)):
+            pack = PackFile(pack_path)
+            open_packs[pack_path] = pack
+        return pack
+
+
+def mol_viz_file_species(filepath):
+    """ Return the [mol_name, mol_type] of each species in a viz file. """
+    if mol_viz_file_version(filepath) == 1:
+        return [[mol_name, mol_type] for mol_name, mol_type, count, data_offset in index_mol_viz_file(filepath)]
+    return [[mol_name, mol_data[0]] for mol_name, mol_data in read_mol_viz_file(filepath).items()]
+
+
+def write_pack(pack_path, filepaths, version=1, compression="zlib", keyframe_interval=10):
+    """ Pack viz files (binary or ASCII) into one container file.
+
+    The frames keep the base names of their files. With version=1 binary
+    files are copied as they are and other files are converted to version 1.
+    With version=2 every frame is encoded in version 2 (see encode_v2) and
+    all frames but every keyframe_interval'th one are delta encoded against
+    the frame before them.
+    """
+
+    # The header holds the species of all the frames, so find them first
+    species = collections.OrderedDict()
+    for filepath in filepaths:
+        for mol_name, mol_type in mol_viz_file_species(filepath):
+            species.setdefault(mol_name, mol_type)
+    frame_names = [os.path.basename(filepath).encode() for filepath in filepaths]
+
+    header = [PACK_MAGIC, struct.pack("=III", PACK_VERSION, len(species), len(frame_names))]
+    for mol_name, mol_type in species.items():
+        name = mol_name[4:].encode()
+        header.append(struct.pack("B", len(name)) + name + struct.pack("B", mol_type))
+    header_len = sum([len(h) for h in header]) + sum([struct.calcsize("=QQH") + len(n) for n in frame_names])
+
+    # The partial pack is hidden (a leading ".") so frame scans never take it for a frame
+    tmp_path = os.path.join(os.path.dirname(pack_path), "." + os.path.basename(pack_path) + ".tmp")
+    with open(tmp_path, "wb") as f:
+        # Write the frames after space for the header, then go back and fill in the frame table
+        f.write(bytes(header_len))
+        reference = None
+        for i, filepath in enumerate(filepaths):
+            frame_offset = f.tell()
+            if version == 2:
+                if (keyframe_interval <= 1) or (i % keyframe_interval == 0):
+                    reference = None
+                frame, quantized = encode_v2(read_mol_viz_file(filepath), compression, reference)
+                f.write(frame)
+                reference = (os.path.basename(filepath), quantized)
+            elif mol_viz_file_version(filepath) == 1:
+                with open(filepath, "rb") as mol_file:
+                    while True:
+                        block = mol_file.read(ASCII_CHUNK_BYTES)
+                        if not block:
+                            break
+                        f.write(block)
+            else:
+                write_binary_mol_viz(f, read_mol_viz_file(filepath))
+            header.append(struct.pack("=QQH", frame_offset, f.tell()-frame_offset, len(frame_names[i])) + frame_names[i])
+        f.seek(0)
+        f.write(b"".join(header))
+    os.replace(tmp_path, pack_path)
+
+
+def mol_dict_nbytes(mol_dict):
+    """ Return the number of bytes held by the arrays of a species dictionary. """
+    nbytes = 0
+    for mol_type, mol_pos, mol_orient in mol_dict.values():
+        nbytes += mol_pos.nbytes + mol_orient.nbytes
+    return nbytes
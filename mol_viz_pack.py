@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Pack the molecule viz files of seed directories into one container per seed.
+
+Usage:
+
+    python mol_viz_pack.py [-remove] [-procs=N] [-v2] [-lzma] [-keyframe=K] directory [directory ...]
+
+Each directory can either be a seed directory (holding the viz files of one
+run, e.g. "viz_data/seed_00001") or a directory of seed directories (e.g.
+"viz_data"). The frames of each seed are written to "frames.vizpack" in the
+seed directory (see mol_viz_data.write_pack), which CellBlender reads in
+place of the individual files. With -remove the packed files are deleted.
+The seed directories are packed in parallel by N processes (default: the
+number of CPUs).
+
+With -v2 the frames are stored in the quantized and compressed Binary Format,
+version 2 (see mol_viz_data.encode_v2), using zlib (or lzma with -lzma). Every
+K'th frame (default 10) is stored on its own and the frames in between are
+delta encoded against the frame before them (-keyframe=1 turns this off).
+"""
+
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mol_viz_data
+
+
+def viz_file_list(seed_dir):
+    """ Return the paths of the viz files in a seed directory in frame order. """
+    file_list = []
+    for name in os.listdir(seed_dir):
+        filepath = os.path.join(seed_dir, name)
+        if name.startswith(".") or name.endswith(mol_viz_data.PACK_SUFFIX) or not os.path.isfile(filepath):
+            continue
+        file_list.append(filepath)
+    file_list.sort(key=lambda filepath: mol_viz_data.frame_sort_key(os.path.basename(filepath)))
+    return file_list
+
+
+def find_seed_dirs(path):
+    """ Return the seed directories at (or just below) a path. """
+    if viz_file_list(path):
+        return [path]
+    seed_dirs = []
+    for name in sorted(os.listdir(path)):
+        sub_path = os.path.join(path, name)
+        if os.path.isdir(sub_path) and (not name.startswith(".")) and viz_file_list(sub_path):
+            seed_dirs.append(sub_path)
+    return seed_dirs
+
+
+def pack_seed_dir(arglist):
+    """ Pack one seed directory. """
+
+    seed_dir, remove, version, compression, keyframe_interval = arglist
+    file_list = viz_file_list(seed_dir)
+    pack_path = os.path.join(seed_dir, mol_viz_data.PACK_FILE_NAME)
+    try:
+        mol_viz_data.write_pack(pack_path, file_list, version, compression, keyframe_interval)
+    except (IOError, OSError, ValueError) as e:
+        return "Unable to pack %s: %s" % (seed_dir, str(e))
+    if remove:
+        for filepath in file_list:
+            os.remove(filepath)
+    return "Packed %d frames into %s" % (len(file_list), pack_path)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    remove = False
+    processes = None
+    version = 1
+    compression = "zlib"
+    keyframe_interval = 10
+    paths = []
+    for arg in args:
+        if arg == "-remove":
+            remove = True
+        elif arg == "-v2":
+            version = 2
+        elif arg == "-lzma":
+            compression = "lzma"
+        elif arg.startswith("-keyframe="):
+            keyframe_interval = int(arg[len("-keyframe="):])
+        elif arg.startswith("-procs="):
+            processes = int(arg[len("-procs="):])
+        else:
+            paths.append(arg)
+
+    if len(paths) == 0:
+        print(__doc__)
+        sys.exit(1)
+
+    seed_dirs = []
+    for path in paths:
+        seed_dirs.extend(find_seed_dirs(path))
+
+    pool = multiprocessing.Pool(processes=processes)
+    for message in pool.imap(pack_seed_dir, [[seed_dir, remove, version, compression, keyframe_interval] for seed_dir in seed_dirs]):
+        print(message)
+    pool.close()
+    pool.join()
@@ -0,0 +1,182 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the catalog of the output files of a project's runs.
+
+An OutputCatalog indexes every file of every seed directory ("seed_*")
+below an output directory (such as "output_data" of a sweep or the
+"react_data" of an older project) by run path, seed and file name:
+
+    output_data/a_index_0/react_data/seed_00001/b.World.dat
+
+is cataloged as ("a_index_0/react_data", "seed_00001", "b.World.dat").
+
+The catalog is built with one os.scandir pass over the tree. Later refreshes
+only stat the directories already seen and rescan the ones that changed, so
+looking up the files of many outputs at many sweep points doesn't scan any
+directory more than once. File modification times are only read when asked
+for (see OutputCatalog.files) and remembered until they could be stale.
+
+Nothing in here depends on Blender.
+"""
+
+import os
+import threading
+import time
+
+
+SEED_DIR_PREFIX = "seed_"
+
+
+class OutputCatalog:
+    """ Index of (run path, seed, file name) -> path of the seed files below a directory. """
+
+    # Directories changed this recently are rescanned every time, since a
+    # coarse mtime doesn't change again for files added within the same tick
+    settle_time = 2.0
+
+    def __init__(self, top_dir):
+        self.top_dir = os.path.abspath(top_dir)
+        self.lock = threading.Lock()
+        self.dirs = {}    # relative directory path -> [stamp, sub directory names, file names]
+        self.runs = {}    # run path -> {seed name: {file name: mtime or None}}
+
+    def refresh(self):
+        """ Bring the catalog up to date with the directories (rescanning only those that changed). """
+        with self.lock:
+            seen = set()
+            changed = self._refresh_dir("", seen)
+            for rel_path in list(self.dirs.keys()):
+                if rel_path not in seen:
+                    self.dirs.pop(rel_path)
+                    changed = True
+            if changed:
+                self._build_runs()
+
+    def _refresh_dir(self, rel_path, seen):
+        path = os.path.join(self.top_dir, rel_path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return rel_path in self.dirs
+        seen.add(rel_path)
+        stamp = st.st_mtime_ns
+        entry = self.dirs.get(rel_path)
+        changed = False
+        if (entry is None) or (entry[0] != stamp) or (time.time() - st.st_mtime <= self.settle_time):
+            sub_dirs = []
+            file_names = []
+            try:
+                for dir_entry in os.scandir(path):
+                    if dir_entry.name.startswith("."):
+                        continue
+                    if dir_entry.is_dir():
+                        sub_dirs.append(dir_entry.name)
+                    elif dir_entry.is_file():
+                        file_names.append(dir_entry.name)
+            except OSError:
+                pass
+            sub_dirs.sort()
+            file_names.sort()
+            changed = (entry is None) or (entry[1] != sub_dirs) or (entry[2] != file_names)
+            entry = [stamp, sub_dirs, file_names]
+            self.dirs[rel_path] = entry
+        if not os.path.basename(rel_path).startswith(SEED_DIR_PREFIX):
+            # Only the files of seed directories are cataloged, so there's no need to look below them
+            for name in entry[1]:
+                if self._refresh_dir(os.path.join(rel_path, name), seen):
+                    changed = True
+        return changed
+
+    def _build_runs(self):
+        runs = {}
+        for rel_path, entry in self.dirs.items():
+            run_path, seed = os.path.split(rel_path)
+            if not seed.startswith(SEED_DIR_PREFIX):
+                continue
+            old_files = self.runs.get(run_path, {}).get(seed, {})
+            runs.setdefault(run_path, {})[seed] = dict([(name, old_files.get(name)) for name in entry[2]])
+        self.runs = runs
+
+    def run_paths(self):
+        """ Return the sorted run paths (relative to the top directory) that have seed directories. """
+        with self.lock:
+            return sorted(self.runs.keys())
+
+    def seeds(self, run_path=""):
+        """ Return the sorted seed directory names of a run path. """
+        with self.lock:
+            return sorted(self.runs.get(run_path.strip(os.sep), {}).keys())
+
+    def seed_files(self, run_path, seed):
+        """ Return the sorted file names of one seed directory of a run path. """
+        with self.lock:
+            return sorted(self.runs.get(run_path.strip(os.sep), {}).get(seed, {}).keys())
+
+    def files(self, run_path, file_name, newer_than=None):
+        """ Return the sorted paths of a file in every seed of a run path.
+
+        With newer_than (a time in seconds since the epoch) only files modified
+        at or after that time are returned.
+        """
+        run_path = run_path.strip(os.sep)
+        with self.lock:
+            seeds = self.runs.get(run_path, {})
+            paths = []
+            for seed in sorted(seeds.keys()):
+                seed_files = seeds[seed]
+                if file_name not in seed_files:
+                    continue
+                path = os.path.join(self.top_dir, run_path, seed, file_name)
+                if newer_than is not None:
+                    mtime = seed_files[file_name]
+                    if (mtime is None) or (mtime < newer_than):
+                        # Unknown or older (the file may have been rewritten since it was last looked at)
+                        try:
+                            mtime = os.stat(path).st_mtime
+                        except OSError:
+                            continue
+                        seed_files[file_name] = mtime
+                    if mtime < newer_than:
+                        continue
+                paths.append(path)
+            return paths
+
+    def clear(self):
+        with self.lock:
+            self.dirs.clear()
+            self.runs.clear()
+
+
+catalogs = {}   # absolute directory path -> OutputCatalog
+catalogs_lock = threading.Lock()
+
+
+def get_catalog(top_dir, refresh=True):
+    """ Return the (shared) output catalog of a directory, refreshed unless asked not to. """
+    top_dir = os.path.abspath(top_dir)
+    with catalogs_lock:
+        catalog = catalogs.get(top_dir)
+        if catalog is None:
+            catalog = OutputCatalog(top_dir)
+            catalogs[top_dir] = catalog
+    if refresh:
+        catalog.refresh()
+    return catalog
@@ -0,0 +1,392 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the reader for reaction data (react_data) files.
+
+Reaction data files are whitespace separated text with one row per output
+time: the time followed by one or more counts (an optional first line
+starting with "#" names the columns). Each file is parsed once into a
+binary columnar cache file, stored in a hidden ".react_cache" directory
+next to it and named after the file's size and modification time:
+
+    react_data/seed_00001/a.World.dat
+    react_data/seed_00001/.react_cache/a.World.dat.<size>_<mtime>.npy
+
+The cache holds a float64 array with one row per column of the text file,
+so every column is a contiguous array. Later reads memory map the cache
+and return read-only NumPy views into the map, so reading a file again
+(in this process or any other) costs a memory map instead of a text parse.
+If the cache can't be written (say on a read-only directory) the parsed
+array is just kept in memory. Files written with write_react_data get their
+cache at the same time, so they are never parsed at all.
+
+BioNetGen .gdat files (all observables of a run in one file) are read in
+one pass into columns by read_gdat.
+
+The same quantity from many seeds can be summarized per output time (mean,
+standard deviation, standard error and quantiles, see summarize_seeds) and
+written as files the plotters can draw as a mean with a band around it (see
+write_seed_summary).
+
+Curves with many more rows than the pixels they are drawn on can be
+decimated before plotting (see decimate), either by keeping the lowest and
+highest point of each pixel's worth of rows ("minmax", so spikes stay
+visible) or by Largest Triangle Three Buckets ("lttb").
+
+Nothing in here depends on Blender, so plotters and analysis scripts can
+import it as well.
+"""
+
+import collections
+import io
+import os
+import threading
+
+import numpy
+
+
+CACHE_DIR_NAME = ".react_cache"
+CACHE_SUFFIX = ".npy"
+
+
+def parse_react_data(filepath):
+    """ Parse a reaction data text file into a (columns, rows) float64 array. """
+    with open(filepath, "rb") as f:
+        text = f.read()
+    if text.startswith(b"#"):
+        # Drop the header line
+        newline = text.find(b"\n")
+        text = b"" if newline < 0 else text[newline+1:]
+    newline = text.find(b"\n")
+    first_line = text if newline < 0 else text[:newline]
+    num_columns = len(first_line.split())
+    if num_columns == 0:
+        return numpy.empty((2, 0), dtype=numpy.float64)
+    values = numpy.fromstring(text, dtype=numpy.float64, sep=" ")
+    if values.size % num_columns != 0:
+        raise ValueError("Reaction data file %s doesn't have %d values on every line" % (filepath, num_columns))
+    return numpy.ascontiguousarray(values.reshape((-1, num_columns)).transpose())
+
+
+def read_gdat(filepath):
+    """ Read a BioNetGen .gdat file into (column names, (columns, rows) float64 array).
+
+    The first line names the columns ("#" first, then the time column and
+    the observables) and the values may be separated by spaces or commas.
+    """
+    with open(filepath, "rb") as f:
+        header = f.readline()
+        text = f.read()
+    names = header.decode().replace(",", " ").replace("#", " ").split()
+    if len(names) == 0:
+        raise ValueError("Reaction data file %s has no header line" % (filepath))
+    values = numpy.fromstring(text.replace(b",", b" "), dtype=numpy.float64, sep=" ")
+    if values.size % len(names) != 0:
+        raise ValueError("Reaction data file %s doesn't have %d values on every line" % (filepath, len(names)))
+    return (names, numpy.ascontiguousarray(values.reshape((-1, len(names))).transpose()))
+
+
+def format_react_data(columns):
+    """ Return the text of a reaction data file holding (columns, rows) values. """
+    text = io.BytesIO()
+    numpy.savetxt(text, numpy.transpose(columns), fmt="%.15g")
+    return text.getvalue()
+
+
+def write_react_data(filepath, columns, text=None):
+    """ Write a reaction data file (text from format_react_data if given) along with its cache file. """
+    if text is None:
+        text = format_react_data(columns)
+    with open(filepath, "wb") as f:
+        f.write(text)
+    write_cache_file(cache_file_path(filepath, os.stat(filepath)), numpy.ascontiguousarray(columns, dtype=numpy.float64))
+
+
+def cache_file_path(filepath, st):
+    """ Return the path of the cache file for a data file with the given os.stat result. """
+    return os.path.join(os.path.dirname(filepath), CACHE_DIR_NAME,
+                        "%s.%d_%d%s" % (os.path.basename(filepath), st.st_size, st.st_mtime_ns, CACHE_SUFFIX))
+
+
+def write_cache_file(cache_path, columns):
+    """ Write a cache file, removing the caches of older versions of the same data file. """
+    cache_dir, cache_name = os.path.split(cache_path)
+    data_name = cache_name[:cache_name.rfind(".", 0, len(cache_name)-len(CACHE_SUFFIX))]
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + ".tmp", "wb") as f:
+            numpy.save(f, columns)
+        os.replace(cache_path + ".tmp", cache_path)
+        for name in os.listdir(cache_dir):
+            stamp = name[len(data_name)+1:-len(CACHE_SUFFIX)]
+            if (name != cache_name) and name.startswith(data_name + ".") and stamp.replace("_", "", 1).isdigit():
+                os.remove(os.path.join(cache_dir, name))
+        return True
+    except (IOError, OSError) as e:
+        print("Unable to save reaction data cache %s: %s" % (cache_path, str(e)))
+        return False
+
+
+class ReactDataStore:
+    """ In-process store of reaction data files, backed by the on-disk cache.
+
+    Entries are checked against the size and mtime of their data file on
+    every read, so rewritten files are parsed again.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()   # data file path -> [stamp, columns]
+
+    def read(self, filepath):
+        """ Return the columns of a reaction data file as a read-only (columns, rows) array. """
+        filepath = os.path.abspath(filepath)
+        st = os.stat(filepath)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(filepath)
+            if (entry is not None) and (entry[0] == stamp):
+                self.entries.move_to_end(filepath)
+                return entry[1]
+
+        cache_path = cache_file_path(filepath, st)
+        columns = None
+        if os.path.exists(cache_path):
+            try:
+                columns = numpy.load(cache_path, mmap_mode="r")
+            except (IOError, OSError, ValueError):
+                columns = None
+        if columns is None:
+            columns = parse_react_data(filepath)
+            if write_cache_file(cache_path, columns):
+                columns = numpy.load(cache_path, mmap_mode="r")
+            else:
+                columns.flags.writeable = False
+
+        with self.lock:
+            self.entries[filepath] = [stamp, columns]
+            self.entries.move_to_end(filepath)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return columns
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+store = ReactDataStore()
+
+
+def read_react_data(filepath):
+    """ Return the columns of a reaction data file (see ReactDataStore.read). """
+    return store.read(filepath)
+
+
+def read_react_xy(filepath):
+    """ Return (times, counts) of a reaction data file as read-only views (counts is the second column). """
+    columns = store.read(filepath)
+    if len(columns) < 2:
+        raise ValueError("Reaction data file %s has fewer than two columns" % (filepath))
+    return (columns[0], columns[1])
+
+
+SUMMARY_DIR_NAME = "summary"
+SUMMARY_CHUNK_ROWS = 1 << 16
+
+
+def parse_quantiles(text):
+    """ Return the percentiles in a comma or space separated string, checking that they are in [0, 100]. """
+    quantiles = []
+    for field in text.replace(",", " ").split():
+        try:
+            q = float(field)
+        except ValueError:
+            raise ValueError("Quantile \"%s\" is not a number" % (field))
+        if not (0.0 <= q <= 100.0):
+            raise ValueError("Quantile %g is not between 0 and 100" % (q))
+        quantiles.append(q)
+    return quantiles
+
+
+def seed_values_chunk(seed_xy, times, start, stop):
+    """ Return the counts of every seed at times[start:stop] as a (seeds, rows) array (NaN where a seed has no data). """
+    chunk = numpy.full((len(seed_xy), stop-start), numpy.nan)
+    for i, (x, y) in enumerate(seed_xy):
+        n = min(stop, len(x)) - start
+        if (n > 0) and numpy.array_equal(x[start:start+n], times[start:start+n]):
+            # The usual case: the seed was output at the same times (it may have stopped early)
+            chunk[i, :n] = y[start:start+n]
+        elif len(x) > 0:
+            chunk[i] = numpy.interp(times[start:stop], x, y, left=numpy.nan, right=numpy.nan)
+    return chunk
+
+
+def summarize_seeds(filepaths, quantiles=(5, 50, 95), chunk_rows=SUMMARY_CHUNK_ROWS):
+    """ Summarize the same reaction data file over several seeds.
+
+    The seeds are aligned on the times of the longest one (seeds output at
+    other times are interpolated, seeds that stopped early just drop out).
+    Returns an OrderedDict of columns: "time", "n" (number of seeds with
+    data), "mean", "std" (sample standard deviation), "sem" (standard error
+    of the mean) and "q<percent>" for each quantile. The seeds are read a
+    chunk of rows at a time, so memory use doesn't grow with the file length.
+    """
+    seed_xy = [read_react_xy(filepath) for filepath in filepaths]
+    times = max([x for x, y in seed_xy], key=len)
+    num_rows = len(times)
+    summary = collections.OrderedDict()
+    summary["time"] = numpy.array(times)
+    for key in ["n", "mean", "std", "sem"] + ["q%g" % (q) for q in quantiles]:
+        summary[key] = numpy.empty(num_rows)
+
+    for start in range(0, num_rows, chunk_rows):
+        stop = min(start + chunk_rows, num_rows)
+        chunk = seed_values_chunk(seed_xy, times, start, stop)
+        have = ~numpy.isnan(chunk)
+        n = have.sum(axis=0)
+        filled = numpy.where(have, chunk, 0.0)
+        mean = filled.sum(axis=0) / numpy.maximum(n, 1)
+        dev = numpy.where(have, chunk - mean, 0.0)
+        var = (dev*dev).sum(axis=0) / numpy.maximum(n - 1, 1)
+        summary["n"][start:stop] = n
+        summary["mean"][start:stop] = mean
+        summary["std"][start:stop] = numpy.sqrt(var)
+        summary["sem"][start:stop] = numpy.sqrt(var / numpy.maximum(n, 1))
+        if len(quantiles) > 0:
+            # Every row has at least one seed (the one the times came from)
+            values = numpy.nanpercentile(chunk, list(quantiles), axis=0)
+            for q, q_values in zip(quantiles, values):
+                summary["q%g" % (q)][start:stop] = q_values
+    return summary
+
+
+def seed_summary_paths(filepath, out_dir):
+    """ Return the paths of the summary, mean, lower and upper files written for a reaction data file. """
+    name = os.path.basename(filepath)
+    if name.endswith(".dat"):
+        name = name[:-len(".dat")]
+    return [os.path.join(out_dir, "%s.%s.dat" % (name, suffix)) for suffix in ("summary", "mean", "lower", "upper")]
+
+
+def write_seed_summary(filepaths, out_dir, quantiles=(5, 50, 95), band="std"):
+    """ Summarize a reaction data file over seeds and write the results to out_dir.
+
+    Writes "<name>.summary.dat" with every summary column (after a "#"
+    header line) and the two column files "<name>.mean.dat",
+    "<name>.lower.dat" and "<name>.upper.dat" for plotting the mean with a
+    band of one standard deviation ("std"), one standard error ("sem") or
+    the lowest to highest quantile ("quantiles"). Returns the paths of the
+    mean, lower and upper files.
+    """
+    summary = summarize_seeds(filepaths, quantiles)
+    summary_path, mean_path, lower_path, upper_path = seed_summary_paths(filepaths[0], out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with open(summary_path, "wb") as f:
+        f.write(("# " + " ".join(summary.keys()) + "\n").encode())
+        numpy.savetxt(f, numpy.column_stack(list(summary.values())), fmt="%.15g")
+
+    mean = summary["mean"]
+    if band == "quantiles":
+        if len(quantiles) == 0:
+            raise ValueError("A quantile band needs at least one quantile")
+        lower = summary["q%g" % (min(quantiles))]
+        upper = summary["q%g" % (max(quantiles))]
+    else:
+        lower = mean - summary[band]
+        upper = mean + summary[band]
+    for path, values in ((mean_path, mean), (lower_path, lower), (upper_path, upper)):
+        numpy.savetxt(path, numpy.column_stack((summary["time"], values)), fmt="%.15g")
+    return [mean_path, lower_path, upper_path]
+
+
+DECIMATE_METHODS = ("minmax", "lttb")
+
+
+def decimate_minmax(x, y, width, chunk_rows=SUMMARY_CHUNK_ROWS):
+    """ Keep the lowest and highest point of each of width equal buckets of rows (in time order).
+
+    Works a chunk of rows at a time, so memory mapped columns are never
+    copied whole. Curves of at most 2*width rows are returned unchanged.
+    """
+    num_rows = len(y)
+    if (width <= 0) or (num_rows <= 2*width):
+        return (x, y)
+    bucket_rows = -(-num_rows // width)
+    step = bucket_rows * max(1, chunk_rows // bucket_rows)
+    keep = [numpy.array([0, num_rows-1])]   # Always span the full time
+    for start in range(0, num_rows, step):
+        stop = min(num_rows, start + step)
+        full = ((stop - start) // bucket_rows) * bucket_rows
+        if full > 0:
+            buckets = numpy.asarray(y[start:start+full]).reshape((-1, bucket_rows))
+            offsets = numpy.arange(start, start+full, bucket_rows)
+            keep.append(offsets + buckets.argmin(axis=1))
+            keep.append(offsets + buckets.argmax(axis=1))
+        if full < stop - start:
+            tail = numpy.asarray(y[start+full:stop])
+            keep.append(numpy.array([start + full + tail.argmin(), start + full + tail.argmax()]))
+    index = numpy.unique(numpy.concatenate(keep))
+    return (x[index], y[index])
+
+
+def decimate_lttb(x, y, width):
+    """ Pick width points with the Largest Triangle Three Buckets algorithm.
+
+    Only one bucket (and the average of the next one) is looked at per
+    step, so memory mapped columns are never copied whole. Curves of at
+    most width rows are returned unchanged.
+    """
+    num_rows = len(y)
+    if (width < 3) or (num_rows <= width):
+        return (x, y)
+    every = (num_rows - 2) / (width - 2)
+    index = numpy.empty(width, dtype=numpy.int64)
+    index[0] = 0
+    index[-1] = num_rows - 1
+    a = 0
+    for i in range(width - 2):
+        start = int(i * every) + 1
+        stop = int((i + 1) * every) + 1
+        next_stop = min(int((i + 2) * every) + 1, num_rows)
+        if next_stop > stop:
+            avg_x = numpy.mean(x[stop:next_stop])
+            avg_y = numpy.mean(y[stop:next_stop])
+        else:
+            avg_x = x[num_rows-1]
+            avg_y = y[num_rows-1]
+        bucket_x = numpy.asarray(x[start:stop])
+        bucket_y = numpy.asarray(y[start:stop])
+        # Twice the area of the triangle from the last point kept, through each point of this bucket, to the next average
+        area = numpy.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        index[i+1] = a
+    return (x[index], y[index])
+
+
+def decimate(x, y, width, method="minmax"):
+    """ Decimate a curve for drawing width pixels wide (width <= 0 keeps every point). """
+    if method == "lttb":
+        return decimate_lttb(x, y, width)
+    elif method == "minmax":
+        return decimate_minmax(x, y, width)
+    raise ValueError("Unknown decimation method %s (expected one of %s)" % (method, ", ".join(DECIMATE_METHODS)))
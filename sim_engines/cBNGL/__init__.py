@@ -1,8 +1,10 @@
+import concurrent.futures
 import os
 import sys
 import shutil
 
 import cellblender
+from cellblender import react_data_store
 import re
 
 
@@ -62,7 +64,18 @@ def postprocess():
   if not os.path.exists(react_dir):
       os.makedirs(react_dir)
 
-  for run_seed in range(start_seed, end_seed+1):
+  mdl_string = ""
+  if parameter_dictionary['MDLString']['val']:
+    mdl_string = "_MDLString"
+
+  # Read the cBNGL data file (the same for every seed) once into columns and format each observable once
+  names, columns = react_data_store.read_gdat ( os.path.join ( cbngl_react_dir, 'Scene.gdat' ) )
+  outputs = []
+  for col in range(1,len(names)):
+    out_columns = columns[[0,col]]
+    outputs.append ( [ names[col] + mdl_string + ".dat", out_columns, react_data_store.format_react_data(out_columns) ] )
+
+  def write_seed ( run_seed ):
     print ( "  Postprocessing for seed " + str(run_seed) )
 
     seed_dir = "seed_%05d" % run_seed
@@ -74,25 +87,14 @@ def postprocess():
     if not os.path.exists(react_seed_dir):
         os.makedirs(react_seed_dir)
 
-    # Read the cBNGL data file and split into a list of rows where each row is a list of columns
-    cbngl_react_file = open ( os.path.join ( cbngl_react_dir, 'Scene.gdat' ) )
-    all_react_data = cbngl_react_file.read()
-    react_data_all = [ [t.strip() for t in s.split() if len(t.strip()) > 0] for s in all_react_data.split('\n') if len(s) > 0 ]
-    react_data_header = react_data_all[0]
-    react_data_rows = react_data_all[1:]
-
-    for col in range(1,len(react_data_header)):
-      mdl_string = ""
-      if parameter_dictionary['MDLString']['val']:
-        mdl_string = "_MDLString"
-
-      out_file_name = os.path.join ( react_seed_dir, react_data_header[col] + mdl_string + ".dat" )
+    for out_name, out_columns, out_text in outputs:
+      out_file_name = os.path.join ( react_seed_dir, out_name )
       print ( "Writing data to " + out_file_name )
-      f = open(out_file_name,"w")
-      for row in react_data_rows:
-        # print ( "  " + row[0] + " " + row[col-1] )
-        f.write ( row[0] + " " + row[col-1] + '\n' )
-      f.close()
+      react_data_store.write_react_data ( out_file_name, out_columns, out_text )
+
+  # The seeds are independent, so they're written concurrently
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(8, os.cpu_count() or 1))) as executor:
+    list ( executor.map ( write_seed, range(start_seed, end_seed+1) ) )
 
   print ( "Done postrocessing cBNGL Reaction Output" )
 
@@ -1,3 +1,4 @@
+import concurrent.futures
 import os
 import subprocess
 import sys
@@ -5,6 +6,7 @@ import pickle
 import shutil
 
 import cellblender
+from cellblender import react_data_store
 from . import data_model_to_mdl_3r
 
 print ( "Executing MCellR Simulation" )
@@ -60,7 +62,14 @@ def postprocess():
   if not os.path.exists(react_dir):
       os.makedirs(react_dir)
 
-  for run_seed in range(start_seed, end_seed+1):
+  # Read the MCellR data file (the same for every seed) once into columns and format each observable once
+  names, columns = react_data_store.read_gdat ( os.path.join ( mcellr_react_dir, 'Scene.mdlr_total.xml.gdat' ) )
+  outputs = []
+  for col in range(1,len(names)):
+    out_columns = columns[[0,col]]
+    outputs.append ( [ names[col] + ".dat", out_columns, react_data_store.format_react_data(out_columns) ] )
+
+  def write_seed ( run_seed ):
     print ( "  Postprocessing for seed " + str(run_seed) )
 
     seed_dir = "seed_%05d" % run_seed
@@ -72,22 +81,14 @@ def postprocess():
     if not os.path.exists(react_seed_dir):
         os.makedirs(react_seed_dir)
 
-
-    # Read the MCellR data file and split into a list of rows where each row is a list of columns
-    mcellr_react_file = open ( os.path.join ( mcellr_react_dir, 'Scene.mdlr_total.xml.gdat' ) )
-    all_react_data = mcellr_react_file.read()
-    react_data_all = [ [t.strip() for t in s.split(',') if len(t.strip()) > 0] for s in all_react_data.split('\n') if len(s) > 0 ]
-    react_data_header = react_data_all[0]
-    react_data_rows = react_data_all[1:]
-
-    for col in range(1,len(react_data_header)):
-      out_file_name = os.path.join ( react_seed_dir, react_data_header[col] + ".dat" )
+    for out_name, out_columns, out_text in outputs:
+      out_file_name = os.path.join ( react_seed_dir, out_name )
       print ( "    Writing data to " + out_file_name )
-      f = open(out_file_name,"w")
-      for row in react_data_rows:
-#        print ( "  " + row[0] + " " + row[col] )
-        f.write ( row[0] + " " + row[col] + '\n' )
-      f.close()
+      react_data_store.write_react_data ( out_file_name, out_columns, out_text )
+
+  # The seeds are independent, so they're written concurrently
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(8, os.cpu_count() or 1))) as executor:
+    list ( executor.map ( write_seed, range(start_seed, end_seed+1) ) )
 
   print ( "Done Postprocessing MCellR Reaction Output" )
 
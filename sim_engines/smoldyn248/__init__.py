@@ -4,9 +4,10 @@ import os
 import pickle
 import math
 import random
-import array
 import shutil
 
+from cellblender import cellblender_utils
+
 # __import__('code').interact(local={k: v for ns in (globals(), locals()) for k, v in ns.items()})
 
 print ( "Executing Smoldyn Simulation" )
@@ -62,51 +63,8 @@ def postprocess():
 
 
   for run_seed in range(start_seed, end_seed+1):
-    print ( "  Postprocessing for seed " + str(run_seed) )
-    f1 = open ( os.path.join ( smoldyn_files_dir, 'run%d'%run_seed, 'viz_data.txt' ) )
-    f2 = open ( os.path.join ( smoldyn_files_dir, 'run%d'%run_seed, 'viz_data2.txt' ) )
-    f1d = f1.read()
-    f2d = f2.read()
-    f1s = [ l for l in f1d.split('\n') if len(l) > 0 ]
-    f2s = [ l for l in f2d.split('\n') if len(l) > 0 ]
-
-    # Convert each string to a list that includes the molecule name at the end
-    n = min(len(f1s),len(f2s))
-    full_list = []
-    for i in range(n):
-      l = f2s[i].strip().split()
-      l.append ( f1s[i][0:f1s[i].index('(')] )
-      full_list.append ( l )
-
-    first_iteration = int(full_list[0][0])
-    last_iteration = int(full_list[-1][0])
-    iter_list = sorted(set([ int(l[0]) for l in full_list]))
-
-    frame_dict = {}
-    for k in iter_list:
-      frame_dict[k] = {}
-
-    for l in full_list:
-      i = int(l[0])
-      mol = l[-1]
-      if not mol in frame_dict[i]:
-        frame_dict[i][mol] = []
-      frame_dict[i][mol].append ( [ l[3], l[4], l[5] ] )
-
-    # The frame_dict is now organized to use for writing molecule files
-
-    ndigits = 1 + math.log(last_iteration+1,10)
-    file_name_template = "Scene.cellbin.%%0%dd.dat" % ndigits
-
     seed_dir = "seed_%05d" % run_seed
 
-    viz_seed_dir = os.path.join(viz_dir, seed_dir)
-
-    if os.path.exists(viz_seed_dir):
-        shutil.rmtree(viz_seed_dir,ignore_errors=True)
-    if not os.path.exists(viz_seed_dir):
-        os.makedirs(viz_seed_dir)
-
     react_seed_dir = os.path.join(react_dir, seed_dir)
 
     if os.path.exists(react_seed_dir):
@@ -114,41 +72,16 @@ def postprocess():
     if not os.path.exists(react_seed_dir):
         os.makedirs(react_seed_dir)
 
+  # The viz files of all seeds are converted (streaming, one frame at a time) by a pool of processes in a separate Python
+  python_path = cellblender_utils.get_python_path(required_modules=['numpy'])
+  if python_path is None:
+    print ( "Unable to postprocess: no Python with numpy was found" )
+    return
+  convert_cmd = [ python_path, os.path.join(os.path.dirname(os.path.realpath(__file__)), "smoldyn_viz_convert.py"),
+                  smoldyn_files_dir, viz_dir, str(start_seed), str(end_seed) ]
+  print ( "Converting the viz data with: " + " ".join(convert_cmd) )
+  subprocess.call ( convert_cmd )
 
-    for i in iter_list:
-      frame = frame_dict[i]
-
-      # Write the viz data (every iteration for now)
-      viz_file_name = file_name_template % i
-      viz_file_name = os.path.join(viz_seed_dir,viz_file_name)
-      #if (i % print_every) == 0:
-      #  if output_detail > 0: print ( "File = " + viz_file_name )
-      f = open(viz_file_name,"wb")
-      int_array = array.array("I")   # Marker indicating a binary file
-      int_array.fromlist([1])
-      int_array.tofile(f)
-      for mol_name in frame.keys():
-        f.write(bytearray([len(mol_name)]))        # Number of bytes in the name
-        for ni in range(len(mol_name)):
-          f.write(bytearray([ord(mol_name[ni])]))  # Each byte of the name
-        f.write(bytearray([0]))                    # Molecule Type, 1=Surface, 0=Volume?
-
-        # Write out the total number of values for this molecule species
-        int_array = array.array("I")
-        #int_array.fromlist([3*len(m['instances'])])
-        int_array.fromlist([3*len(frame[mol_name])])
-        int_array.tofile(f)
-
-        for mi in frame[mol_name]:
-          x = float(mi[0])
-          y = float(mi[1])
-          z = float(mi[2])
-          mol_pos = array.array("f")
-          mol_pos.fromlist ( [ x, y, z ] )
-          mol_pos.tofile(f)
-      f.close()
-
-    #__import__('code').interact(local={k: v for ns in (globals(), locals()) for k, v in ns.items()})
   print ( "Done postrocessing all Smoldyn runs" )
 
 
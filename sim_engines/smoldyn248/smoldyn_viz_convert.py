@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Convert the molecule listings of Smoldyn runs into CellBlender viz files.
+
+Usage:
+
+    python smoldyn_viz_convert.py [-procs=N] smoldyn_files_dir viz_data_dir first_seed last_seed
+
+For each seed S the run directory "run<S>" in smoldyn_files_dir holds two
+listings with one line per molecule per output iteration, in the same
+order: "viz_data.txt" (lines starting with the species name followed by
+"(") and "viz_data2.txt" (iteration, ..., x, y, z). The two files are read
+in lockstep, one line at a time, and each iteration's frame is written to
+"viz_data_dir/seed_<S>/Scene.cellbin.<iteration>.dat" (Binary Format,
+version 1) as soon as the next iteration starts, so only one frame is ever
+held in memory. The listings are expected in iteration order.
+
+The seeds are converted in parallel by N processes (default: the number of
+CPUs), which report their progress through a shared queue.
+"""
+
+import collections
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import mol_viz_data
+
+
+# Number of frames between progress reports of a seed
+PROGRESS_FRAMES = 100
+
+
+def last_iteration(filepath):
+    """ Return the iteration of the last line of a viz_data2.txt listing (reading just its end). """
+    with open(filepath, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        block = 4096
+        while True:
+            start = max(0, end - block)
+            f.seek(start)
+            lines = [line for line in f.read(end - start).split(b"\n") if line.strip()]
+            if start == 0:
+                break
+            if len(lines) > 1:
+                # The first line may have been cut off, but the last one is whole
+                break
+            block *= 2
+    if len(lines) == 0:
+        return None
+    return int(lines[-1].split()[0])
+
+
+def write_frame(filepath, frame):
+    """ Write one frame ({species name: list of "x y z" strings}) as a binary viz file. """
+    mol_dict = collections.OrderedDict()
+    for mol_name, positions in frame.items():
+        mol_pos = numpy.fromstring(" ".join(positions), dtype=numpy.float32, sep=" ").reshape((-1, 3))
+        mol_dict["mol_" + mol_name] = [0, mol_pos, mol_viz_data.EMPTY_ORIENT]
+    with open(filepath, "wb") as f:
+        mol_viz_data.write_binary_mol_viz(f, mol_dict)
+
+
+def convert_run(arglist):
+    """ Convert the listings of one Smoldyn run into a seed directory of viz files. Return a message. """
+
+    run_dir, viz_seed_dir, progress = arglist
+    names_path = os.path.join(run_dir, "viz_data.txt")
+    values_path = os.path.join(run_dir, "viz_data2.txt")
+    try:
+        last = last_iteration(values_path)
+    except (IOError, OSError, ValueError) as e:
+        return "Unable to convert %s: %s" % (run_dir, str(e))
+    if last is None:
+        return "No molecules listed in %s" % (run_dir)
+
+    if os.path.exists(viz_seed_dir):
+        shutil.rmtree(viz_seed_dir, ignore_errors=True)
+    os.makedirs(viz_seed_dir, exist_ok=True)
+
+    ndigits = 1 + math.log(last+1, 10)
+    file_name_template = "Scene.cellbin.%%0%dd.dat" % ndigits
+
+    num_frames = 0
+    iteration = None
+    frame = collections.OrderedDict()
+    try:
+        with open(names_path, "r") as names_file, open(values_path, "r") as values_file:
+            names = (line for line in names_file if line.strip())
+            values = (line for line in values_file if line.strip())
+            for name_line, value_line in zip(names, values):
+                fields = value_line.split()
+                line_iteration = int(fields[0])
+                if line_iteration != iteration:
+                    if iteration is not None:
+                        write_frame(os.path.join(viz_seed_dir, file_name_template % iteration), frame)
+                        num_frames += 1
+                        if (num_frames % PROGRESS_FRAMES) == 0:
+                            progress.put("%s: iteration %d of %d" % (os.path.basename(viz_seed_dir), iteration, last))
+                    iteration = line_iteration
+                    frame = collections.OrderedDict()
+                mol_name = name_line[0:name_line.index('(')]
+                positions = frame.get(mol_name)
+                if positions is None:
+                    positions = []
+                    frame[mol_name] = positions
+                positions.append(" ".join(fields[3:6]))
+            if iteration is not None:
+                write_frame(os.path.join(viz_seed_dir, file_name_template % iteration), frame)
+                num_frames += 1
+    except (IOError, OSError, ValueError) as e:
+        return "Unable to convert %s: %s" % (run_dir, str(e))
+    return "Converted %d frames of %s into %s" % (num_frames, run_dir, viz_seed_dir)
+
+
+def convert_runs(smoldyn_files_dir, viz_dir, seeds, processes=None):
+    """ Convert the runs of several seeds in parallel, printing their progress. """
+    manager = multiprocessing.Manager()
+    progress = manager.Queue()
+    arglists = [[os.path.join(smoldyn_files_dir, "run%d" % (seed)), os.path.join(viz_dir, "seed_%05d" % (seed)), progress]
+                for seed in seeds]
+    pool = multiprocessing.Pool(processes=processes)
+    results = pool.map_async(convert_run, arglists)
+    while not results.ready():
+        try:
+            print(progress.get(timeout=0.5))
+        except queue.Empty:
+            pass
+    while not progress.empty():
+        print(progress.get())
+    for message in results.get():
+        print(message)
+    pool.close()
+    pool.join()
+    manager.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    processes = None
+    paths = []
+    for arg in args:
+        if arg.startswith("-procs="):
+            processes = int(arg[len("-procs="):])
+        else:
+            paths.append(arg)
+
+    if len(paths) != 4:
+        print(__doc__)
+        sys.exit(1)
+
+    smoldyn_files_dir, viz_dir, first_seed, last_seed = paths
+    convert_runs(smoldyn_files_dir, viz_dir, range(int(first_seed), int(last_seed)+1), processes)
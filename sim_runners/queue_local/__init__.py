@@ -423,6 +423,9 @@ class MCELL_QL_percentage_done_timer(bpy.types.Operator):
                 if task_complete:
                     task_ctr += 1
 
+            # Pick up any new viz frames when following the simulation
+            cellblender.cellblender_mol_viz.follow_mol_viz_files(context, final=(task_len == task_ctr))
+
             # Force a redraw of the OpenGL code
             bpy.context.area.tag_redraw()
 
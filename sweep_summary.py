@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+"""
+Summarize how the reaction outputs of a parameter sweep respond to the swept parameters.
+
+Usage:
+
+    python sweep_summary.py [-procs=N] [-files=F1,F2,...] [-threshold=V] [-out=DIR] [-plot=FILE [-stat=S]] files_dir
+
+files_dir is the directory holding a project's "data_layout.json" (the
+"mcell" directory of the project's files). Every reaction data file of
+every seed of every sweep point (or just the files F1, F2, ... such as
+"a.World.dat") is reduced to these statistics of its counts:
+
+    final        the last value
+    mean         the time average (trapezoidal, over the whole run)
+    peak         the highest value
+    t_threshold  the first time the value reaches V (default: half of the
+                 file's own peak), NaN if it never does
+
+The results are written to DIR (default: "sweep_summary" in files_dir):
+
+    sweep_summary.npz  "table" is a P1 x P2 x ... x seeds x files x stats
+                       array (NaN where a run or file is missing) with one
+                       axis per swept parameter, "parameters" and
+                       "values_<i>" give the parameter names and values,
+                       and "seeds", "files" and "stats" name the other axes
+    sweep_summary.csv  one row per sweep point, seed and file
+
+Projects without a sweep (no data_layout.json) are summarized as a single
+point with no parameters. The (sweep point, seed) runs are summarized in
+parallel by N processes (default: the number of CPUs).
+
+With -plot the statistic S (default: final) of file FILE is then plotted
+against the swept parameters (using matplotlib): the mean over seeds with
+its standard deviation for one parameter, or a heatmap of the mean for two
+(further parameters are held at their first value).
+"""
+
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import output_catalog
+import react_data_store
+
+
+STATS = ("final", "mean", "peak", "t_threshold")
+
+
+def sweep_runs(files_dir):
+    """ Return (parameters, runs) of a project's data layout.
+
+    parameters is a list of (name, values) of the swept parameters and runs
+    a list of (index tuple, react_data run path relative to files_dir), one
+    per sweep point.
+    """
+    layout_path = os.path.join(files_dir, "data_layout.json")
+    if not os.path.exists(layout_path):
+        return ([], [((), "react_data")])
+    with open(layout_path, "r") as f:
+        layout_spec = json.load(f)
+    if layout_spec.get("version", 0) == 2:
+        dir_key, file_type_key, seed_key = ("/DIR", "/FILE_TYPE", "/SEED")
+    else:
+        dir_key, file_type_key, seed_key = ("dir", "file_type", "SEED")
+
+    parameters = []
+    path_parts = []   # directory names, or the index of a swept parameter
+    for level in layout_spec["data_layout"]:
+        if level[0] == dir_key:
+            path_parts.append(level[1][0])
+        elif level[0] == file_type_key:
+            path_parts.append("react_data")
+        elif level[0] == seed_key:
+            pass
+        else:
+            path_parts.append(len(parameters))
+            parameters.append((level[0], level[1]))
+
+    runs = []
+    for index in numpy.ndindex(*[len(values) for name, values in parameters]):
+        parts = []
+        for part in path_parts:
+            if isinstance(part, int):
+                parts.append("%s_index_%d" % (parameters[part][0], index[part]))
+            else:
+                parts.append(part)
+        runs.append((tuple(index), os.path.join(*parts)))
+    return (parameters, runs)
+
+
+def curve_stats(x, y, threshold=None):
+    """ Return [final, mean, peak, t_threshold] of one curve. """
+    if len(y) == 0:
+        return [numpy.nan] * len(STATS)
+    final = y[-1]
+    peak = y.max()
+    if (len(x) > 1) and (x[-1] > x[0]):
+        mean = numpy.sum(numpy.diff(x) * (y[1:] + y[:-1])) / (2.0 * (x[-1] - x[0]))
+    else:
+        mean = y.mean()
+    if threshold is None:
+        threshold = 0.5 * peak
+    reached = numpy.flatnonzero(y >= threshold)
+    t_threshold = x[reached[0]] if len(reached) > 0 else numpy.nan
+    return [float(final), float(mean), float(peak), float(t_threshold)]
+
+
+def summarize_seed(arglist):
+    """ Summarize the files of one seed of one sweep point. Returns (point, seed, {file name: stats}). """
+
+    point, seed, seed_dir, file_names, threshold = arglist
+    results = {}
+    for file_name in file_names:
+        filepath = os.path.join(seed_dir, file_name)
+        if not os.path.exists(filepath):
+            continue
+        try:
+            x, y = react_data_store.read_react_xy(filepath)
+        except (IOError, OSError, ValueError) as e:
+            print("Unable to summarize %s: %s" % (filepath, str(e)))
+            continue
+        results[file_name] = curve_stats(x, y, threshold)
+    return (point, seed, results)
+
+
+def summarize_sweep(pool, files_dir, file_names=None, threshold=None):
+    """ Summarize every seed of every sweep point. Returns (parameters, seeds, file names, table). """
+    parameters, runs = sweep_runs(files_dir)
+    if os.path.exists(os.path.join(files_dir, "data_layout.json")):
+        catalog = output_catalog.get_catalog(os.path.join(files_dir, "output_data"))
+        runs = [(index, os.path.relpath(os.path.join(files_dir, run_path), catalog.top_dir)) for index, run_path in runs]
+    else:
+        catalog = output_catalog.get_catalog(os.path.join(files_dir, "react_data"))
+        runs = [(index, "") for index, run_path in runs]
+
+    seeds = sorted(set([seed for index, run_path in runs for seed in catalog.seeds(run_path)]))
+    if file_names is None:
+        names = set()
+        for index, run_path in runs:
+            for seed in catalog.seeds(run_path):
+                names.update(catalog.seed_files(run_path, seed))
+        file_names = sorted([name for name in names if name.endswith(".dat")])
+
+    shape = [len(values) for name, values in parameters] + [len(seeds), len(file_names), len(STATS)]
+    table = numpy.full(shape, numpy.nan)
+    seed_index = dict([(seed, i) for i, seed in enumerate(seeds)])
+    file_index = dict([(name, i) for i, name in enumerate(file_names)])
+    arglists = []
+    for index, run_path in runs:
+        for seed in catalog.seeds(run_path):
+            arglists.append([index, seed, os.path.join(catalog.top_dir, run_path, seed), file_names, threshold])
+    for point, seed, results in pool.imap_unordered(summarize_seed, arglists, chunksize=8):
+        for file_name, stats in results.items():
+            table[point + (seed_index[seed], file_index[file_name])] = stats
+    return (parameters, seeds, file_names, table)
+
+
+def write_summary(out_dir, parameters, seeds, file_names, table):
+    """ Write sweep_summary.npz and sweep_summary.csv. """
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {"table": table, "parameters": numpy.array([name for name, values in parameters]),
+              "seeds": numpy.array(seeds), "files": numpy.array(file_names), "stats": numpy.array(STATS)}
+    for i, (name, values) in enumerate(parameters):
+        arrays["values_%d" % (i)] = numpy.array(values)
+    npz_path = os.path.join(out_dir, "sweep_summary.npz")
+    with open(npz_path + ".tmp", "wb") as f:
+        numpy.savez_compressed(f, **arrays)
+    os.replace(npz_path + ".tmp", npz_path)
+
+    csv_path = os.path.join(out_dir, "sweep_summary.csv")
+    with open(csv_path + ".tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, values in parameters] + ["seed", "file"] + list(STATS))
+        for index in numpy.ndindex(*table.shape[:-3]):
+            point_values = [parameters[i][1][j] for i, j in enumerate(index)]
+            for s, seed in enumerate(seeds):
+                for n, file_name in enumerate(file_names):
+                    stats = table[index + (s, n)]
+                    if numpy.isnan(stats).all():
+                        continue
+                    writer.writerow(point_values + [seed, file_name] + ["%.15g" % (v) for v in stats])
+    os.replace(csv_path + ".tmp", csv_path)
+
+
+def plot_summary(npz_path, file_name, stat):
+    """ Plot one statistic of one file against the swept parameters. """
+    import matplotlib as mpl
+    mpl.use("TkAgg")
+    import matplotlib.pyplot as plt
+
+    with numpy.load(npz_path) as summary:
+        table = summary["table"]
+        parameters = [str(name) for name in summary["parameters"]]
+        values = [summary["values_%d" % (i)] for i in range(len(parameters))]
+        files = [str(name) for name in summary["files"]]
+        stats = [str(name) for name in summary["stats"]]
+    if file_name not in files:
+        print("No %s in %s" % (file_name, npz_path))
+        return
+    data = table[..., files.index(file_name), stats.index(stat)]   # parameters x seeds
+
+    # Only parameters with more than one value are plotted against, the others are held at their first value
+    axes = [i for i in range(len(parameters)) if len(values[i]) > 1]
+    if len(axes) > 2:
+        print("Holding %s at their first values" % (", ".join([parameters[i] for i in axes[2:]])))
+    take = tuple([slice(None) if i in axes[:2] else 0 for i in range(len(parameters))])
+    data = data[take]
+    axes = axes[:2]
+    counts = numpy.isfinite(data).sum(axis=-1)
+    mean = numpy.where(counts > 0, numpy.nansum(data, axis=-1) / numpy.maximum(counts, 1), numpy.nan)
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    title = "%s %s" % (file_name, stat)
+    if len(axes) == 0:
+        ax.bar([0], [mean])
+        ax.set_xticks([])
+    elif len(axes) == 1:
+        deviation = numpy.sqrt(numpy.nansum((data - mean[..., numpy.newaxis])**2, axis=-1) / numpy.maximum(counts - 1, 1))
+        ax.errorbar(values[axes[0]], mean, yerr=deviation, marker="o", capsize=3)
+        ax.set_xlabel(parameters[axes[0]])
+        ax.set_ylabel(stat)
+    else:
+        image = ax.imshow(mean.transpose(), origin="lower", aspect="auto", interpolation="nearest")
+        ax.set_xticks(range(len(values[axes[0]])))
+        ax.set_xticklabels(["%g" % (v) for v in values[axes[0]]])
+        ax.set_yticks(range(len(values[axes[1]])))
+        ax.set_yticklabels(["%g" % (v) for v in values[axes[1]]])
+        ax.set_xlabel(parameters[axes[0]])
+        ax.set_ylabel(parameters[axes[1]])
+        fig.colorbar(image, ax=ax, label=stat)
+    ax.set_title(title)
+    plt.show()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    processes = None
+    file_names = None
+    threshold = None
+    out_dir = None
+    plot_file = None
+    plot_stat = "final"
+    paths = []
+    for arg in args:
+        if arg.startswith("-files="):
+            file_names = [name for name in arg[len("-files="):].split(",") if name]
+        elif arg.startswith("-threshold="):
+            threshold = float(arg[len("-threshold="):])
+        elif arg.startswith("-procs="):
+            processes = int(arg[len("-procs="):])
+        elif arg.startswith("-out="):
+            out_dir = arg[len("-out="):]
+        elif arg.startswith("-plot="):
+            plot_file = arg[len("-plot="):]
+        elif arg.startswith("-stat="):
+            plot_stat = arg[len("-stat="):]
+        else:
+            paths.append(arg)
+
+    if (len(paths) != 1) or (plot_stat not in STATS):
+        print(__doc__)
+        sys.exit(1)
+
+    files_dir = os.path.abspath(paths[0])
+    if out_dir is None:
+        out_dir = os.path.join(files_dir, "sweep_summary")
+
+    pool = multiprocessing.Pool(processes=processes)
+    parameters, seeds, file_names, table = summarize_sweep(pool, files_dir, file_names, threshold)
+    pool.close()
+    pool.join()
+    write_summary(out_dir, parameters, seeds, file_names, table)
+    print("Summarized %d files of %d seeds at %d sweep points in %s" %
+          (len(file_names), len(seeds), int(numpy.prod(table.shape[:-3])), out_dir))
+
+    if plot_file is not None:
+        plot_summary(os.path.join(out_dir, "sweep_summary.npz"), plot_file, plot_stat)